@@ -0,0 +1,71 @@
+import os, sys, time, tempfile
+from typing import Callable
+
+
+# Settings are read on import, so environment is set before app is imported (values of environment are kept)
+TMP_DIR = tempfile.mkdtemp(prefix="notes-bench-")
+for name, value in {
+    "DB_PATH": f"{TMP_DIR}/db/sqlite.db",
+    "KEYS_PATH": f"{TMP_DIR}/private_keys",
+    "BACKUP_FOLDER": f"{TMP_DIR}/backups",
+    "KEY": "bench-key",
+    "ADMIN_KEY": "bench-admin-key",
+    "EMAIL_ADDRESS": "",
+    "EMAIL_TOKEN": "",
+    "NOTIFY_ENABLED": "0",
+    "ENVELOPE_CONVERTER": "0",
+    "KEYS_POOL_SIZE": "0",
+}.items():
+    os.environ.setdefault(name, value)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = "Str0ngPassw0rd!x"
+
+
+def signup(client, username: str) -> dict:
+    """
+    Sign up and log in user by test client
+    :return: user from db
+    """
+
+    from database.users import get_user
+
+    response = client.post("/users/signup", json={ "username": username, "password": PASSWORD,
+                                                   "repeat_password": PASSWORD, "email": f"{username}@example.com" })
+    assert response.status_code == 200, response.text
+    response = client.post("/users/signin", data={ "username": username, "password": PASSWORD })
+    assert response.status_code == 200, response.text
+
+    return get_user(username)
+
+
+def measure(func: Callable[[], object], count: int) -> list[float]:
+    """
+    Call function count times
+    :return: seconds of every call
+    """
+
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def percentile(times: list[float], p: float) -> float:
+    ordered = sorted(times)
+
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def report(name: str, times: list[float], total: float | None = None) -> None:
+    """
+    Print operations per second and latency percentiles (ms)
+    :param total: wall time of all operations (if they were run in parallel)
+    """
+
+    total = total if total is not None else sum(times)
+    print(f"{name:<44} {len(times) / total:>10.0f} ops/s   p50 {percentile(times, 50) * 1000:8.3f} ms"
+          f"   p99 {percentile(times, 99) * 1000:8.3f} ms")
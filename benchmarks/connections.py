@@ -0,0 +1,65 @@
+"""
+Db connections: DAO calls of note reads from many threads and GET /notes/{id} requests,
+with reused per-thread connections and with new connection for every call (as it was before)
+
+Usage: python -m benchmarks.connections [--threads 8] [--reads 4000] [--requests 1000]
+"""
+
+import argparse, sqlite3, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import signup, measure, report
+
+from fastapi.testclient import TestClient
+
+from main import app
+from database import general
+from database.notes import get_note_by_id, get_aes_key, check_access
+
+
+def new_connection() -> sqlite3.Connection:
+    return sqlite3.connect(general.DB_PATH, timeout=general.DB_BUSY_TIMEOUT / 1000)
+
+
+def use_connections(factory) -> None:
+    # DAO modules import get_connection by name
+    for name, module in list(sys.modules.items()):
+        if name.startswith("database.") and hasattr(module, "get_connection"):
+            module.get_connection = factory
+
+
+def read_note(note_id: int, user_id: int) -> None:
+    check_access(note_id, user_id)
+    get_aes_key(note_id, user_id)
+    get_note_by_id(note_id, user_id)
+
+
+def run(client: TestClient, user: dict, note_id: int, args: argparse.Namespace, mode: str) -> None:
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        start = time.perf_counter()
+        times = list(executor.map(lambda _: measure(lambda: read_note(note_id, user["id"]), 1)[0], range(args.reads)))
+        report(f"DAO reads, {mode}", times, time.perf_counter() - start)
+
+    report(f"GET /notes/{{id}}, {mode}", measure(lambda: client.get(f"/notes/{note_id}"), args.requests))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--reads", type=int, default=4000)
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    with TestClient(app) as client:
+        user = signup(client, "bench")
+        client.post("/notes/create", json={ "header": "Note", "text": "text " * 100, "tags": "tag" })
+        note_id = int(next(iter(client.get("/notes/").json()["notes"])))
+
+        run(client, user, note_id, args, "per-thread connection")
+        use_connections(new_connection)
+        run(client, user, note_id, args, "connection per call")
+        use_connections(general.get_connection)
+
+
+if __name__ == "__main__":
+    main()
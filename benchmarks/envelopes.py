@@ -0,0 +1,88 @@
+"""
+Notes at rest: bytes per note and time of decrypting, for 3 base64 fields with base64 RSA wrap (as before)
+and for binary envelope with raw X25519 wrap
+
+Usage: python -m benchmarks.envelopes [--notes 10000]
+"""
+
+import argparse, base64, os, random, string
+
+from benchmarks.common import measure, report
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import x25519
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from cipher.encrypting import encrypt_aes_key, encrypt_aes_key_x25519, encrypt_envelope
+from cipher.decrypting import symmetric_decrypt_data, decrypt_envelope
+from cipher.generate import new_private_key, generate_aes_key
+
+
+def encrypt_legacy_field(key: bytes, data: str) -> str:
+    """
+    Field in format before envelopes: base64 of iv | tag | AES-GCM ciphertext
+    """
+
+    iv = os.urandom(12)
+    sealed = AESGCM(key).encrypt(iv, data.encode(), None)  # Ciphertext | tag
+
+    return base64.b64encode(iv + sealed[-16:] + sealed[:-16]).decode()
+
+
+def words(count: int) -> str:
+    return " ".join("".join(random.choices(string.ascii_lowercase, k=random.randint(2, 9))) for _ in range(count))
+
+
+def make_notes(count: int) -> list[tuple[str, str, str | None]]:
+    """
+    Short headers, mostly short texts with some long ones, a half of notes without tags
+    """
+
+    random.seed(1)
+    tags = [f"tag{i}" for i in range(30)]
+
+    return [(words(random.randint(1, 6)),
+             words(int(random.lognormvariate(4, 1)) + 1),
+             ", ".join(random.sample(tags, random.randint(1, 3))) if random.random() < 0.5 else None)
+            for _ in range(count)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=10_000)
+    args = parser.parse_args()
+
+    notes = make_notes(args.notes)
+    key = generate_aes_key()
+    rsa_public = new_private_key().public_key().public_bytes(encoding=serialization.Encoding.PEM,
+                                                            format=serialization.PublicFormat.SubjectPublicKeyInfo)
+    x25519_public = x25519.X25519PrivateKey.generate().public_key().public_bytes(
+        encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw)
+
+    legacy = [(encrypt_legacy_field(key, header), encrypt_legacy_field(key, text),
+               encrypt_legacy_field(key, tags) if tags is not None else None) for header, text, tags in notes]
+    envelopes = [encrypt_envelope(key, header, text, tags) for header, text, tags in notes]
+    legacy_wrap = len(base64.b64encode(encrypt_aes_key(rsa_public, key)))
+    envelope_wrap = len(encrypt_aes_key_x25519(x25519_public, key))
+
+    plain = sum(len(header.encode()) + len(text.encode()) + len((tags or "").encode()) for header, text, tags in notes)
+    legacy_bytes = sum(sum(len(field) for field in fields if field is not None) + legacy_wrap for fields in legacy)
+    envelope_bytes = sum(len(body) + envelope_wrap for body in envelopes)
+    print(f"{args.notes} notes, plain fields: {plain / args.notes:.0f} bytes per note")
+    print(f"3 base64 fields + base64 RSA wrap: {legacy_bytes / args.notes:.0f} bytes per note")
+    print(f"envelope + X25519 wrap: {envelope_bytes / args.notes:.0f} bytes per note "
+          f"({100 * (1 - envelope_bytes / legacy_bytes):.0f}% less)")
+
+    def decrypt_legacy(fields: tuple[str, str, str | None]) -> None:
+        for field in fields:
+            if field is not None:
+                symmetric_decrypt_data(key, field)
+
+    report("decrypt note, 3 base64 fields", [time for fields in legacy
+                                             for time in measure(lambda: decrypt_legacy(fields), 1)])
+    report("decrypt note, envelope", [time for body in envelopes
+                                      for time in measure(lambda: decrypt_envelope(key, body), 1)])
+
+
+if __name__ == "__main__":
+    main()
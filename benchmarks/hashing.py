@@ -0,0 +1,68 @@
+"""
+Bcrypt under load: logins per second and latency of note reads, without logins and while logins saturate hashing
+
+Usage: python -m benchmarks.hashing [--hash-workers 0] [--queue 64] [--rounds 10] [--logins 8] [--seconds 10]
+(--hash-workers 0 - bcrypt in auth threads, N - in process pool of N processes)
+"""
+
+import argparse, os, threading, time
+
+from benchmarks.common import PASSWORD, signup, measure, report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hash-workers", type=int, default=0)
+    parser.add_argument("--queue", type=int, default=64, help="max hashing operations in progress or waiting")
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt cost")
+    parser.add_argument("--logins", type=int, default=8, help="threads which log in without pause")
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    os.environ.update({ "HASH_WORKERS": str(args.hash_workers), "HASH_QUEUE_SIZE": str(args.queue),
+                        "BCRYPT_ROUNDS": str(args.rounds) })
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as client:
+        signup(client, "reader")
+        client.post("/notes/create", json={ "header": "Note", "text": "text " * 100, "tags": None })
+        note_id = int(next(iter(client.get("/notes/").json()["notes"])))
+        signup(TestClient(app), "login")
+
+        def read() -> None:
+            assert client.get(f"/notes/{note_id}").status_code == 200
+
+        report("note reads, idle", measure(read, 200))
+
+        stopping = threading.Event()
+        statuses = []
+
+        def log_in() -> None:
+            login_client = TestClient(app)
+            while not stopping.is_set():
+                login_client.cookies.clear()  # Logged user isn't logged in again
+                statuses.append(login_client.post("/users/signin", data={ "username": "login",
+                                                                          "password": PASSWORD }).status_code)
+
+        threads = [threading.Thread(target=log_in) for _ in range(args.logins)]
+        for thread in threads:
+            thread.start()
+
+        reads = []
+        deadline = time.monotonic() + args.seconds
+        while time.monotonic() < deadline:
+            reads += measure(read, 1)
+            time.sleep(0.01)
+
+        stopping.set()
+        for thread in threads:
+            thread.join()
+
+    report(f"note reads, {args.logins} login threads", reads)
+    print(f"logins: {statuses.count(200) / args.seconds:.1f}/s ok, {statuses.count(503) / args.seconds:.1f}/s "
+          f"rejected with 503 (hash workers: {args.hash_workers}, queue: {args.queue}, cost: {args.rounds})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Overhead of metrics: instrumented calls against plain calls, and requests with metrics on or off
+(settings are read on import, so every mode is run by its own process)
+
+Usage: python -m benchmarks.metrics [--metrics 1] [--calls 200000] [--requests 2000]
+"""
+
+import argparse, os, time
+
+
+def per_call(func, count: int) -> float:
+    """
+    :return: nanoseconds per call of count calls in loop
+    """
+
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+
+    return (time.perf_counter() - start) / count * 1e9
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--metrics", choices=["0", "1"], default="1", help="METRICS_ENABLED")
+    parser.add_argument("--calls", type=int, default=200_000, help="calls of empty function in every case")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ["METRICS_ENABLED"] = args.metrics
+    from benchmarks.common import signup, measure, report
+
+    from fastapi.testclient import TestClient
+
+    from main import app
+    from secure.metrics import timed, call_timed, cipher_seconds, task_seconds
+
+    def empty() -> None:
+        pass
+
+    instrumented = timed(cipher_seconds, "bench")(empty)
+    print(f"metrics enabled: {args.metrics}")
+    print(f"plain call: {per_call(empty, args.calls):.0f} ns")
+    print(f"@timed call: {per_call(instrumented, args.calls):.0f} ns")
+    print(f"call_timed call: {per_call(lambda: call_timed(task_seconds, ('bench',), 'crypto', empty)(), args.calls):.0f} ns")
+
+    with TestClient(app) as client:
+        signup(client, "bench")
+        for i in range(10):
+            client.post("/notes/create", json={ "header": f"Note {i}", "text": "text " * 100, "tags": "tag" })
+        note_id = int(next(iter(client.get("/notes/").json()["notes"])))
+
+        report(f"GET /notes/{{id}}, metrics {args.metrics}",
+               measure(lambda: client.get(f"/notes/{note_id}"), args.requests))
+        report(f"GET /notes/ (10 notes), metrics {args.metrics}", measure(lambda: client.get("/notes/"), args.requests))
+
+
+if __name__ == "__main__":
+    main()
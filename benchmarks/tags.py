@@ -0,0 +1,78 @@
+"""
+Filter by tags for user with many notes: note_tags index against LIKE scan of tags column (as before)
+
+Usage: python -m benchmarks.tags [--notes 100000] [--tags 50] [--queries 200]
+"""
+
+import argparse, random, time
+
+from benchmarks.common import measure, report
+
+from database.general import get_connection, init_db
+from database.notes import get_all_notes
+from cipher.indexing import tag_tokens
+
+
+def fill(user_id: int, count: int, tags: list[str]) -> None:
+    """
+    Notes of user with 1-3 random tags (fields aren't encrypted, only page query is measured)
+    """
+
+    random.seed(1)
+    with get_connection() as conn:
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM notes").fetchone()[0]
+        rows, token_rows = [], []
+        for note_id in range(last_id + 1, last_id + count + 1):
+            names = random.sample(tags, random.randint(1, 3))
+            rows.append((note_id, ", ".join(names), user_id))
+            token_rows += [(note_id, token) for token in tag_tokens(user_id, names)]
+
+        conn.executemany("""
+            INSERT INTO notes (id, header, content, tags, aes_key, created_time, from_user_id, indexed)
+            VALUES (?, 'h', 'c', ?, randomblob(16), '00:00:00 01-01-2026', ?, 1)
+        """, rows)
+        conn.executemany("INSERT INTO note_tags (note_id, token) VALUES (?, ?)", token_rows)
+        conn.commit()
+
+
+def like_page(user_id: int, tag: str) -> list:
+    with get_connection() as conn:
+        return conn.execute("SELECT id, created_time FROM notes WHERE from_user_id = ? AND tags LIKE ? "
+                            "ORDER BY id LIMIT 10", (user_id, f"%{tag}%")).fetchall()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=100_000)
+    parser.add_argument("--tags", type=int, default=50, help="different tags of user")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    init_db()
+    with get_connection() as conn:
+        conn.execute("INSERT INTO users (username, password, email, public_key) VALUES ('bench', '', 'b@e.com', '')")
+        user_id = conn.execute("SELECT id FROM users WHERE username = 'bench'").fetchone()[0]
+        conn.commit()
+
+    tags = [f"tag{i}" for i in range(args.tags)]
+    start = time.perf_counter()
+    fill(user_id, args.notes, tags)
+    print(f"{args.notes} notes with tokens are added in {time.perf_counter() - start:.1f} s")
+
+    fields = ["created_time"]
+    cases = {
+        "one tag": lambda: get_all_notes(user_id, 0, 10, ["tag7"], False, None, fields),
+        "two tags, any": lambda: get_all_notes(user_id, 0, 10, ["tag7", "tag8"], False, None, fields),
+        "two tags, all": lambda: get_all_notes(user_id, 0, 10, ["tag7", "tag8"], True, None, fields),
+        "two tags, all, cursor": lambda: get_all_notes(user_id, 0, 10, ["tag7", "tag8"], True,
+                                                       args.notes // 2, fields),
+        "missing tag": lambda: get_all_notes(user_id, 0, 10, ["missing"], False, None, fields),
+        "LIKE, one tag": lambda: like_page(user_id, "tag7,"),
+        "LIKE, missing tag (full scan)": lambda: like_page(user_id, "missing"),
+    }
+    for name, query in cases.items():
+        report(name, measure(query, args.queries))
+
+
+if __name__ == "__main__":
+    main()
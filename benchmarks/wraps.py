@@ -0,0 +1,47 @@
+"""
+Wraps of note keys: generating keys of user, wrapping and unwrapping aes_key by RSA-OAEP (as before) and X25519
+
+Usage: python -m benchmarks.wraps [--count 2000]
+"""
+
+import argparse
+
+from benchmarks.common import measure, report
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import x25519
+
+from cipher.encrypting import encrypt_aes_key, encrypt_aes_key_x25519
+from cipher.decrypting import decrypt_aes_key, decrypt_aes_key_x25519
+from cipher.generate import new_private_key, generate_aes_key
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=2000, help="wraps and unwraps of every scheme")
+    args = parser.parse_args()
+
+    key = generate_aes_key()
+    report("generate key, RSA-2048", measure(new_private_key, max(1, args.count // 100)))
+    report("generate key, X25519", measure(x25519.X25519PrivateKey.generate, args.count))
+
+    rsa_private = new_private_key()
+    rsa_public = rsa_private.public_key().public_bytes(encoding=serialization.Encoding.PEM,
+                                                      format=serialization.PublicFormat.SubjectPublicKeyInfo)
+    x25519_private = x25519.X25519PrivateKey.generate()
+    x25519_public = x25519_private.public_key().public_bytes(encoding=serialization.Encoding.Raw,
+                                                             format=serialization.PublicFormat.Raw)
+
+    rsa_wrap = encrypt_aes_key(rsa_public, key)
+    x25519_wrap = encrypt_aes_key_x25519(x25519_public, key)
+    assert decrypt_aes_key(rsa_private, rsa_wrap) == decrypt_aes_key_x25519(x25519_private, x25519_wrap) == key
+
+    report("wrap, RSA-OAEP", measure(lambda: encrypt_aes_key(rsa_public, key), args.count))
+    report("wrap, X25519", measure(lambda: encrypt_aes_key_x25519(x25519_public, key), args.count))
+    report("unwrap, RSA-OAEP", measure(lambda: decrypt_aes_key(rsa_private, rsa_wrap), args.count))
+    report("unwrap, X25519", measure(lambda: decrypt_aes_key_x25519(x25519_private, x25519_wrap), args.count))
+    print(f"wrap size: RSA-OAEP {len(rsa_wrap)} bytes, X25519 {len(x25519_wrap)} bytes")
+
+
+if __name__ == "__main__":
+    main()
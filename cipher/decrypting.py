@@ -1,16 +1,40 @@
-from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric import padding, rsa, x25519
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
 
-import base64
-from cipher.generate import KEYS_PATH
+import base64, os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 
+from cipher.keystore import keystore, x25519_key_name, legacy_x25519_key_name
+from cipher.encrypting import (SCHEME_X25519, X25519_WRAP_LENGTH, ENVELOPE_VERSION, ENVELOPE_FIELDS,
+                               derive_wrap_key)
+from secure.caching import TTLCache, zeroize
+from secure.metrics import timed, cipher_seconds, cipher_bytes
 
-# Decrypting aes_key by private key
-def decrypt_aes_key(private_pem: bytes, encrypted_aes_key: bytes) -> bytes:
-    private_key = serialization.load_pem_private_key(private_pem, password=None)
 
+load_dotenv()
+
+# Cache of parsed private keys by username
+private_keys_cache = TTLCache(maxsize=int(os.getenv("PKEY_CACHE_SIZE", 1024)),
+                              ttl=float(os.getenv("PKEY_CACHE_TTL", 300)))
+
+# Opt-in cache of unwrapped note keys by (user_id, note_id), disabled when size is 0
+aes_keys_cache = TTLCache(maxsize=int(os.getenv("AES_KEY_CACHE_SIZE", 0)),
+                          ttl=float(os.getenv("AES_KEY_CACHE_TTL", 60)),
+                          on_evict=zeroize if os.getenv("AES_KEY_CACHE_ZEROIZE", "1") == "1" else None)
+
+# Threads for decrypting pages of notes (cryptography releases GIL), 0 - decrypt in request thread
+DECRYPT_WORKERS = int(os.getenv("DECRYPT_WORKERS", os.cpu_count() or 1))
+decrypt_executor = ThreadPoolExecutor(max_workers=DECRYPT_WORKERS,
+                                      thread_name_prefix="decrypt") if DECRYPT_WORKERS > 0 else None
+
+
+# Decrypting aes_key by private key
+@timed(cipher_seconds, "rsa_unwrap")
+def decrypt_aes_key(private_key: rsa.RSAPrivateKey, encrypted_aes_key: bytes) -> bytes:
     # Decrypted data
     decrypted_data = private_key.decrypt(
         encrypted_aes_key,
@@ -24,6 +48,34 @@ def decrypt_aes_key(private_pem: bytes, encrypted_aes_key: bytes) -> bytes:
     return decrypted_data
 
 
+# Decrypting aes_key wrapped by X25519 scheme
+@timed(cipher_seconds, "x25519_unwrap")
+def decrypt_aes_key_x25519(private_key: x25519.X25519PrivateKey, wrapped_key: bytes) -> bytes:
+    tag = wrapped_key[:1]
+    ephemeral_public = wrapped_key[1:33]
+    nonce = wrapped_key[33:45]
+
+    public_raw = private_key.public_key().public_bytes(encoding=serialization.Encoding.Raw,
+                                                       format=serialization.PublicFormat.Raw)
+    shared_key = private_key.exchange(x25519.X25519PublicKey.from_public_bytes(ephemeral_public))
+    wrap_key = derive_wrap_key(shared_key, ephemeral_public, public_raw)
+
+    return AESGCM(wrap_key).decrypt(nonce, wrapped_key[45:], tag)
+
+
+def is_x25519_wrap(wrapped_key: bytes) -> bool:
+    return len(wrapped_key) == X25519_WRAP_LENGTH and wrapped_key[0] == SCHEME_X25519
+
+
+# Decrypting aes_key by user's private key of scheme which was used for wrapping
+def decrypt_wrapped_key(username: str, wrapped_key: bytes) -> bytes:
+    if is_x25519_wrap(wrapped_key):
+        return decrypt_aes_key_x25519(load_x25519_private_key(username), wrapped_key)
+
+    return decrypt_aes_key(load_private_key(username), wrapped_key)
+
+
+@timed(cipher_seconds, "aes_decrypt_field")
 def symmetric_decrypt_data(key: bytes, data: str) -> str:
     data = base64.b64decode(data)
     iv = data[:12]  # First 12 bits with iv
@@ -36,22 +88,151 @@ def symmetric_decrypt_data(key: bytes, data: str) -> str:
         backend=default_backend()
     ).decryptor()
 
+    cipher_bytes.inc("decrypt", value=len(text))
+
     return (decryptor.update(text) + decryptor.finalize()).decode()
 
 
+# Decrypt binary envelope of note to its fields
+@timed(cipher_seconds, "aes_decrypt_envelope")
+def decrypt_envelope(key: bytes, body: bytes) -> dict:
+    version = body[:1]
+    if version[0] != ENVELOPE_VERSION:
+        raise ValueError(f"Unknown version of note envelope: {version[0]}")
+
+    fields = AESGCM(key).decrypt(body[1:13], body[13:], version)
+    cipher_bytes.inc("decrypt", value=len(fields))
+
+    flags, header_length, tags_length = ENVELOPE_FIELDS.unpack_from(fields)
+    start = ENVELOPE_FIELDS.size
+    header = fields[start:start + header_length]
+    tags = fields[start + header_length:start + header_length + tags_length]
+    text = fields[start + header_length + tags_length:]
+
+    return { "header": header.decode(), "content": text.decode(), "tags": tags.decode() if flags & 1 else None }
+
+
+# Wrapped key from db: raw bytes (BLOB) or base64 (old rows)
+def load_wrapped_key(value: str | bytes) -> bytes:
+    if isinstance(value, str):
+        value = value.encode()
+
+    if len(value) in (256, X25519_WRAP_LENGTH):  # Raw RSA-OAEP or X25519 wrap
+        return value
+
+    return base64.b64decode(value)
+
+
+# Get decrypted aes_key of note for user (from cache if possible, without RSA)
+def unwrap_aes_key(note_id: int, user: dict, encrypted_aes_key: bytes) -> bytes:
+    # Copies are returned, cached value can be wiped on eviction at any moment
+    secret_key = aes_keys_cache.get((user["id"], note_id), copy=bytes)
+    if secret_key is None:
+        secret_key = decrypt_wrapped_key(user["username"], encrypted_aes_key)
+        aes_keys_cache.set((user["id"], note_id), bytearray(secret_key))
+
+    return secret_key
+
+
+# Drop cached aes_keys by note and/or user (all keys if nothing specified)
+def forget_aes_keys(note_id: int | None = None, user_id: int | None = None) -> None:
+    if note_id is None and user_id is None:
+        aes_keys_cache.clear()
+        return
+
+    aes_keys_cache.delete_where(lambda key: (user_id is None or key[0] == user_id) and
+                                            (note_id is None or key[1] == note_id))
+
+
 # Decrypt note
-def decrypt_note(note: dict, username: str, aes_key: bytes) -> dict:
-    private_pem = get_private_key(username)
-    secret_key = decrypt_aes_key(private_pem, aes_key)
+def decrypt_note(note: dict, note_id: int, user: dict, aes_key: bytes) -> dict:
+    secret_key = unwrap_aes_key(note_id, user, aes_key)
+
+    # Only fields which are in note were selected (requested)
+    body = note.pop("body", None)
+    if body is not None:  # Binary envelope, decrypted as a whole
+        note.update({ field: value for field, value in decrypt_envelope(secret_key, body).items() if field in note })
+        return note
 
-    note["header"] = symmetric_decrypt_data(secret_key, note["header"])
-    note["content"] = symmetric_decrypt_data(secret_key, note["content"])
-    note["tags"] = symmetric_decrypt_data(secret_key, note["tags"])
+    # Old format: every field is encrypted separately
+    for field in ("header", "content", "tags"):
+        if note.get(field) is not None:
+            note[field] = symmetric_decrypt_data(secret_key, note[field])
 
     return note
 
 
-# Read private key from file
+# Decrypt page of notes in parallel, order is kept, corrupted note doesn't break others
+def decrypt_notes(notes: dict, user: dict) -> dict:
+    """
+    :param notes: encrypted notes by id (with wrapped "aes_key")
+    :param user: user who reads notes
+    :return: decrypted notes by id without "aes_key", or { "error": ... } for note which can't be decrypted
+    """
+
+    def decrypt_one(note_id: int) -> dict:
+        note = notes[note_id]
+        if "aes_key" not in note:  # No encrypted fields requested
+            return note
+
+        try:
+            decrypted_note = decrypt_note(note, note_id, user, load_wrapped_key(note.pop("aes_key")))
+        except Exception as e:
+            print(e)
+            return { "error": "Note can't be decrypted" }
+
+        return decrypted_note
+
+    note_ids = list(notes.keys())
+    if decrypt_executor is None or len(note_ids) < 2:
+        return { note_id: decrypt_one(note_id) for note_id in note_ids }
+
+    return dict(zip(note_ids, decrypt_executor.map(decrypt_one, note_ids)))
+
+
+# Read private key from keystore
 def get_private_key(username: str) -> bytes:
-    with open(f"{KEYS_PATH}/{username}_key.pem", "rb") as file:
-        return file.read()
+    return keystore.get_key(username)
+
+
+# Get parsed private key (from cache if possible)
+def load_private_key(username: str) -> rsa.RSAPrivateKey:
+    private_key = private_keys_cache.get(username)
+    if private_key is None:
+        private_key = serialization.load_pem_private_key(get_private_key(username), password=None)
+        private_keys_cache.set(username, private_key)
+
+    return private_key
+
+
+# Get parsed X25519 private key (from cache if possible)
+def load_x25519_private_key(username: str) -> x25519.X25519PrivateKey:
+    private_key = private_keys_cache.get((username, "x25519"))
+    if private_key is None:
+        try:
+            private_key = serialization.load_pem_private_key(keystore.get_key(x25519_key_name(username)), password=None)
+        except KeyError:
+            private_key = migrate_legacy_x25519_key(username)
+        private_keys_cache.set((username, "x25519"), private_key)
+
+    return private_key
+
+
+# Move X25519 key of user from old name "{username}_x25519" to its own namespace
+def migrate_legacy_x25519_key(username: str) -> x25519.X25519PrivateKey:
+    pem = keystore.get_key(legacy_x25519_key_name(username))
+    private_key = serialization.load_pem_private_key(pem, password=None)
+
+    # Old name is also RSA key name of user "{username}_x25519", his key could overwrite this one
+    if not isinstance(private_key, x25519.X25519PrivateKey):
+        raise KeyError(f"X25519 private key of {username} was overwritten by RSA key of other user")
+
+    keystore.put_key(x25519_key_name(username), pem)
+
+    return private_key
+
+
+# Drop cached private keys (after deleting or regenerating)
+def forget_private_key(username: str) -> None:
+    private_keys_cache.delete(username)
+    private_keys_cache.delete((username, "x25519"))
@@ -1,13 +1,30 @@
-from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric import padding, x25519
 from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
-import base64, os
+import os, struct
+from dotenv import load_dotenv
 from models.notes import NoteInternalModel, NoteUpdateInternalModel
+from secure.metrics import timed, cipher_seconds, cipher_bytes
+
+
+load_dotenv()
+
+# Schemes of wrapping aes_key. RSA-OAEP wraps have no tag (256 bytes),
+# other schemes start with tag byte: tag | ephemeral public key (32) | nonce (12) | encrypted key with GCM tag (48)
+SCHEME_X25519 = 2
+X25519_WRAP_LENGTH = 1 + 32 + 12 + 48
+KEY_WRAP_SCHEME = os.getenv("KEY_WRAP_SCHEME", "x25519")  # Scheme for new wraps: x25519 or rsa
+
+# Binary envelope of note: version (1) | iv (12) | encrypted fields with GCM tag (16).
+# Fields: flags (1, bit 0 - tags exist) | length of header (4) | length of tags (4) | header | tags | text
+ENVELOPE_VERSION = 1
+ENVELOPE_FIELDS = struct.Struct(">BII")
 
 
 # Encrypting aes_key by public key
+@timed(cipher_seconds, "rsa_wrap")
 def encrypt_aes_key(public_pem: bytes, key: bytes) -> bytes:
     public_key = serialization.load_pem_public_key(public_pem)  # Load pub_key
 
@@ -24,25 +41,66 @@ def encrypt_aes_key(public_pem: bytes, key: bytes) -> bytes:
     return encrypted_key
 
 
-def symmetric_encrypt_data(key: bytes, data: str) -> str:
-    iv = os.urandom(12)  # Length of initialize vector
+# Derive key encryption key for ECIES wrap
+def derive_wrap_key(shared_key: bytes, ephemeral_public: bytes, public_raw: bytes) -> bytes:
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"notes-aes-key-wrap" + ephemeral_public + public_raw
+    ).derive(shared_key)
+
+
+# Encrypting aes_key by X25519 public key (ECIES: X25519 + HKDF + AES-GCM)
+@timed(cipher_seconds, "x25519_wrap")
+def encrypt_aes_key_x25519(public_raw: bytes, key: bytes) -> bytes:
+    ephemeral_key = x25519.X25519PrivateKey.generate()
+    ephemeral_public = ephemeral_key.public_key().public_bytes(encoding=serialization.Encoding.Raw,
+                                                               format=serialization.PublicFormat.Raw)
+
+    shared_key = ephemeral_key.exchange(x25519.X25519PublicKey.from_public_bytes(public_raw))
+    wrap_key = derive_wrap_key(shared_key, ephemeral_public, public_raw)
+
+    tag = bytes([SCHEME_X25519])
+    nonce = os.urandom(12)
+
+    return tag + ephemeral_public + nonce + AESGCM(wrap_key).encrypt(nonce, key, tag)
+
+
+# Encrypting aes_key by preferred scheme for user's public keys
+def wrap_aes_key(public_keys: dict, key: bytes) -> bytes:
+    """
+    :param public_keys: { "rsa": PEM bytes, "x25519": raw bytes or None } of user
+    """
+
+    if KEY_WRAP_SCHEME == "x25519" and public_keys["x25519"]:
+        return encrypt_aes_key_x25519(public_keys["x25519"], key)
+
+    return encrypt_aes_key(public_keys["rsa"], key)
+
+
+# Encrypt all fields of note by one AES-GCM operation
+@timed(cipher_seconds, "aes_encrypt_envelope")
+def encrypt_envelope(key: bytes, header: str, text: str, tags: str | None) -> bytes:
+    header_bytes = header.encode()
+    tags_bytes = tags.encode() if tags is not None else b""
 
-    encryptor = Cipher(
-        algorithms.AES(key),
-        modes.GCM(iv),
-        backend=default_backend()
-    ).encryptor()
+    fields = (ENVELOPE_FIELDS.pack(int(tags is not None), len(header_bytes), len(tags_bytes))
+              + header_bytes + tags_bytes + text.encode())
 
-    data = encryptor.update(data.encode()) + encryptor.finalize()
+    version = bytes([ENVELOPE_VERSION])
+    iv = os.urandom(12)
+    cipher_bytes.inc("encrypt", value=len(fields))
 
-    return base64.b64encode(iv + encryptor.tag + data).decode()
+    return version + iv + AESGCM(key).encrypt(iv, fields, version)
 
 
-# Symmetric encrypting note
+# Symmetric encrypting note (to binary envelope, text columns stay empty)
 def symmetric_encrypt_note(key: bytes, note: NoteInternalModel | NoteUpdateInternalModel) -> NoteInternalModel | NoteUpdateInternalModel:
 
-    note.header = symmetric_encrypt_data(key, note.header)
-    note.text = symmetric_encrypt_data(key, note.text)
-    note.tags = symmetric_encrypt_data(key, note.tags)
+    note.body = encrypt_envelope(key, note.header, note.text, note.tags)
+    note.header = ""
+    note.text = ""
+    note.tags = None
 
     return note
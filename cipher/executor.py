@@ -0,0 +1,45 @@
+import os, asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from dotenv import load_dotenv
+
+from secure import metrics
+
+
+load_dotenv()
+
+# Dedicated threads for crypto from async handlers, so crypto doesn't block event loop
+CRYPTO_WORKERS = int(os.getenv("CRYPTO_WORKERS", 4))  # Notes encrypting/decrypting, keys wrapping
+AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", 2))  # bcrypt and RSA keys generation (signups and logins)
+UPGRADE_WORKERS = int(os.getenv("UPGRADE_WORKERS", 1))  # Background rewrapping of aes_keys after logins
+
+crypto_executor = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="crypto")
+auth_executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="auth")
+upgrade_executor = ThreadPoolExecutor(max_workers=UPGRADE_WORKERS, thread_name_prefix="upgrade")
+
+
+async def run_crypto(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run crypto operation with notes in crypto executor
+    """
+
+    call = metrics.call_timed(metrics.task_seconds, ("crypto", func.__name__), "crypto", func, *args, **kwargs)
+
+    return await asyncio.get_running_loop().run_in_executor(crypto_executor, call)
+
+
+async def run_auth(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run slow auth operation (password hashing, keys generation) in separate executor,
+    so burst of signups/logins doesn't starve note reads
+    """
+
+    call = metrics.call_timed(metrics.task_seconds, ("auth", func.__name__), "auth", func, *args, **kwargs)
+
+    return await asyncio.get_running_loop().run_in_executor(auth_executor, call)
+
+
+def shutdown_executors() -> None:
+    crypto_executor.shutdown()
+    auth_executor.shutdown()
+    upgrade_executor.shutdown(cancel_futures=True)  # Not started upgrades are queued again after next login
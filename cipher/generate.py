@@ -1,29 +1,38 @@
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import rsa, x25519
 from cryptography.hazmat.primitives import serialization
 
-import os
+import os, threading, time, base64
+from collections import deque
 from dotenv import load_dotenv
 
+from cipher.keystore import keystore, x25519_key_name
+from secure.metrics import timed, cipher_seconds
+
 
 load_dotenv()
-KEYS_PATH = os.getenv("KEYS_PATH")
+
+# Pool of pre-generated RSA keys for fast signups
+KEYS_POOL_SIZE = int(os.getenv("KEYS_POOL_SIZE", 8))  # Count of keys kept ready, 0 - disabled
+KEYS_POOL_INTERVAL = float(os.getenv("KEYS_POOL_INTERVAL", 0.05))  # Pause between generating keys (seconds)
+
+_pool: deque[rsa.RSAPrivateKey] = deque()
+_pool_stats = { "taken": 0, "generated_inline": 0, "refilled": 0 }
+_pool_lock = threading.Lock()
+_refill = threading.Event()
+_stopping = threading.Event()
+_thread: threading.Thread | None = None
 
 
 def generate_asymmetric_keys(username: str) -> str:
-    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_key = take_private_key()
     public_key = private_key.public_key()
 
-    create_dir_if_not_exists()
-
     # Create private key and save it on server
-    with open(f"{KEYS_PATH}/{username}_key.pem", "wb") as file:
-        file.write(
-            private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.TraditionalOpenSSL,
-                encryption_algorithm=serialization.NoEncryption()
-            )
-        )
+    keystore.put_key(username, private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        encryption_algorithm=serialization.NoEncryption()
+    ))
 
     # Create public key then save it on db
     public_pem = public_key.public_bytes(
@@ -34,6 +43,36 @@ def generate_asymmetric_keys(username: str) -> str:
     return public_pem.decode()
 
 
+# Generate X25519 keys (for wrapping aes_keys by ECIES), private key is saved on server
+def generate_x25519_keys(username: str) -> str:
+    private_pem, public_key = new_x25519_keys()
+    keystore.put_key(x25519_key_name(username), private_pem)
+
+    return public_key
+
+
+@timed(cipher_seconds, "x25519_generate")
+def new_x25519_keys() -> tuple[bytes, str]:
+    """
+    Generate X25519 keys without saving them
+    :return: private key in PEM, raw public key in base64 (to save it on db)
+    """
+
+    private_key = x25519.X25519PrivateKey.generate()
+    private_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+    public_raw = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+
+    return private_pem, base64.b64encode(public_raw).decode()
+
+
 def generate_aes_key() -> bytes:
     aes_key_length = 32  # Length of key
     key = os.urandom(aes_key_length)
@@ -41,6 +80,71 @@ def generate_aes_key() -> bytes:
     return key
 
 
-def create_dir_if_not_exists() -> None:
-    if not os.path.exists(KEYS_PATH):
-        os.mkdir(KEYS_PATH)
+@timed(cipher_seconds, "rsa_generate")
+def new_private_key() -> rsa.RSAPrivateKey:
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def take_private_key() -> rsa.RSAPrivateKey:
+    """
+    Take pre-generated key from pool, generate it only if pool is empty
+    """
+
+    try:
+        private_key = _pool.popleft()
+        stat = "taken"
+    except IndexError:
+        private_key = new_private_key()
+        stat = "generated_inline"
+
+    with _pool_lock:
+        _pool_stats[stat] += 1
+
+    _refill.set()
+
+    return private_key
+
+
+def start_keys_pool() -> None:
+    """
+    Start background thread which keeps pool filled
+    """
+
+    global _thread
+
+    if KEYS_POOL_SIZE <= 0:
+        return
+
+    def run() -> None:
+        while not _stopping.is_set():
+            if len(_pool) >= KEYS_POOL_SIZE:  # Pool is full, wait until key is taken
+                _refill.wait()
+                _refill.clear()
+                continue
+
+            _pool.append(new_private_key())
+            with _pool_lock:
+                _pool_stats["refilled"] += 1
+
+            time.sleep(KEYS_POOL_INTERVAL)  # Don't take whole CPU core
+
+    _stopping.clear()
+    _thread = threading.Thread(target=run, name="keys-pool", daemon=True)
+    _thread.start()
+
+
+def stop_keys_pool() -> None:
+    global _thread
+
+    if _thread is not None:
+        _stopping.set()
+        _refill.set()
+        _thread.join()
+        _thread = None
+
+    _pool.clear()
+
+
+def keys_pool_stats() -> dict:
+    with _pool_lock:
+        return { "depth": len(_pool), "size": KEYS_POOL_SIZE, **_pool_stats }
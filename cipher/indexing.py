@@ -0,0 +1,59 @@
+import hmac, hashlib, os, re
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Secret for blind index tokens (separate from JWT key)
+INDEX_KEY = hashlib.sha256(b"blind-index:" + (os.getenv("INDEX_KEY") or os.getenv("KEY")).encode()).digest()
+
+
+def normalize_tags(tags: str | None) -> list[str]:
+    """
+    Split tags string ("work, Ideas,#todo") to unique normalized tags
+    """
+
+    if not tags:
+        return []
+
+    normalized = (tag.strip().lstrip("#").lower() for tag in tags.split(","))
+
+    return list(dict.fromkeys(tag for tag in normalized if tag))
+
+
+def user_index_key(user_id: int) -> bytes:
+    return hmac.new(INDEX_KEY, f"user:{user_id}".encode(), hashlib.sha256).digest()
+
+
+# Blind index tokens for every tag of note, keyed by owner of note (so equal tags of different users don't match)
+def tag_tokens(owner_id: int, tags: str | list[str] | None) -> list[bytes]:
+    """
+    :param tags: string of tags or already normalized tags
+    """
+
+    key = user_index_key(owner_id)
+    names = tags if isinstance(tags, list) else normalize_tags(tags)
+
+    return [hmac.new(key, f"tag:{tag}".encode(), hashlib.sha256).digest() for tag in names]
+
+
+# Blind tokens of unique words, keyed per user (hex, so full-text index sees them as single words)
+def word_tokens(key: bytes, text: str | None) -> list[str]:
+    if not text:
+        return []
+
+    words = dict.fromkeys(re.findall(r"\w+", text.lower()))
+
+    return [hmac.new(key, word.encode(), hashlib.sha256).hexdigest()[:32] for word in words]
+
+
+# Tokens of header and content for search index of owner's notes
+def search_tokens(owner_id: int, header: str, text: str) -> tuple[str, str]:
+    key = user_index_key(owner_id)
+
+    return " ".join(word_tokens(key, header)), " ".join(word_tokens(key, text))
+
+
+# Full-text query which matches notes with all words
+def search_query(user_id: int, query: str) -> str:
+    return " ".join(f'"{token}"' for token in word_tokens(user_index_key(user_id), query))
@@ -0,0 +1,448 @@
+import os, sys, mmap, struct, sqlite3, tarfile, threading, argparse
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+from dotenv import load_dotenv
+
+try:
+    import fcntl  # Locks of file keystore, Unix only
+except ImportError:
+    fcntl = None
+
+
+load_dotenv()
+KEYS_PATH = os.getenv("KEYS_PATH")
+KEYSTORE = os.getenv("KEYSTORE", "pem")  # pem - file per key, file - one append-only file, sqlite - separate db
+KEYSTORE_FILE = os.getenv("KEYSTORE_FILE", f"{KEYS_PATH}/keys.store")
+KEYSTORE_DB = os.getenv("KEYSTORE_DB", f"{KEYS_PATH}/keys.db")
+
+PEM_SUFFIX = "_key.pem"
+X25519_PREFIX = "x25519/"  # Usernames can't contain "/", so X25519 keys don't clash with RSA keys
+LEGACY_X25519_SUFFIX = "_x25519"  # Old names of X25519 keys (could clash with RSA key of other user)
+
+
+# Private keys of users by name ("{username}" for RSA, "x25519/{username}" for X25519) as PEM bytes
+class PemKeystore:
+    """
+    Every key in its own file: {KEYS_PATH}/{name}_key.pem
+    """
+
+    files: tuple[str, ...] = ()  # Own files of backend inside KEYS_PATH
+
+    def get_key(self, name: str) -> bytes:
+        value = self.get_pem(name)
+        if value is None:
+            raise KeyError(f"Private key not found: {name}")
+
+        return value
+
+    def put_key(self, name: str, value: bytes) -> None:
+        self.put_keys([(name, value)])
+
+    def put_keys(self, items: Iterable[tuple[str, bytes]]) -> None:
+        create_keys_dir()
+        for name, value in items:
+            path = pem_path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as file:
+                file.write(value)
+
+    def delete_key(self, name: str) -> None:
+        self.delete_keys([name])
+
+    def delete_keys(self, names: list[str], executor: Executor | None = None) -> None:
+        """
+        Delete many keys (PEM files are removed in parallel if executor is given)
+        """
+
+        self.delete_pems(names, executor)
+
+    def close(self) -> None:
+        pass
+
+    def add_to_backup(self, tar: tarfile.TarFile, arcname: str) -> None:
+        """
+        Add consistent copy of all keys to backup archive
+        """
+
+        if not os.path.exists(KEYS_PATH):
+            return
+
+        # Own files are live, they are copied by backends themselves
+        own = { os.path.abspath(path) for path in self.files }
+
+        def skip_own(info: tarfile.TarInfo) -> tarfile.TarInfo | None:
+            path = os.path.abspath(os.path.join(KEYS_PATH, os.path.relpath(info.name, arcname)))
+            return None if path in own or path.endswith(".tmp") else info
+
+        tar.add(KEYS_PATH, arcname=arcname, filter=skip_own)
+
+    # Old PEM files are read by every backend (until they are migrated)
+    @staticmethod
+    def get_pem(name: str) -> bytes | None:
+        try:
+            with open(pem_path(name), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def delete_pem(name: str) -> None:
+        try:
+            os.remove(pem_path(name))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def delete_pems(names: list[str], executor: Executor | None = None) -> None:
+        if executor is None:
+            for name in names:
+                PemKeystore.delete_pem(name)
+        else:
+            list(executor.map(PemKeystore.delete_pem, names))
+
+
+class FileKeystore(PemKeystore):
+    """
+    One append-only file of records: op (1 - put, 2 - delete) | length of name | length of value | name | value.
+    Offsets of values are kept in memory, values are read by mmap.
+
+    File can be shared by many processes (uvicorn workers, CLI migrate and compact while server works):
+    writers hold exclusive lock of "{path}.lock", readers catch up with records of other processes
+    when key isn't found, and reopen file when it was replaced by compact
+    """
+
+    RECORD = struct.Struct(">BHI")
+    PUT, DELETE = 1, 2
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.files = (path, path + ".lock")
+        self.__index: dict[str, tuple[int, int]] = {}  # name -> (offset of value, length)
+        self.__size = 0  # Indexed part of file
+        self.__lock = threading.Lock()
+        self.__map: mmap.mmap | None = None
+
+        create_keys_dir()
+        self.__lock_file = open(path + ".lock", "a+b")
+        self.__open()
+        with self.__exclusive():
+            self.__load(truncate=True)
+
+    def get_key(self, name: str) -> bytes:
+        with self.__lock:
+            item = self.__index.get(name)
+            if item is None:  # Can be written by other process
+                self.__refresh()
+                item = self.__index.get(name)
+
+            if item is not None:
+                offset, length = item
+                data = self.__map
+                if data is None or offset + length > len(data):  # Appended after mapping
+                    data = self.__remap()
+
+                return data[offset:offset + length]
+
+        return super().get_key(name)
+
+    def put_keys(self, items: Iterable[tuple[str, bytes]]) -> None:
+        self.__append([(self.PUT, name, value) for name, value in items])
+
+    def delete_keys(self, names: list[str], executor: Executor | None = None) -> None:
+        self.__append([(self.DELETE, name, b"") for name in names])
+        self.delete_pems(names, executor)
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__map = None
+            self.__file.close()
+            self.__lock_file.close()
+
+    def add_to_backup(self, tar: tarfile.TarFile, arcname: str) -> None:
+        super().add_to_backup(tar, arcname)
+
+        # File is only appended, so its indexed part is a consistent snapshot
+        with self.__lock:
+            self.__refresh()
+            size = self.__size
+            file = os.fdopen(os.dup(self.__file.fileno()), "rb")  # The same file even if it's replaced meanwhile
+
+        with file:
+            file.seek(0)
+            info = tar.gettarinfo(fileobj=file, arcname=f"{arcname}/{os.path.basename(self.path)}")
+            info.size = size
+            tar.addfile(info, file)
+
+    def compact(self) -> None:
+        """
+        Rewrite file without deleted and replaced keys (other processes reopen new file)
+        """
+
+        with self.__exclusive():
+            self.__refresh(truncate=True)
+            data = self.__remap()
+            with open(self.path + ".tmp", "wb") as file:
+                for name, (offset, length) in self.__index.items():
+                    encoded = name.encode()
+                    file.write(self.RECORD.pack(self.PUT, len(encoded), length) + encoded + data[offset:offset + length])
+                file.flush()
+                os.fsync(file.fileno())
+
+            os.replace(self.path + ".tmp", self.path)
+            self.__reopen()
+
+    @contextmanager
+    def __exclusive(self) -> Iterator[None]:
+        """
+        Lock file for writing by this thread and other processes
+        """
+
+        with self.__lock:
+            fcntl.flock(self.__lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.__lock_file.fileno(), fcntl.LOCK_UN)
+
+    def __open(self) -> None:
+        self.__file = open(self.path, "a+b")
+        self.__map = None
+
+    def __reopen(self) -> None:
+        self.__file.close()
+        self.__open()
+        self.__index.clear()
+        self.__size = 0
+        self.__load()
+
+    def __refresh(self, truncate: bool = False) -> None:
+        """
+        Catch up with records appended by other processes, reopen file if it was replaced by compact
+        :param truncate: cut off not completely written record (only with lock of file)
+        """
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+
+        if stat.st_ino != os.fstat(self.__file.fileno()).st_ino:
+            self.__reopen()
+        elif stat.st_size > self.__size or truncate:
+            self.__load(truncate)
+
+    def __load(self, truncate: bool = False) -> None:
+        """
+        Add records after indexed part of file to index
+        :param truncate: cut off record which wasn't written completely (only with lock of file)
+        """
+
+        data = self.__remap()  # Whole file isn't read in memory
+        size = len(data)
+        position = self.__size
+        while position + self.RECORD.size <= size:
+            op, name_length, length = self.RECORD.unpack_from(data, position)
+            start = position + self.RECORD.size + name_length
+            if start + length > size:
+                break
+
+            name = bytes(data[position + self.RECORD.size:start]).decode()
+            if op == self.PUT:
+                self.__index[name] = (start, length)
+            else:
+                self.__index.pop(name, None)
+            position = start + length
+
+        self.__size = position
+        if truncate and position < size:
+            self.__map = None
+            if isinstance(data, mmap.mmap):
+                data.close()
+            self.__file.truncate(position)
+
+    def __append(self, records: list[tuple[int, str, bytes]]) -> None:
+        if not records:
+            return
+
+        with self.__exclusive():
+            self.__refresh(truncate=True)  # Records of other processes are before ours
+
+            position = self.__size
+            updates = []
+            for op, name, value in records:
+                if op == self.DELETE and name not in self.__index:
+                    continue
+
+                encoded = name.encode()
+                self.__file.write(self.RECORD.pack(op, len(encoded), len(value)) + encoded + value)
+                position += self.RECORD.size + len(encoded)
+                updates.append((op, name, position, len(value)))
+                position += len(value)
+
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+
+            # Index is changed only when records are on disk
+            for op, name, offset, length in updates:
+                if op == self.PUT:
+                    self.__index[name] = (offset, length)
+                else:
+                    self.__index.pop(name, None)
+            self.__size = position
+
+    def __remap(self) -> mmap.mmap | bytes:
+        self.__file.flush()
+        if os.fstat(self.__file.fileno()).st_size == 0:  # Empty file can't be mapped
+            return b""
+
+        # Values are read only with lock, so old map isn't used anymore
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self.__map
+
+
+class SqliteKeystore(PemKeystore):
+    """
+    Keys in separate SQLite db (not in main db, so they can be stored and backed up apart)
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.files = (path, path + "-wal", path + "-shm")
+        self.__local = threading.local()
+        self.__connections: list[sqlite3.Connection] = []
+        self.__lock = threading.Lock()
+
+        create_keys_dir()
+        with self.__connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS keys (name TEXT PRIMARY KEY, value BLOB NOT NULL) WITHOUT ROWID")
+
+    def get_key(self, name: str) -> bytes:
+        row = self.__connection().execute("SELECT value FROM keys WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return super().get_key(name)
+
+        return row[0]
+
+    def put_keys(self, items: Iterable[tuple[str, bytes]]) -> None:
+        with self.__connection() as conn:  # One transaction
+            conn.executemany("INSERT OR REPLACE INTO keys (name, value) VALUES (?, ?)", items)
+
+    def delete_keys(self, names: list[str], executor: Executor | None = None) -> None:
+        with self.__connection() as conn:
+            conn.executemany("DELETE FROM keys WHERE name = ?", [(name,) for name in names])
+        self.delete_pems(names, executor)
+
+    def close(self) -> None:
+        with self.__lock:
+            for conn in self.__connections:
+                conn.close()
+            self.__connections.clear()
+        self.__local = threading.local()
+
+    def add_to_backup(self, tar: tarfile.TarFile, arcname: str) -> None:
+        super().add_to_backup(tar, arcname)
+
+        # Online backup of keys db, then it's packed
+        copy = self.path + ".backup.tmp"
+        target = sqlite3.connect(copy)
+        try:
+            self.__connection().backup(target)
+            target.close()
+            tar.add(copy, arcname=f"{arcname}/{os.path.basename(self.path)}")
+        finally:
+            target.close()
+            os.remove(copy)
+
+    def __connection(self) -> sqlite3.Connection:
+        conn = getattr(self.__local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")  # Lost key means lost notes
+            self.__local.conn = conn
+            with self.__lock:
+                self.__connections.append(conn)
+
+        return conn
+
+
+def pem_path(name: str) -> str:
+    return f"{KEYS_PATH}/{name}{PEM_SUFFIX}"
+
+
+def x25519_key_name(username: str) -> str:
+    return f"{X25519_PREFIX}{username}"
+
+
+def legacy_x25519_key_name(username: str) -> str:
+    return f"{username}{LEGACY_X25519_SUFFIX}"
+
+
+def create_keys_dir() -> None:
+    if not os.path.exists(KEYS_PATH):
+        os.mkdir(KEYS_PATH)
+
+
+def open_keystore(kind: str) -> PemKeystore:
+    if kind == "file":
+        if fcntl is None:
+            raise ValueError("Keystore file needs fcntl locks (Unix only), use pem or sqlite keystore")
+        return FileKeystore(KEYSTORE_FILE)
+    if kind == "sqlite":
+        return SqliteKeystore(KEYSTORE_DB)
+    if kind == "pem":
+        return PemKeystore()
+
+    raise ValueError(f"Unknown keystore: {kind}")
+
+
+keystore = open_keystore(KEYSTORE)
+
+
+def migrate_pem_keys(target: PemKeystore, delete: bool = False, batch: int = 1000) -> int:
+    """
+    Move keys from PEM files of KEYS_PATH to other keystore
+    :param delete: remove PEM files when keys are written
+    :return: count of moved keys
+    """
+
+    names = []
+    for root, _, file_names in os.walk(KEYS_PATH):  # X25519 keys are in subdirectory
+        prefix = os.path.relpath(root, KEYS_PATH).replace(os.sep, "/")
+        names += [file_name[:-len(PEM_SUFFIX)] if prefix == "." else f"{prefix}/{file_name[:-len(PEM_SUFFIX)]}"
+                  for file_name in file_names if file_name.endswith(PEM_SUFFIX)]
+
+    for i in range(0, len(names), batch):
+        part = names[i:i + batch]
+        target.put_keys([(name, PemKeystore.get_pem(name)) for name in part])
+
+        if delete:
+            for name in part:
+                if target.get_key(name) == PemKeystore.get_pem(name):  # Written correctly
+                    PemKeystore.delete_pem(name)
+
+    return len(names)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keystore of private keys")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser("migrate", help="Move keys from PEM files to keystore")
+    migrate.add_argument("--to", choices=["file", "sqlite"], default=KEYSTORE if KEYSTORE != "pem" else "file")
+    migrate.add_argument("--delete", action="store_true", help="Remove PEM files after migration")
+
+    # Both commands can be run while server works: file keystore is locked for writing and reloaded by server
+    commands.add_parser("compact", help="Remove deleted keys from keystore file")
+
+    args = parser.parse_args()
+    if args.command == "migrate":
+        store = open_keystore(args.to)
+        print(f"Migrated keys: {migrate_pem_keys(store, args.delete)}")
+        store.close()
+    elif not isinstance(keystore, FileKeystore):
+        sys.exit("Compact is supported only by file keystore")
+    else:
+        keystore.compact()
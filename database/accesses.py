@@ -1,16 +1,47 @@
-import sqlite3
 from models.accesses import AccessInternalModel, AccessModel
 
-from .general import DB_PATH
+from .general import get_connection
+from .migrations import hot_query
 from .users import get_email
-from secure.notification import notify
+from . import notifications
+from cipher.decrypting import forget_aes_keys
+
+
+CHECK_IS_OWNER_QUERY = hot_query("check_is_owner_of_note", """
+    SELECT * FROM notes WHERE id = ? AND from_user_id = ?
+""")
+GET_PERMISSION_QUERY = hot_query("edit_permission", """
+    SELECT permission FROM accesses WHERE note_id = ? AND user_id = ?
+""")
+DELETE_ACCESS_QUERY = hot_query("delete_permission", """
+    DELETE FROM accesses WHERE note_id = ? AND user_id = ?
+""")
+EDIT_PERMISSION_QUERY = hot_query("edit_permissions", """
+    UPDATE accesses SET permission = ? WHERE note_id = ? AND user_id = ? AND permission != ?
+""")
+SET_PERMISSION_QUERY = hot_query("edit_permission (update)", """
+    UPDATE accesses SET permission = ? WHERE note_id = ? AND user_id = ?
+""")
+HAS_ACCESS_QUERY = hot_query("edit_permissions (check)", """
+    SELECT 1 FROM accesses WHERE note_id = ? AND user_id = ?
+""")
+
+
+def get_owned_keys_query(count: int) -> str:
+    return f"""
+        SELECT id, aes_key FROM notes WHERE from_user_id = ? AND id IN ({", ".join("?" * count)})
+    """
+
+
+hot_query("get_owned_keys", get_owned_keys_query(2))
 
 
 def set_permission(access: AccessInternalModel, owner_id: int) -> dict:
     if not check_is_owner_of_note(owner_id, access.note_id):
         return { "message": "This action can only be performed by owner of note" }
 
-    with sqlite3.connect(DB_PATH) as conn:
+    owner_email = get_email(owner_id)  # Before transaction, its own "with" would commit it
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute("""
@@ -20,15 +51,14 @@ def set_permission(access: AccessInternalModel, owner_id: int) -> dict:
         if cursor.rowcount == 0:  # If ignore
             return { "message": "This user already has access to this note" }
 
+        # Email is sent in background
+        permission = "read" if access.permission == 1 else "read & write"
+        notifications.enqueue(cursor, access.user_id,
+                              make_notification_text({ "email": owner_email,
+                                                       "note_id": access.note_id,
+                                                       "permission": f"Gave access to {permission}" }))
         conn.commit()
 
-        ##### Send email
-        # permission = "read" if access.permission == 1 else "read & write"
-        # notify(get_email(access.user_id),
-        #        make_notification_text({ "email": get_email(owner_id),
-        #                                 "note_id": access.note_id,
-        #                                 "permission": f"Gave access to {permission}" }))
-
         return { "message": "User successfully gained access" }
 
 
@@ -36,22 +66,20 @@ def delete_permission(access: AccessModel, owner_id: int) -> dict:
     if not check_is_owner_of_note(owner_id, access.note_id):
         return { "message": "This action can only be performed by owner of note" }
 
-    with sqlite3.connect(DB_PATH) as conn:
+    owner_email = get_email(owner_id)
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            DELETE FROM accesses WHERE note_id = ? AND user_id = ?
-        """, (access.note_id, access.user_id))
+        cursor.execute(DELETE_ACCESS_QUERY, (access.note_id, access.user_id))
 
         if cursor.rowcount == 0:  # If user doesn't have access to this note
             return { "message": "This user doesn't have access to this note" }
 
+        notifications.enqueue(cursor, access.user_id, make_notification_text({ "email": owner_email,
+                                                                               "note_id": access.note_id,
+                                                                               "permission": "Take away access" }))
         conn.commit()
-
-        ##### Send email
-        # notify(get_email(access.user_id), make_notification_text({ "email": get_email(owner_id),
-        #                                                                "note_id": access.note_id,
-        #                                                                "permission": "Take away access" }))
+        forget_aes_keys(access.note_id, access.user_id)
 
         return { "message": "User successfully lost access" }
 
@@ -60,12 +88,11 @@ def edit_permission(access: AccessInternalModel, owner_id: int) -> dict:
     if not check_is_owner_of_note(owner_id, access.note_id):
         return { "message": "This action can only be performed by owner of note" }
 
-    with sqlite3.connect(DB_PATH) as conn:
+    owner_email = get_email(owner_id)
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT permission FROM accesses WHERE note_id = ? AND user_id = ?
-        """, (access.note_id, access.user_id))
+        cursor.execute(GET_PERMISSION_QUERY, (access.note_id, access.user_id))
 
         row = cursor.fetchone()
         if not row:
@@ -73,29 +100,133 @@ def edit_permission(access: AccessInternalModel, owner_id: int) -> dict:
         elif row[0] == access.permission:  # If not changed
             return {"message": "You select the same rights as user had"}
 
-        cursor.execute("""
-            UPDATE accesses SET permission = ? WHERE note_id = ? AND user_id = ?
-        """, (access.permission, access.note_id, access.user_id))
+        cursor.execute(SET_PERMISSION_QUERY, (access.permission, access.note_id, access.user_id))
 
+        permission = "read" if access.permission == 1 else "read & write"
+        notifications.enqueue(cursor, access.user_id,
+                              make_notification_text({ "email": owner_email,
+                                                       "note_id": access.note_id,
+                                                       "permission": f"Change your access to {permission}" }))
         conn.commit()
 
-        ##### Send email
-        # permission = "read" if access.permission == 1 else "read & write"
-        # notify(get_email(access.user_id),
-        #        make_notification_text({ "email": get_email(owner_id),
-        #                                 "note_id": access.note_id,
-        #                                 "permission": f"Change your access to {permission}" }))
-
         return { "message": "Rights successfully changed" }
 
 
+def get_owned_keys(owner_id: int, note_ids: list[int]) -> dict:
+    """
+    Wrapped AES keys of notes which belong to owner: { note_id: aes_key } (other notes are skipped)
+    """
+
+    if not note_ids:
+        return {}
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(get_owned_keys_query(len(note_ids)), (owner_id, *note_ids))
+
+        return dict(cursor.fetchall())
+
+
+def set_permissions(accesses: list[AccessInternalModel], owner_id: int) -> list[str]:
+    """
+    Give accesses to many (note, user) pairs in one transaction (owner must be checked by caller)
+    :return: message for every access
+    """
+
+    owner_email = get_email(owner_id)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        messages = []
+        for access in accesses:
+            cursor.execute("""
+                INSERT OR IGNORE INTO accesses (note_id, user_id, key, permission) VALUES (?, ?, ?, ?)
+            """, (access.note_id, access.user_id, access.key, access.permission))
+
+            if not cursor.rowcount:
+                messages.append("This user already has access to this note")
+                continue
+
+            permission = "read" if access.permission == 1 else "read & write"
+            notifications.enqueue(cursor, access.user_id,
+                                  make_notification_text({ "email": owner_email, "note_id": access.note_id,
+                                                           "permission": f"Gave access to {permission}" }))
+            messages.append("User successfully gained access")
+
+        conn.commit()
+
+        return messages
+
+
+def edit_permissions(accesses: list[AccessInternalModel], owner_id: int) -> list[str]:
+    """
+    Change permission of many accesses in one transaction (owner must be checked by caller)
+    :return: message for every access
+    """
+
+    owner_email = get_email(owner_id)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        messages = []
+        for access in accesses:
+            cursor.execute(EDIT_PERMISSION_QUERY, (access.permission, access.note_id, access.user_id, access.permission))
+
+            if cursor.rowcount:
+                permission = "read" if access.permission == 1 else "read & write"
+                notifications.enqueue(cursor, access.user_id,
+                                      make_notification_text({ "email": owner_email, "note_id": access.note_id,
+                                                               "permission": f"Change your access to {permission}" }))
+                messages.append("Rights successfully changed")
+                continue
+
+            cursor.execute(HAS_ACCESS_QUERY, (access.note_id, access.user_id))
+            messages.append("You select the same rights as user had" if cursor.fetchone()
+                            else "This user doesn't have access to this note")
+
+        conn.commit()
+
+        return messages
+
+
+def delete_permissions(accesses: list[AccessModel], owner_id: int) -> list[str]:
+    """
+    Take away many accesses in one transaction (owner must be checked by caller)
+    :return: message for every access
+    """
+
+    owner_email = get_email(owner_id)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        messages = []
+        for access in accesses:
+            cursor.execute(DELETE_ACCESS_QUERY, (access.note_id, access.user_id))
+
+            if not cursor.rowcount:
+                messages.append("This user doesn't have access to this note")
+                continue
+
+            notifications.enqueue(cursor, access.user_id,
+                                  make_notification_text({ "email": owner_email, "note_id": access.note_id,
+                                                           "permission": "Take away access" }))
+            messages.append("User successfully lost access")
+
+        conn.commit()
+
+    for access, message in zip(accesses, messages):
+        if message == "User successfully lost access":
+            forget_aes_keys(access.note_id, access.user_id)
+
+    return messages
+
+
 def check_is_owner_of_note(user_id: int, note_id: int) -> bool:
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT * FROM notes WHERE id = ? AND from_user_id = ?
-        """, (note_id, user_id))
+        cursor.execute(CHECK_IS_OWNER_QUERY, (note_id, user_id))
 
         if not cursor.fetchone():
             return False
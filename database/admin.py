@@ -1,124 +1,288 @@
-import sqlite3, os
+import os, time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 
-from .general import DB_PATH
-from cipher.generate import KEYS_PATH
+from .general import get_connection
+from .migrations import hot_query
+from .jobs import create_job, update_job, finish_job
+from cipher.keystore import keystore, x25519_key_name, legacy_x25519_key_name
+from cipher.decrypting import forget_private_key, forget_aes_keys
+from .users import forget_user
 
 
-def delete_notes_by_user_id(user_id: int) -> dict:
-    """
-    Delete all notes which belong specific user
-    """
+load_dotenv()
+PURGE_BATCH = int(os.getenv("PURGE_BATCH", 500))  # Rows deleted in one transaction
+PURGE_PAUSE = float(os.getenv("PURGE_PAUSE", 0.05))  # Pause between transactions, so other writers can go (seconds)
+PURGE_WORKERS = int(os.getenv("PURGE_WORKERS", 8))  # Threads for deleting keys
 
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
+purge_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="purge")  # One purge at a time
+files_executor = ThreadPoolExecutor(max_workers=PURGE_WORKERS, thread_name_prefix="purge-files")
 
-        # Delete all accesses for this notes
-        cursor.execute("""
-            DELETE FROM accesses WHERE note_id IN (SELECT id FROM notes WHERE from_user_id = ?)
-        """, (user_id,))
+PURGE_ALL_USERS_QUERY = hot_query("purge (all users)", """
+    SELECT id, username FROM users WHERE is_admin = 0 AND id > ? ORDER BY id LIMIT ?
+""")
+GET_USUAL_USER_QUERY = hot_query("delete_user_by_id", """
+    SELECT username FROM users WHERE id = ? AND is_admin = 0
+""")
+NOTE_EXISTS_QUERY = hot_query("delete_note_by_id (admin)", """
+    SELECT 1 FROM notes WHERE id = ?
+""")
 
-        cursor.execute("""
-            DELETE FROM notes WHERE from_user_id = ?
-        """, (user_id,))
 
-        if cursor.rowcount == 0:
-            return {"message": "Notes not found"}
+# Queries of purge by batches (placeholders for ids of batch)
+def placeholders(count: int) -> str:
+    return ", ".join("?" * count)
+
+
+def purge_notes_query(users_count: int) -> str:
+    return f"SELECT id FROM notes WHERE from_user_id IN ({placeholders(users_count)}) LIMIT ?"
+
+
+def purge_users_query(users_count: int) -> str:
+    return f"SELECT id, username FROM users WHERE is_admin = 0 AND id IN ({placeholders(users_count)}) ORDER BY id"
 
-        conn.commit()
 
-        return {"message": "Notes are successfully deleted"}
+def delete_users_query(users_count: int) -> str:
+    return f"DELETE FROM users WHERE is_admin = 0 AND id IN ({placeholders(users_count)})"
 
 
-def delete_statistics_by_user_id(user_id: int) -> None:
+def taken_names_query(names_count: int) -> str:
+    return f"SELECT username FROM users WHERE username IN ({placeholders(names_count)})"
+
+
+def delete_by_notes_query(table: str, column: str, notes_count: int) -> str:
+    return f"DELETE FROM {table} WHERE {column} IN ({placeholders(notes_count)})"
+
+
+def delete_by_users_query(table: str, users_count: int) -> str:
+    return f"""
+        DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE user_id IN ({placeholders(users_count)}) LIMIT ?)
     """
-    Delete statistics for specific user
+
+
+def orphan_rows_query(table: str, column: str, user_column: str) -> str:
+    return f"""
+        SELECT {column} FROM {table} WHERE {column} > ? AND {user_column} NOT IN (SELECT id FROM users)
+        ORDER BY {column} LIMIT ?
     """
 
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
 
-        cursor.execute("""
-            DELETE FROM statistics WHERE user_id = ?
-        """, (user_id,))
-        conn.commit()
+NOTE_ROWS = (("accesses", "note_id"), ("note_tags", "note_id"), ("notes_search", "rowid"), ("notes", "id"))
+USER_TABLES = ("accesses", "statistics", "password_restore")
+
+# Rows of users which don't exist (left by purge which was interrupted): (table, column of batches, column of user)
+ORPHAN_ROWS = (("notes", "id", "from_user_id"),) + tuple((table, "rowid", "user_id") for table in USER_TABLES)
+
+hot_query("purge (users)", purge_users_query(2))
+hot_query("purge (delete users)", delete_users_query(2))
+hot_query("delete_user_pkey (legacy names)", taken_names_query(2))
+hot_query("purge (notes)", purge_notes_query(2))
+for table, column in NOTE_ROWS:
+    hot_query(f"purge ({table} of notes)", delete_by_notes_query(table, column, 2))
+for table in USER_TABLES:
+    hot_query(f"purge ({table})", delete_by_users_query(table, 2))
+for table, column, user_column in ORPHAN_ROWS:
+    hot_query(f"purge (orphan {table})", orphan_rows_query(table, column, user_column))
+    hot_query(f"purge (orphan {table} by {column})", delete_by_notes_query(table, column, 2))
 
 
 def delete_user_by_id(user_id: int) -> dict:
-    with sqlite3.connect(DB_PATH) as conn:
+    """
+    Start background purge of user and all his data
+    """
+
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT username FROM users WHERE id = ?
-        """, (user_id,))
+        cursor.execute(GET_USUAL_USER_QUERY, (user_id,))
 
         row = cursor.fetchone()
         if not row:
             return { "message": "User not found" }
 
-        # Delete private key
-        delete_user_pkey(row[0])
+    job = create_job("purge")
+    purge_executor.submit(run_purge, job, [user_id])
 
-        cursor.execute("""
-            DELETE FROM users WHERE id = ? AND is_admin = 0
-        """, (user_id,))
-        conn.commit()
-
-        # Delete his notes and statistics
-        delete_notes_by_user_id(user_id)
-        delete_statistics_by_user_id(user_id)
-
-        return {"message": "User is successfully deleted"}
+    return { "message": "Deleting of user and his notes, statistics and keys is started", "job_id": job["id"] }
 
 
 def delete_note_by_id(note_id: int) -> dict:
-    with sqlite3.connect(DB_PATH) as conn:
+    """
+    Delete note with its accesses and indexes (the same rows as purge deletes)
+    """
+
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            DELETE FROM notes WHERE id = ?
-        """, (note_id,))
+        cursor.execute(NOTE_EXISTS_QUERY, (note_id,))
+
+        if not cursor.fetchone():
+            return { "message": "Note not found" }
+
+        for table, column in NOTE_ROWS:
+            cursor.execute(delete_by_notes_query(table, column, 1), (note_id,))
         conn.commit()
 
-        if cursor.rowcount == 0:
-            return {"message": "Note not found"}
+    forget_aes_keys(note_id)  # Key of note can be cached for any user
 
-        return {"message": "Note is successfully deleted"}
+    return { "message": "Note is successfully deleted" }
 
 
 def delete_all_users() -> dict:
-    with sqlite3.connect(DB_PATH) as conn:
+    """
+    Start background purge of all usual users
+    """
+
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute("""
-            SELECT username FROM users WHERE is_admin = 0
+            SELECT 1 FROM users WHERE is_admin = 0 LIMIT 1
         """)
 
-        row = cursor.fetchall()
-        if not row:
+        if not cursor.fetchone():
             return { "message": "No users found" }
 
-        # Delete private keys
-        delete_user_pkey([name[0] for name in row])
+    job = create_job("purge")
+    purge_executor.submit(run_purge, job, None)
 
-        cursor.executescript("""
-            DELETE FROM users WHERE is_admin = 0;
-            DELETE FROM notes WHERE from_user_id NOT IN (SELECT id FROM users);
-            DELETE FROM statistics WHERE user_id NOT IN (SELECT id FROM users);
-            DELETE FROM accesses WHERE user_id NOT IN (SELECT id FROM users);
-        """)
-        conn.commit()
+    return { "message": "Deleting of all usual users and their notes, statistics and keys is started",
+             "job_id": job["id"] }
 
-        return { "message": "All usual users and their notes, statistics and keys are deleted" }
 
+def run_purge(job: dict, user_ids: list[int] | None) -> None:
+    """
+    Delete users (all usual users if None) and all their data by short transactions
+    """
 
-# Delete private key by username
-def delete_user_pkey(username: str | list) -> None:
     try:
-        if username is list:
-            for name in username:
-                os.remove(f"{KEYS_PATH}/{name}_key.pem")
-            return
+        last_id = 0
+        while True:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+
+                if user_ids is None:
+                    cursor.execute(PURGE_ALL_USERS_QUERY, (last_id, PURGE_BATCH))
+                else:
+                    batch = sorted(user_id for user_id in user_ids if user_id > last_id)[:PURGE_BATCH]
+                    if not batch:
+                        break
 
-        os.remove(f"{KEYS_PATH}/{username}_key.pem")
-    except FileNotFoundError as e:
+                    cursor.execute(purge_users_query(len(batch)), batch)
+
+                users = cursor.fetchall()
+                if not users:
+                    break
+
+                purge_users(job, [row[0] for row in users], [row[1] for row in users])
+                last_id = users[-1][0]
+
+        purge_orphans(job)
+    except Exception as e:
         print(e)
+        finish_job(job, "Purge was interrupted")
+        return
+
+    forget_aes_keys()
+    finish_job(job)
+
+
+def purge_users(job: dict, user_ids: list[int], usernames: list[str]) -> None:
+    # Users are deleted first, so they can't add new notes meanwhile
+    # (if purge is interrupted, rest of their rows is deleted by purge_orphans of next purge)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(delete_users_query(len(user_ids)), user_ids)
+        conn.commit()
+
+    for name in usernames:
+        forget_user(name)
+    delete_user_pkey(usernames)
+
+    # Notes with their accesses and indexes
+    while True:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(purge_notes_query(len(user_ids)), (*user_ids, PURGE_BATCH))
+
+            note_ids = [row[0] for row in cursor.fetchall()]
+            if not note_ids:
+                break
+
+            for table, column in NOTE_ROWS:
+                cursor.execute(delete_by_notes_query(table, column, len(note_ids)), note_ids)
+            conn.commit()
+
+        job["notes"] = job.get("notes", 0) + len(note_ids)  # Progress inside batch of users
+        update_job(job)
+        time.sleep(PURGE_PAUSE)
+
+    # Rows of other tables which belong to these users
+    for table in USER_TABLES:
+        while True:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute(delete_by_users_query(table, len(user_ids)), (*user_ids, PURGE_BATCH))
+                deleted = cursor.rowcount
+                conn.commit()
+
+            if deleted < PURGE_BATCH:
+                break
+            time.sleep(PURGE_PAUSE)
+
+    for user_id in user_ids:
+        forget_aes_keys(user_id=user_id)
+
+    update_job(job, processed=len(user_ids), done=len(user_ids))
+
+
+def purge_orphans(job: dict) -> None:
+    """
+    Delete rows of users which don't exist anymore by batches (notes with their accesses and indexes first)
+    """
+
+    for table, column, user_column in ORPHAN_ROWS:
+        last_id = 0
+        while True:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute(orphan_rows_query(table, column, user_column), (last_id, PURGE_BATCH))
+
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    break
+
+                if table == "notes":
+                    for note_table, note_column in NOTE_ROWS:
+                        cursor.execute(delete_by_notes_query(note_table, note_column, len(ids)), ids)
+                    job["notes"] = job.get("notes", 0) + len(ids)
+                else:
+                    cursor.execute(delete_by_notes_query(table, column, len(ids)), ids)
+                conn.commit()
+
+            last_id = ids[-1]
+            update_job(job)
+            time.sleep(PURGE_PAUSE)
+
+
+# Delete private keys by username (or list of them, files are removed in parallel)
+def delete_user_pkey(username: str | list) -> None:
+    usernames = username if isinstance(username, list) else [username]
+
+    # Drop parsed keys from cache
+    for name in usernames:
+        forget_private_key(name)
+
+    # Old name of X25519 key is RSA key of user "{username}_x25519" if he exists, it isn't deleted then
+    legacy_names = [legacy_x25519_key_name(name) for name in usernames]
+    with get_connection() as conn:
+        taken = { row[0] for row in conn.execute(taken_names_query(len(legacy_names)), legacy_names) } \
+            if legacy_names else set()
+
+    # Users created before X25519 scheme may not have second key
+    keystore.delete_keys(usernames + [x25519_key_name(name) for name in usernames]
+                         + [name for name in legacy_names if name not in taken], files_executor)
@@ -0,0 +1,87 @@
+import sqlite3, os, tarfile, asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterator
+from dotenv import load_dotenv
+
+from .general import DB_PATH, DB_BUSY_TIMEOUT
+from cipher.keystore import keystore, KEYS_PATH
+
+
+load_dotenv()
+BACKUP_FOLDER = os.getenv("BACKUP_FOLDER")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 5))  # Count of snapshots to keep
+BACKUP_PREFIX = "backup-"
+BACKUP_SUFFIX = ".tar.gz"
+
+# One backup at a time, outside of db workers
+backup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backup")
+
+
+def create_backup() -> str:
+    """
+    Create compressed snapshot of db (online backup API, writers aren't blocked by WAL) and private keys,
+    remove old snapshots
+    :return: path of created snapshot
+    """
+
+    os.makedirs(BACKUP_FOLDER, exist_ok=True)
+
+    name = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+    db_copy = os.path.join(BACKUP_FOLDER, f"{name}.sqlite3.tmp")
+    archive = os.path.join(BACKUP_FOLDER, name + BACKUP_SUFFIX)
+
+    try:
+        # Copy all pages in one step from one read snapshot: copy by steps starts again after every write
+        # of other connection (statistics are flushed every second), so it could never finish
+        source = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT / 1000)
+        target = sqlite3.connect(db_copy)
+        try:
+            source.backup(target, pages=-1)
+        finally:
+            source.close()
+            target.close()
+
+        # Pack db and keys, rename when archive is complete
+        with tarfile.open(archive + ".tmp", "w:gz", compresslevel=6) as tar:
+            tar.add(db_copy, arcname=os.path.basename(DB_PATH))
+            keystore.add_to_backup(tar, os.path.basename(os.path.normpath(KEYS_PATH)))
+        os.replace(archive + ".tmp", archive)
+    finally:
+        for path in (db_copy, archive + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Rotate snapshots
+    for old in list_backups()[BACKUP_KEEP:]:
+        os.remove(old)
+
+    return archive
+
+
+async def create_backup_async() -> str:
+    return await asyncio.get_running_loop().run_in_executor(backup_executor, create_backup)
+
+
+def list_backups() -> list[str]:
+    """
+    Get paths of snapshots (the newest first)
+    """
+
+    if not os.path.exists(BACKUP_FOLDER):
+        return []
+
+    names = [name for name in os.listdir(BACKUP_FOLDER)
+             if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)]
+
+    return [os.path.join(BACKUP_FOLDER, name) for name in sorted(names, reverse=True)]
+
+
+def read_chunks(path: str, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """
+    Read file by chunks (for streaming response)
+    """
+
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            yield chunk
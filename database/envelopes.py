@@ -0,0 +1,161 @@
+import os, threading
+from dotenv import load_dotenv
+
+from .general import get_connection
+from .migrations import hot_query
+from .notes import DELETE_NOTE_TAGS_QUERY, set_tag_tokens, set_search_tokens
+from .users import UPDATE_ACCESS_KEY_QUERY
+from cipher.encrypting import encrypt_envelope
+from cipher.decrypting import decrypt_wrapped_key, decrypt_envelope, load_wrapped_key, symmetric_decrypt_data
+from cipher.indexing import tag_tokens, search_tokens
+
+
+load_dotenv()
+ENVELOPE_CONVERTER = os.getenv("ENVELOPE_CONVERTER", "1") == "1"  # Convert and index old notes in background
+ENVELOPE_BATCH = int(os.getenv("ENVELOPE_BATCH", 200))  # Notes per transaction
+ENVELOPE_PAUSE = float(os.getenv("ENVELOPE_PAUSE", 0.5))  # Pause between batches (seconds)
+
+OLD_NOTES_QUERY = hot_query("convert_batch", """
+    SELECT notes.id, notes.header, notes.content, notes.tags, notes.body, notes.aes_key,
+           notes.from_user_id, users.username
+    FROM notes
+    INNER JOIN users ON users.id = notes.from_user_id
+    WHERE notes.id > ? AND notes.indexed = 0
+    ORDER BY notes.id LIMIT ?
+""")
+OLD_ACCESSES_QUERY = hot_query("convert_batch (accesses)", """
+    SELECT note_id, user_id, key FROM accesses WHERE note_id > ? AND note_id <= ?
+""")
+CONVERT_NOTE_QUERY = hot_query("convert_batch (note)", """
+    UPDATE notes SET header = '', content = '', tags = NULL, body = ?, aes_key = ?, indexed = 1
+    WHERE id = ? AND body IS NULL
+""")
+INDEX_NOTE_QUERY = hot_query("convert_batch (index)", """
+    UPDATE notes SET indexed = 1 WHERE id = ? AND indexed = 0
+""")
+
+converter_stats = { "converted": 0, "indexed": 0, "failed": 0, "bytes_before": 0, "bytes_after": 0 }
+_stopping = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def convert_batch(after_id: int, limit: int) -> int | None:
+    """
+    Rewrite batch of old notes (3 base64 fields) to binary envelopes and raw wrapped keys,
+    and write blind tokens of tags and words for notes which aren't indexed yet
+    :param after_id: convert notes with id greater than it
+    :param limit: count of notes
+    :return: id of last processed note or None if nothing left
+    """
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(OLD_NOTES_QUERY, (after_id, limit))
+        rows = cursor.fetchall()
+
+    if not rows:
+        return None
+
+    # Decrypt and encrypt outside of transaction
+    updates = []
+    for note_id, header, content, tags, body, aes_key, owner_id, username in rows:
+        try:
+            wrapped_key = load_wrapped_key(aes_key)
+            secret_key = decrypt_wrapped_key(username, wrapped_key)
+
+            if body is None:  # Old note
+                fields = { "header": symmetric_decrypt_data(secret_key, header),
+                           "content": symmetric_decrypt_data(secret_key, content),
+                           "tags": symmetric_decrypt_data(secret_key, tags) if tags is not None else None }
+                body = encrypt_envelope(secret_key, fields["header"], fields["content"], fields["tags"])
+            else:
+                fields, wrapped_key = decrypt_envelope(secret_key, body), None
+        except Exception as e:
+            print(e)
+            converter_stats["failed"] += 1
+            continue
+
+        tokens = tag_tokens(owner_id, fields["tags"])
+        words = search_tokens(owner_id, fields["header"], fields["content"])
+        updates.append((note_id, body if wrapped_key else None, wrapped_key, owner_id, tokens, words))
+
+        if wrapped_key:
+            converter_stats["bytes_before"] += len(header) + len(content) + len(tags or "") + len(aes_key)
+            converter_stats["bytes_after"] += len(body) + len(wrapped_key)
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        for note_id, body, wrapped_key, owner_id, tokens, words in updates:
+            # Note could be edited meanwhile, then it's already converted and indexed
+            if body is not None:
+                cursor.execute(CONVERT_NOTE_QUERY, (body, wrapped_key, note_id))
+                converter_stats["converted"] += cursor.rowcount
+            else:
+                cursor.execute(INDEX_NOTE_QUERY, (note_id,))
+
+            if not cursor.rowcount:
+                continue
+
+            cursor.execute(DELETE_NOTE_TAGS_QUERY, (note_id,))
+            set_tag_tokens(cursor, note_id, tokens)
+            set_search_tokens(cursor, note_id, owner_id, words)
+            converter_stats["indexed"] += 1
+
+        # Wrapped keys of accesses only need decoding from base64
+        cursor.execute(OLD_ACCESSES_QUERY, (after_id, rows[-1][0]))
+        keys = [(load_wrapped_key(key), note_id, user_id) for note_id, user_id, key in cursor.fetchall()
+                if load_wrapped_key(key) != key]
+
+        cursor.executemany(UPDATE_ACCESS_KEY_QUERY, keys)
+
+        conn.commit()
+
+    return rows[-1][0]
+
+
+def start_converter() -> None:
+    """
+    Start background thread which converts and indexes all old notes
+    """
+
+    global _thread
+
+    if not ENVELOPE_CONVERTER:
+        return
+
+    def run() -> None:
+        last_id = 0
+        while not _stopping.is_set():
+            try:
+                last_id = convert_batch(last_id, ENVELOPE_BATCH)
+            except Exception as e:
+                print(e)
+                return
+
+            if last_id is None:  # All notes are converted and indexed
+                return
+
+            _stopping.wait(ENVELOPE_PAUSE)
+
+    _stopping.clear()
+    _thread = threading.Thread(target=run, name="envelopes", daemon=True)
+    _thread.start()
+
+
+def stop_converter() -> None:
+    global _thread
+
+    if _thread is not None:
+        _stopping.set()
+        _thread.join()
+        _thread = None
+
+
+def get_converter_stats() -> dict:
+    stats = dict(converter_stats)
+    stats["bytes_saved_per_note"] = ((stats["bytes_before"] - stats["bytes_after"]) / stats["converted"]
+                                     if stats["converted"] else 0)
+
+    return stats
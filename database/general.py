@@ -1,83 +1,99 @@
-import sqlite3, os
+import sqlite3, os, threading, asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
 from dotenv import load_dotenv
 
+from .migrations import migrate, check_query_plans, hot_query
+from secure import metrics
+
 
 load_dotenv()
 DB_PATH = os.getenv("DB_PATH")
 
+# Connection tuning
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", 5000))  # ms to wait for locked db
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", -16000))  # Negative value is size in KiB
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", 64 * 1024 * 1024))  # Bytes
+
+# Dedicated threads for db queries from async handlers
+DB_WORKERS = int(os.getenv("DB_WORKERS", 8))
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+_local = threading.local()  # Connection for every thread
+_connections: list[sqlite3.Connection] = []  # All opened connections (to close them on shutdown)
+_connections_lock = threading.Lock()
+
+CHECK_EXISTING_EMAIL_QUERY = hot_query("check_existing_email", """
+    SELECT * FROM users WHERE email = ?
+""")
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Get connection to db which is reused by current thread.
+    Usage is the same as sqlite3.connect(): "with get_connection() as conn" commits or rollbacks,
+    but doesn't close connection
+    """
+
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        check_db_dir()
+
+        # Connection is used only by own thread, but can be closed from main thread on shutdown
+        conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT / 1000, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")  # Safe with WAL, fsync only on checkpoints
+        conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}")
+        conn.execute(f"PRAGMA cache_size = {DB_CACHE_SIZE}")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        if metrics.METRICS_ENABLED:
+            conn.row_factory = metrics.count_row  # Rows are still tuples
+        metrics.db_connections.inc()
+
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+
+    return conn
+
+
+def close_connections() -> None:
+    """
+    Close all opened connections (on shutdown)
+    """
+
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+
+    _local.__dict__.clear()
+
+
+async def run_db(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run blocking db function in db executor without blocking event loop
+    """
+
+    call = metrics.call_timed(metrics.db_seconds, (func.__name__,), "db", func, *args, **kwargs)
+
+    return await asyncio.get_running_loop().run_in_executor(db_executor, call)
+
 
 def init_db() -> None:
     """
-    Initialization db: Create db and tables (if not exists yet)
+    Initialization db: Create db and apply new migrations of schema
     """
 
     check_db_dir()
 
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
+    with get_connection() as conn:
+        migrate(conn)
 
-        # Table users
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                is_admin BOOLEAN DEFAULT 0,
-                public_key TEXT UNIQUE NOT NULL
-            );
-        """)
-
-        # Table notes
-        cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS notes (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        header TEXT NOT NULL,
-                        content TEXT NOT NULL,
-                        tags TEXT,
-                        aes_key TEXT UNIQUE NOT NULL,
-                        from_user_id INTEGER NOT NULL,
-                        created_time TEXT NOT NULL,
-                        last_edit_time TEXT,
-                        last_edit_user INTEGER,
-                        FOREIGN KEY (from_user_id) REFERENCES users(id)
-                    );
-                """)
-
-        # Table statistics
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS statistics (
-                user_id INTEGER NOT NULL,
-                count_creating_note INTEGER NOT NULL,
-                count_reading_note INTEGER NOT NULL,
-                count_deleting_note INTEGER NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            );
-        """)
-
-        # Table accesses
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS accesses (
-                note_id INTEGER,
-                user_id INTEGER,
-                permission INTEGER NOT NULL,
-                key TEXT UNIQUE NOT NULL,
-                FOREIGN KEY (note_id) REFERENCES notes(id),
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                PRIMARY KEY (note_id, user_id)
-            );
-        """)
-
-        # Table restore password
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS password_restore (
-                user_id INTEGER,
-                key TEXT UNIQUE NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            );
-        """)
-
-        conn.commit()
+        # Fail on start if some hot query doesn't use index (for development)
+        if os.getenv("DB_CHECK_PLANS") == "1":
+            check_query_plans(conn)
 
 
 def check_existing_email(email: str) -> bool:
@@ -85,12 +101,10 @@ def check_existing_email(email: str) -> bool:
     Checking if email is already registered
     """
 
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT * FROM users WHERE email = ?
-        """, (email, ))
+        cursor.execute(CHECK_EXISTING_EMAIL_QUERY, (email, ))
 
         user = cursor.fetchone()
         if user:
@@ -100,5 +114,6 @@ def check_existing_email(email: str) -> bool:
 
 
 def check_db_dir() -> None:
-    if not os.path.exists("db"):
-        os.mkdir("db")
+    db_dir = os.path.dirname(DB_PATH)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
@@ -0,0 +1,62 @@
+import os, uuid
+from datetime import datetime
+from dotenv import load_dotenv
+
+from secure.caching import TTLCache
+
+
+load_dotenv()
+JOBS_KEEP = int(os.getenv("JOBS_KEEP", 1024))  # Max jobs of every kind kept in memory
+JOBS_TTL = float(os.getenv("JOBS_TTL", 24 * 60 * 60))  # Seconds since last progress of job
+JOB_MAX_ERRORS = int(os.getenv("JOB_MAX_ERRORS", 1000))  # Max reported errors for one job
+
+JOB_KINDS = ("import", "purge")
+
+# Status of long background jobs by id, separately for every kind (many imports don't evict status of purge)
+jobs = { kind: TTLCache(maxsize=JOBS_KEEP, ttl=JOBS_TTL) for kind in JOB_KINDS }
+
+
+def create_job(kind: str, owner_id: int | None = None) -> dict:
+    job = { "id": uuid.uuid4().hex, "kind": kind, "owner_id": owner_id, "status": "waiting",
+            "processed": 0, "done": 0, "failed": 0, "errors": [],
+            "created_time": datetime.now().strftime("%H:%M:%S %d-%m-%Y"), "finished_time": None }
+    jobs[kind].set(job["id"], job)
+
+    return job
+
+
+def get_job(kind: str, job_id: str, owner_id: int | None = None) -> dict | None:
+    """
+    Get job of this kind by id (only if it belongs to owner, when owner is given)
+    """
+
+    job = jobs[kind].get(job_id)
+    if job is None or (owner_id is not None and job["owner_id"] != owner_id):
+        return None
+
+    return job
+
+
+def update_job(job: dict, processed: int = 0, done: int = 0, errors: list[dict] | None = None) -> None:
+    """
+    Add progress of job and keep it in memory for next JOBS_TTL seconds
+    """
+
+    job["status"] = "running"
+    job["processed"] += processed
+    job["done"] += done
+    for error in errors or []:
+        job["failed"] += 1
+        if len(job["errors"]) < JOB_MAX_ERRORS:
+            job["errors"].append(error)
+
+    jobs[job["kind"]].set(job["id"], job)
+
+
+def finish_job(job: dict, error: str | None = None) -> None:
+    job["status"] = "failed" if error else "done"
+    if error:
+        job["error"] = error
+    job["finished_time"] = datetime.now().strftime("%H:%M:%S %d-%m-%Y")
+
+    jobs[job["kind"]].set(job["id"], job)
@@ -0,0 +1,188 @@
+import sqlite3
+
+
+# Ordered migrations of schema: version of db after migration = index + 1.
+# Never change applied migrations, add new one to the end
+MIGRATIONS: list[list[str]] = [
+    # 1: Base tables
+    [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            is_admin BOOLEAN DEFAULT 0,
+            public_key TEXT UNIQUE NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            header TEXT NOT NULL,
+            content TEXT NOT NULL,
+            tags TEXT,
+            aes_key TEXT UNIQUE NOT NULL,
+            from_user_id INTEGER NOT NULL,
+            created_time TEXT NOT NULL,
+            last_edit_time TEXT,
+            last_edit_user INTEGER,
+            FOREIGN KEY (from_user_id) REFERENCES users(id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS statistics (
+            user_id INTEGER NOT NULL,
+            count_creating_note INTEGER NOT NULL,
+            count_reading_note INTEGER NOT NULL,
+            count_deleting_note INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS accesses (
+            note_id INTEGER,
+            user_id INTEGER,
+            permission INTEGER NOT NULL,
+            key TEXT UNIQUE NOT NULL,
+            FOREIGN KEY (note_id) REFERENCES notes(id),
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            PRIMARY KEY (note_id, user_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS password_restore (
+            user_id INTEGER,
+            key TEXT UNIQUE NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+        """,
+    ],
+
+    # 2: Blind indexes of tags (HMAC token for every normalized tag) and words (rowid is note id)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS note_tags (
+            note_id INTEGER NOT NULL,
+            token BLOB NOT NULL,
+            FOREIGN KEY (note_id) REFERENCES notes(id),
+            PRIMARY KEY (note_id, token)
+        ) WITHOUT ROWID;
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_note_tags_token ON note_tags (token, note_id);",
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS notes_search USING fts5 (
+            header,
+            content,
+            user_id UNINDEXED
+        );
+        """,
+    ],
+
+    # 3: Secondary indexes for hot queries
+    [
+        "CREATE INDEX IF NOT EXISTS idx_notes_from_user_id ON notes (from_user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_accesses_user_id ON accesses (user_id, note_id);",
+        "CREATE INDEX IF NOT EXISTS idx_statistics_user_id ON statistics (user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_password_restore_user_id ON password_restore (user_id);",
+    ],
+
+    # 4: X25519 public keys of users (for ECIES wrapping of aes_keys)
+    [
+        "ALTER TABLE users ADD COLUMN x25519_public_key TEXT;",
+    ],
+
+    # 5: Binary envelope of note (header, content and tags are empty for such notes)
+    [
+        "ALTER TABLE notes ADD COLUMN body BLOB;",
+    ],
+
+    # 6: Queue of email notifications (sent in background)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            receiver TEXT NOT NULL,
+            text TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_try REAL NOT NULL
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_notifications_next_try ON notifications (next_try);",
+    ],
+
+    # 7: Blind tokens keyed by owner of note: old global tag tokens are dropped,
+    # tokens of all old notes are written again by converter (notes.indexed = 0)
+    [
+        "ALTER TABLE notes ADD COLUMN indexed INTEGER NOT NULL DEFAULT 0;",
+        "CREATE INDEX IF NOT EXISTS idx_notes_not_indexed ON notes (id) WHERE indexed = 0;",
+        "DELETE FROM note_tags;",
+    ],
+]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Apply new migrations in one transaction (version of schema is stored in PRAGMA user_version)
+    :return: current version of schema
+    """
+
+    # Lock db for writing, so other process can't apply the same migrations
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                conn.execute(statement)
+
+            conn.execute(f"PRAGMA user_version = {number}")
+
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+    return len(MIGRATIONS)
+
+
+# Hot queries of DAO functions (with placeholders) which must use indexes, they are registered by DAO modules
+HOT_QUERIES: dict[str, str] = {}
+
+
+def hot_query(name: str, query: str) -> str:
+    """
+    Register query of DAO function for check of its plan
+    :return: the same query (DAO function uses it)
+    """
+
+    HOT_QUERIES[name] = query
+
+    return query
+
+
+def check_query_plans(conn: sqlite3.Connection) -> None:
+    """
+    Check by EXPLAIN QUERY PLAN that no hot query scans whole table
+    (all DAO modules must be imported, so their queries are registered)
+    :raise RuntimeError: if some query makes full scan
+    """
+
+    errors = []
+    for name, query in HOT_QUERIES.items():
+        params = [None] * query.count("?")
+
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params):
+            detail = row[3]
+            # Scans of subqueries and of SELECT without table are allowed
+            if not detail.startswith("SCAN ") or detail.startswith("SCAN (") or detail == "SCAN CONSTANT ROW":
+                continue
+
+            # Virtual table (full-text index) is scanned by its own index: "INDEX 0:M1", full scan is "INDEX 0:"
+            if "VIRTUAL TABLE" in detail and not detail.endswith(":"):
+                continue
+
+            errors.append(f"{name}: {detail}")
+
+    if errors:
+        raise RuntimeError("Queries without index:\n" + "\n".join(errors))
@@ -1,66 +1,296 @@
-import sqlite3, base64
+import sqlite3
 from models.notes import NoteInternalModel, NoteUpdateInternalModel
 from typing import Optional
 
-from .general import DB_PATH
+from .general import get_connection
+from .migrations import hot_query
 from .accesses import check_is_owner_of_note
+from . import statistics
+from cipher.decrypting import forget_aes_keys
+from cipher import indexing
 
 
-def add_note(note: NoteInternalModel, from_user: int) -> None:
+NOTE_FIELDS = ("header", "content", "tags", "from_user_id", "created_time", "last_edit_time", "last_edit_user")
+ENCRYPTED_FIELDS = ("header", "content", "tags")
+
+
+def note_columns(fields: Optional[list[str]], key_column: str) -> tuple[list[str], str]:
+    """
+    Columns to select for requested fields of note
+    :param fields: requested fields (None - all of them)
+    :param key_column: column with wrapped AES key for this part of query
+    :return: names of selected values (after id) and SQL list of columns
+    """
+
+    names = [field for field in NOTE_FIELDS if fields is None or field in fields]
+    columns = list(names)
+
+    # Encrypted fields need wrapped key, and envelope for new notes
+    if any(field in ENCRYPTED_FIELDS for field in names):
+        names += ["aes_key", "body"]
+        columns += [key_column, "body"]
+
+    return names, ", ".join(["notes.id"] + columns)
+
+
+def tags_filter(tokens_count: Optional[int], match_all: bool) -> str:
+    """
+    Filter of notes by tags with index on note_tags
+    :param tokens_count: count of tag tokens (None - without filter)
+    """
+
+    if tokens_count is None:
+        return ""
+    if tokens_count == 0:  # No tokens can match
+        return "AND 0"
+
+    return f"""
+        AND notes.id IN (SELECT note_id FROM note_tags WHERE token IN ({", ".join("?" * tokens_count)})
+                         GROUP BY note_id {"HAVING COUNT(*) = ?" if match_all else ""})
+    """
+
+
+def get_all_notes_query(fields: Optional[list[str]], own_tokens: Optional[int] = None,
+                        shared_tokens: Optional[int] = None, match_all: bool = False,
+                        keyset: bool = False) -> tuple[list[str], str]:
+    """
+    Query of notes page for get_all_notes
+    :param own_tokens: count of tag tokens for own notes (None - without filter by tags)
+    :param shared_tokens: count of tag tokens for shared notes (tokens of all their owners)
+    :param keyset: page after cursor (otherwise by offset)
+    :return: names of selected values (after id) and query
+    """
+
+    names, own_columns = note_columns(fields, "aes_key")
+    _, shared_columns = note_columns(fields, "accesses.key")
+    own_filter = tags_filter(own_tokens, match_all)
+    shared_filter = tags_filter(shared_tokens, match_all)
+
+    if not keyset:
+        return names, f"""
+            SELECT * FROM (
+                SELECT {own_columns} FROM notes WHERE from_user_id = ? {own_filter}
+                UNION
+                SELECT {shared_columns} FROM notes
+                INNER JOIN accesses ON notes.id = accesses.note_id WHERE accesses.user_id = ? {shared_filter}
+            )
+            ORDER BY id LIMIT ? OFFSET ?
+        """
+
+    # Keyset: both parts seek by index from cursor and read at most :limit rows
+    return names, f"""
+        SELECT * FROM (
+            SELECT {own_columns} FROM notes WHERE from_user_id = ? AND id > ? {own_filter}
+            ORDER BY id LIMIT ?
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT {shared_columns} FROM accesses
+            INNER JOIN notes ON notes.id = accesses.note_id
+            WHERE accesses.user_id = ? AND accesses.note_id > ? {shared_filter}
+            ORDER BY accesses.note_id LIMIT ?
+        )
+        ORDER BY id LIMIT ?
+    """
+
+
+def get_note_by_id_query(fields: Optional[list[str]]) -> tuple[list[str], str]:
+    names, own_columns = note_columns(fields, "aes_key")
+    _, shared_columns = note_columns(fields, "accesses.key")
+
+    return names, f"""
+        SELECT {own_columns} FROM notes
+        WHERE id = ? AND from_user_id = ?
+        UNION
+        SELECT {shared_columns} FROM notes
+        INNER JOIN accesses ON notes.id = accesses.note_id
+        WHERE accesses.note_id = ? AND accesses.user_id = ?
+    """
+
+
+hot_query("get_all_notes", get_all_notes_query(None)[1])
+hot_query("get_all_notes (tags)", get_all_notes_query(None, 2, 4)[1])
+hot_query("get_all_notes (cursor)", get_all_notes_query(None, keyset=True)[1])
+hot_query("get_all_notes (cursor, all tags)", get_all_notes_query(None, 2, 4, True, True)[1])
+
+SHARING_OWNERS_QUERY = hot_query("get_all_notes (owners of shared notes)", """
+    SELECT DISTINCT notes.from_user_id FROM accesses
+    INNER JOIN notes ON notes.id = accesses.note_id
+    WHERE accesses.user_id = ?
+""")
+hot_query("get_note_by_id", get_note_by_id_query(None)[1])
+
+SEARCH_NOTES_QUERY = hot_query("search_notes", """
+    SELECT notes.id, notes.header, notes.content, notes.tags, notes.aes_key, notes.from_user_id,
+           notes.created_time, notes.last_edit_time, notes.last_edit_user, notes.body
+    FROM notes_search
+    INNER JOIN notes ON notes.id = notes_search.rowid
+    WHERE notes_search MATCH ? AND notes_search.user_id = ? AND notes.from_user_id = ?
+    ORDER BY bm25(notes_search, 2.0, 1.0) LIMIT ? OFFSET ?
+""")
+GET_SHARED_KEY_QUERY = hot_query("get_aes_key", """
+    SELECT key FROM accesses WHERE note_id = ? AND user_id = ?
+""")
+CHECK_ACCESS_QUERY = hot_query("check_access", """
+    SELECT * FROM notes WHERE id = ? AND (from_user_id = ? OR
+    EXISTS (SELECT 1 FROM accesses WHERE note_id = ? AND user_id = ? AND permission = 2))
+""")
+
+# Rows which are deleted with note
+DELETE_NOTE_ACCESSES_QUERY = hot_query("delete accesses of note", """
+    DELETE FROM accesses WHERE note_id = ?
+""")
+DELETE_NOTE_TAGS_QUERY = hot_query("delete tags of note", """
+    DELETE FROM note_tags WHERE note_id = ?
+""")
+DELETE_NOTE_SEARCH_QUERY = hot_query("delete search tokens of note", """
+    DELETE FROM notes_search WHERE rowid = ?
+""")
+
+ADDED_NOTES_QUERY = hot_query("add_notes (ids)", """
+    SELECT id FROM notes WHERE id > ? ORDER BY id
+""")
+GET_NOTE_OWNER_QUERY = hot_query("get_note_owner", """
+    SELECT from_user_id FROM notes WHERE id = ?
+""")
+GET_OWN_KEY_QUERY = hot_query("get_aes_key (owner)", """
+    SELECT aes_key FROM notes WHERE id = ?
+""")
+DELETE_OWN_NOTE_QUERY = hot_query("delete_note_by_id", """
+    DELETE FROM notes WHERE id = ? AND from_user_id = ?
+""")
+UPDATE_NOTE_QUERY = hot_query("update_note", """
+    UPDATE notes SET header = ?, content = ?, tags = ?, body = ?, last_edit_time = ?, last_edit_user = ?, indexed = 1
+    WHERE id = ?
+""")
+
+
+def add_note(note: NoteInternalModel, from_user: int, tag_tokens: list[bytes], search_tokens: tuple[str, str]) -> None:
     """
     Add new note to db
     :param note: all info about this note (header, content, tags)
     :param from_user: user's id who wants to get his notes
+    :param tag_tokens: blind index tokens of note's tags
+    :param search_tokens: blind word tokens of header and content
     """
 
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        print(len(note.aes_key))
-        key_str = base64.b64encode(note.aes_key).decode()
-
         cursor.execute("""
-            INSERT INTO notes (header, content, tags, aes_key, created_time, from_user_id) VALUES (?, ?, ?, ?, ?, ?)
-        """, (note.header, note.text, note.tags, key_str, note.created_time, from_user))
+            INSERT INTO notes (header, content, tags, body, aes_key, created_time, from_user_id, indexed) VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+        """, (note.header, note.text, note.tags, note.body, note.aes_key, note.created_time, from_user))
+        note_id = cursor.lastrowid
+        set_tag_tokens(cursor, note_id, tag_tokens)
+        set_search_tokens(cursor, note_id, from_user, search_tokens)
         conn.commit()
 
         # Increment counter for creating notes
-        cursor.execute("""
-            UPDATE statistics SET count_creating_note = count_creating_note + 1 
-            WHERE user_id = ? 
-        """, (from_user,))
-        conn.commit()
+        statistics.increment(from_user, created=1)
+
+
+def add_notes(notes: list[NoteInternalModel], from_user: int,
+              tag_tokens: list[list[bytes]], search_tokens: list[tuple[str, str]],
+              all_or_nothing: bool = False) -> list[int | str]:
+    """
+    Add many notes of one user to db in one transaction
+    :param notes: encrypted notes
+    :param from_user: user's id who adds notes
+    :param tag_tokens: blind index tokens of tags for every note
+    :param search_tokens: blind word tokens for every note
+    :param all_or_nothing: if one note can't be added, nothing is added
+    :return: id of every added note or error of db if it wasn't added
+    """
+
+    rows = [(note.header, note.text, note.tags, note.body, note.aes_key, note.created_time, from_user)
+            for note in notes]
+    query = """
+        INSERT INTO notes (header, content, tags, body, aes_key, created_time, from_user_id, indexed) VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+    """
 
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-def get_all_notes(user_id: int, offset: int, limit: int, tags: Optional[str]) -> dict:
+        # Write lock for whole batch, so ids of new notes are all greater than current max
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            last_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM notes").fetchone()[0]
+
+            cursor.execute("SAVEPOINT bulk")
+            try:
+                cursor.executemany(query, rows)
+                note_ids = [row[0] for row in cursor.execute(ADDED_NOTES_QUERY, (last_id,))]
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK TO bulk")
+                if all_or_nothing:
+                    raise
+
+                # Find bad notes one by one and keep the rest
+                note_ids = []
+                for row in rows:
+                    try:
+                        cursor.execute(query, row)
+                        note_ids.append(cursor.lastrowid)
+                    except sqlite3.Error as e:
+                        note_ids.append(str(e))
+            cursor.execute("RELEASE bulk")
+
+            added = [(note_id, tokens, words) for note_id, tokens, words in zip(note_ids, tag_tokens, search_tokens)
+                     if isinstance(note_id, int)]
+            cursor.executemany("""
+                INSERT OR IGNORE INTO note_tags (note_id, token) VALUES (?, ?)
+            """, [(note_id, token) for note_id, tokens, _ in added for token in tokens])
+            cursor.executemany("""
+                INSERT INTO notes_search (rowid, header, content, user_id) VALUES (?, ?, ?, ?)
+            """, [(note_id, words[0], words[1], from_user) for note_id, _, words in added])
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    # Increment counter for creating notes once for batch
+    statistics.increment(from_user, created=len(added))
+
+    return note_ids
+
+
+def get_all_notes(user_id: int, offset: int, limit: int,
+                  tags: Optional[list[str]] = None, match_all: bool = False,
+                  after_id: Optional[int] = None, fields: Optional[list[str]] = None) -> dict:
     """
     Getting all notes for users by his id
     :param user_id: user's id who want to get his notes
     :param offset: offset from the start of the available notes
     :param limit: count notes for 1 query
-    :param tags: filter notes by tags
+    :param tags: filter notes by normalized tags (by their blind index tokens)
+    :param match_all: note must have all tags (otherwise any of them)
+    :param after_id: cursor, get notes with id greater than it (offset is ignored)
+    :param fields: select only these fields of notes (None - all of them)
     """
 
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        # Query and parameters
-        query = f"""
-            SELECT * FROM (
-                SELECT * FROM notes WHERE from_user_id = ? 
-                UNION
-                SELECT id, header, content, tags, accesses.key, from_user_id,
-                    created_time, last_edit_time, last_edit_user 
-                FROM notes 
-                INNER JOIN accesses ON notes.id = accesses.note_id WHERE accesses.user_id = ?
-            )
-            {"WHERE tags LIKE %?%" if tags is not None else ""} ORDER BY id LIMIT ? OFFSET ?
-        """
-        params = [user_id, user_id, tags, limit, offset]
-
-        # If tags is None then remove it from parameters
-        if not tags:
-            params.remove(tags)
+        # Tokens are keyed by owner of note: own tokens and tokens of every user who shared notes
+        own_params, shared_params = [], []
+        if tags:
+            cursor.execute(SHARING_OWNERS_QUERY, (user_id,))
+            own_params = indexing.tag_tokens(user_id, tags)
+            shared_params = [token for row in cursor.fetchall() for token in indexing.tag_tokens(row[0], tags)]
+
+        names, query = get_all_notes_query(fields, len(own_params) if tags else None,
+                                           len(shared_params) if tags else None, match_all, after_id is not None)
+        if tags and match_all:
+            own_params.append(len(tags))
+            if shared_params:
+                shared_params.append(len(tags))
+
+        if after_id is None:
+            params = [user_id, *own_params, user_id, *shared_params, limit, offset]
+        else:
+            params = [user_id, after_id, *own_params, limit,
+                      user_id, after_id, *shared_params, limit, limit]
 
         cursor.execute(query, params)
 
@@ -69,67 +299,94 @@ def get_all_notes(user_id: int, offset: int, limit: int, tags: Optional[str]) ->
             return { "message": "No notes found!" }
 
         # Increase counter for reading notes
-        cursor.execute("""
-            UPDATE statistics SET count_reading_note = count_reading_note + ? 
-            WHERE user_id = ? 
-        """, (len(data), user_id))
-        conn.commit()
+        statistics.increment(user_id, read=len(data))
 
         # Return dictionary in understandable format
-        return { item[0]: { "header": item[1], "content": item[2], "tags": item[3],
-                            "aes_key": item[4], "from_user_id": item[5],
-                            "created_time": item[6], "last_edit_time": item[7], "last_edit_user": item[8] }
-                 for item in data }
+        return { item[0]: dict(zip(names, item[1:])) for item in data }
 
 
-def get_note_by_id(note_id: int, user_id: int) -> dict:
+def get_note_by_id(note_id: int, user_id: int, fields: Optional[list[str]] = None) -> dict:
     """
     Get note by id for user if he has access for this note
+    :param fields: select only these fields of note (None - all of them)
     """
 
-    with sqlite3.connect(DB_PATH) as conn:
+    names, query = get_note_by_id_query(fields)
+
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT id, header, content, tags, aes_key, from_user_id, created_time, last_edit_time, last_edit_user FROM notes
-            WHERE id = ? AND from_user_id = ?
-            UNION
-            SELECT id, header, content, tags, accesses.key, from_user_id, created_time, last_edit_time, last_edit_user FROM notes
-            INNER JOIN accesses ON notes.id = accesses.note_id
-            WHERE accesses.note_id = ? AND accesses.user_id = ?
-        """, (note_id, user_id, note_id, user_id))
+        cursor.execute(query, (note_id, user_id, note_id, user_id))
 
         data = cursor.fetchone()
         if not data:
             return { "message": f"Note not found or access denied!" }
 
         # Increment counter for reading notes
-        cursor.execute("""
-                            UPDATE statistics SET count_reading_note = count_reading_note + 1 
-                            WHERE user_id = ? 
-                        """, (user_id,))
-        conn.commit()
+        statistics.increment(user_id, read=1)
+
+        return { "id": data[0], **dict(zip(names, data[1:])) }
+
+
+def search_notes(user_id: int, query: str, offset: int, limit: int) -> dict:
+    """
+    Search own notes of user by full-text index of blind word tokens
+    :param user_id: user's id who searches
+    :param query: full-text query of blind tokens
+    :param offset: offset from the start of found notes
+    :param limit: count notes for 1 query
+    :return: found notes by id (most relevant first)
+    """
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        # Header words are more relevant than content words
+        cursor.execute(SEARCH_NOTES_QUERY, (query, user_id, user_id, limit, offset))
+
+        data = cursor.fetchall()
+        if not data:  # If nothing found
+            return { "message": "No notes found!" }
+
+        # Increase counter for reading notes
+        statistics.increment(user_id, read=len(data))
+
+        return { item[0]: { "header": item[1], "content": item[2], "tags": item[3],
+                            "aes_key": item[4], "from_user_id": item[5],
+                            "created_time": item[6], "last_edit_time": item[7], "last_edit_user": item[8],
+                            "body": item[9] }
+                 for item in data }
+
+
+def get_note_owner(note_id: int) -> int | None:
+    """
+    Get id of user who created note
+    """
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-        return { "id": data[0], "header": data[1], "content": data[2], "tags": data[3], "aes_key": data[4],
-                 "from_user_id": data[5], "created_time": data[6], "last_edit_time": data[7], "last_edit_user": data[8] }
+        cursor.execute(GET_NOTE_OWNER_QUERY, (note_id,))
 
+        data = cursor.fetchone()
+        if not data:
+            return None
+
+        return data[0]
 
-def get_aes_key(note_id: int, user_id: int) -> str:
+
+def get_aes_key(note_id: int, user_id: int) -> str | bytes:
     """
     Get aes_key from db to access note by user_id and note_id
     """
 
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         if check_is_owner_of_note(user_id, note_id):
-            cursor.execute("""
-                SELECT aes_key FROM notes WHERE id = ?
-            """, (note_id,))
+            cursor.execute(GET_OWN_KEY_QUERY, (note_id,))
         else:
-            cursor.execute("""
-                SELECT key FROM accesses WHERE note_id = ? AND user_id = ?
-            """, (note_id, user_id))
+            cursor.execute(GET_SHARED_KEY_QUERY, (note_id, user_id))
 
         data = cursor.fetchone()
         if not data:
@@ -143,30 +400,25 @@ def delete_note_by_id(note_id: int, user_id: int) -> dict:
     Delete note by id if user is owner this note
     """
 
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            DELETE FROM notes WHERE id = ? AND from_user_id = ?
-        """, (note_id, user_id))
+        cursor.execute(DELETE_OWN_NOTE_QUERY, (note_id, user_id))
 
         # If not exist note with :note_id or this user isn't owner this note
         if cursor.rowcount == 0:
             return { "message": "Note not found or access denied!" }
 
-        # Delete all accesses for this note
-        cursor.execute("""
-            DELETE FROM accesses WHERE note_id = ?
-        """, (note_id,))
+        # Delete all accesses and tags for this note
+        cursor.execute(DELETE_NOTE_ACCESSES_QUERY, (note_id,))
+        cursor.execute(DELETE_NOTE_TAGS_QUERY, (note_id,))
+        cursor.execute(DELETE_NOTE_SEARCH_QUERY, (note_id,))
 
         conn.commit()
+        forget_aes_keys(note_id)
 
         # Increment counter for deleting notes
-        cursor.execute("""
-                    UPDATE statistics SET count_deleting_note = count_deleting_note + 1 
-                    WHERE user_id = ? 
-                """, (user_id,))
-        conn.commit()
+        statistics.increment(user_id, deleted=1)
 
         return { "message": "Note has been successfully deleted" }
 
@@ -176,28 +428,53 @@ def check_access(note_id: int, user_id: int) -> bool:
     Check user access to note
     """
 
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT * FROM notes WHERE id = ? AND (from_user_id = ? OR 
-            EXISTS (SELECT 1 FROM accesses WHERE note_id = ? AND user_id = ? AND permission = 2))
-        """, (note_id, user_id, note_id, user_id))
+        cursor.execute(CHECK_ACCESS_QUERY, (note_id, user_id, note_id, user_id))
 
         return bool(cursor.fetchone())
 
 
-def update_note(note: NoteUpdateInternalModel) -> dict:
+def update_note(note: NoteUpdateInternalModel, tag_tokens: list[bytes], search_tokens: tuple[str, str]) -> dict:
     """
     Update note in db after editing
     """
 
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            UPDATE notes SET header = ?, content = ?, tags = ?, last_edit_time = ?, last_edit_user = ? WHERE id = ?
-        """, (note.header, note.text, note.tags, note.last_edit_time, note.last_edit_user, note.id))
+        cursor.execute(UPDATE_NOTE_QUERY, (note.header, note.text, note.tags, note.body,
+                                           note.last_edit_time, note.last_edit_user, note.id))
+
+        # Replace tags tokens
+        cursor.execute(DELETE_NOTE_TAGS_QUERY, (note.id,))
+        set_tag_tokens(cursor, note.id, tag_tokens)
+
+        # Replace search tokens
+        cursor.execute(GET_NOTE_OWNER_QUERY, (note.id,))
+        set_search_tokens(cursor, note.id, cursor.fetchone()[0], search_tokens)
         conn.commit()
 
         return { "message": "Note has successfully updated" }
+
+
+def set_tag_tokens(cursor: sqlite3.Cursor, note_id: int, tag_tokens: list[bytes]) -> None:
+    """
+    Write blind index tokens of note's tags (in transaction of caller)
+    """
+
+    cursor.executemany("""
+        INSERT OR IGNORE INTO note_tags (note_id, token) VALUES (?, ?)
+    """, [(note_id, token) for token in tag_tokens])
+
+
+def set_search_tokens(cursor: sqlite3.Cursor, note_id: int, owner_id: int, search_tokens: tuple[str, str]) -> None:
+    """
+    Replace blind word tokens of note in full-text index (in transaction of caller)
+    """
+
+    cursor.execute(DELETE_NOTE_SEARCH_QUERY, (note_id,))
+    cursor.execute("""
+        INSERT INTO notes_search (rowid, header, content, user_id) VALUES (?, ?, ?, ?)
+    """, (note_id, search_tokens[0], search_tokens[1], owner_id))
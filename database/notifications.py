@@ -0,0 +1,153 @@
+import os, time, sqlite3, threading
+from dotenv import load_dotenv
+
+from .general import get_connection
+from .migrations import hot_query
+from secure.notification import send_messages
+
+
+load_dotenv()
+NOTIFY_ENABLED = os.getenv("NOTIFY_ENABLED", "1") == "1"  # Send queued notifications in background
+NOTIFY_DELAY = float(os.getenv("NOTIFY_DELAY", 5))  # Events for one receiver during this time are sent in one email
+NOTIFY_INTERVAL = float(os.getenv("NOTIFY_INTERVAL", 1))  # Seconds between checks of queue
+NOTIFY_BATCH = int(os.getenv("NOTIFY_BATCH", 500))  # Queued events per SMTP session
+NOTIFY_BACKOFF = float(os.getenv("NOTIFY_BACKOFF", 30))  # First retry after it (seconds), then it's doubled
+NOTIFY_BACKOFF_MAX = float(os.getenv("NOTIFY_BACKOFF_MAX", 60 * 60))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", 10))  # Then event is dropped
+NOTIFY_LEASE = float(os.getenv("NOTIFY_LEASE", 10 * 60))  # Claimed events are sent again after it, if worker died
+
+DUE_QUERY = hot_query("due notifications", """
+    SELECT id, receiver, text, attempts FROM notifications WHERE next_try <= ? ORDER BY next_try LIMIT ?
+""")
+ENQUEUE_QUERY = hot_query("enqueue notification", """
+    INSERT INTO notifications (receiver, text, next_try) SELECT email, ?, ? FROM users WHERE id = ?
+""")
+CLAIM_QUERY = hot_query("claim notification", """
+    UPDATE notifications SET next_try = ? WHERE id = ?
+""")
+RETRY_QUERY = hot_query("retry notification", """
+    UPDATE notifications SET attempts = attempts + 1, next_try = ? WHERE id = ?
+""")
+DELETE_QUERY = hot_query("delete notification", """
+    DELETE FROM notifications WHERE id = ?
+""")
+
+_stopping = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def enqueue(cursor: sqlite3.Cursor, user_id: int, text: str) -> None:
+    """
+    Queue notification for user (in transaction of caller, so it's sent only if changes are committed)
+    """
+
+    cursor.execute(ENQUEUE_QUERY, (text, time.time() + NOTIFY_DELAY, user_id))
+
+
+def send_due() -> int:
+    """
+    Send due notifications, all events of one receiver in one email, by one SMTP session
+    :return: count of handled events
+    """
+
+    now = time.time()
+    with get_connection() as conn:
+        # Claim events, so other workers (processes) don't send them too
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(DUE_QUERY, (now, NOTIFY_BATCH)).fetchall()
+            conn.executemany(CLAIM_QUERY,
+                             [(now + NOTIFY_LEASE, row[0]) for row in rows])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    if not rows:
+        return 0
+
+    # Coalesce events by receiver
+    events: dict[str, list[tuple[int, str, int]]] = {}
+    for event_id, receiver, text, attempts in rows:
+        events.setdefault(receiver, []).append((event_id, text, attempts))
+
+    receivers = list(events.keys())
+    handled = 0
+
+    # Events are deleted as soon as their email is sent, so they aren't sent again if session breaks later
+    def on_result(i: int, is_sent: bool) -> None:
+        nonlocal handled
+        finish_events(receivers[i], events[receivers[i]], is_sent, now)
+        handled += 1
+
+    try:
+        send_messages([(receiver, "\n\n".join(text for _, text, _ in events[receiver])) for receiver in receivers],
+                      on_result)
+    except Exception as e:  # Server isn't available, retry the rest of them later
+        print(e)
+
+    for receiver in receivers[handled:]:
+        finish_events(receiver, events[receiver], False, now)
+
+    return len(rows)
+
+
+def finish_events(receiver: str, events: list[tuple[int, str, int]], is_sent: bool, now: float) -> None:
+    """
+    Delete sent events of receiver (or dropped after last attempt), others are retried later
+    """
+
+    done, retry = [], []
+    for event_id, _, attempts in events:
+        if is_sent or attempts + 1 >= NOTIFY_MAX_ATTEMPTS:
+            if not is_sent:
+                print(f"Notification {event_id} for {receiver} is dropped after {attempts + 1} attempts")
+            done.append((event_id,))
+        else:
+            retry.append((now + min(NOTIFY_BACKOFF * 2 ** attempts, NOTIFY_BACKOFF_MAX), event_id))
+
+    with get_connection() as conn:
+        conn.executemany(DELETE_QUERY, done)
+        conn.executemany(RETRY_QUERY, retry)
+        conn.commit()
+
+
+def start_notifier() -> None:
+    """
+    Start background thread which sends queued notifications
+    """
+
+    global _thread
+
+    if not NOTIFY_ENABLED:
+        return
+
+    def run() -> None:
+        while not _stopping.is_set():
+            try:
+                if send_due() == NOTIFY_BATCH:  # More events are waiting
+                    continue
+            except Exception as e:
+                print(e)
+
+            _stopping.wait(NOTIFY_INTERVAL)
+
+    _stopping.clear()
+    _thread = threading.Thread(target=run, name="notifications", daemon=True)
+    _thread.start()
+
+
+def stop_notifier() -> None:
+    global _thread
+
+    if _thread is not None:
+        _stopping.set()
+        _thread.join()
+        _thread = None
+
+
+def get_queue_stats() -> dict:
+    with get_connection() as conn:
+        size, retrying = conn.execute("SELECT COUNT(*), COUNT(*) FILTER (WHERE attempts > 0) FROM notifications").fetchone()
+
+    return { "queued": size, "retrying": retrying }
@@ -0,0 +1,130 @@
+import os, threading
+from dotenv import load_dotenv
+
+from .general import get_connection
+from .migrations import hot_query
+
+
+load_dotenv()
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", 1))  # Seconds between writing counters to db
+STATS_FLUSH_EVENTS = int(os.getenv("STATS_FLUSH_EVENTS", 1000))  # Or after this count of increments
+
+FLUSH_QUERY = hot_query("flush statistics", """
+    UPDATE statistics SET count_creating_note = count_creating_note + ?,
+                          count_reading_note = count_reading_note + ?,
+                          count_deleting_note = count_deleting_note + ?
+    WHERE user_id = ?
+""")
+
+# Counters not written to db yet: user_id -> [created, read, deleted]
+_pending: dict[int, list[int]] = {}
+_flushing: dict[int, list[int]] = {}  # Counters which are being written now
+_events = 0
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+
+_wakeup = threading.Event()
+_stopping = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def increment(user_id: int, created: int = 0, read: int = 0, deleted: int = 0) -> None:
+    """
+    Increase activity counters of user in memory (they are written to db in batch)
+    """
+
+    global _events
+
+    with _lock:
+        counters = _pending.setdefault(user_id, [0, 0, 0])
+        counters[0] += created
+        counters[1] += read
+        counters[2] += deleted
+
+        _events += 1
+        if _events < STATS_FLUSH_EVENTS:
+            return
+
+    # Too many events: write now
+    if _thread is not None:
+        _wakeup.set()
+    else:
+        flush()
+
+
+def get_pending(user_id: int) -> list[int]:
+    """
+    Get counters of user which aren't written to db yet: [created, read, deleted]
+    """
+
+    with _lock:
+        pending = _pending.get(user_id, [0, 0, 0])
+        flushing = _flushing.get(user_id, [0, 0, 0])
+
+        return [a + b for a, b in zip(pending, flushing)]
+
+
+def flush() -> None:
+    """
+    Write all pending counters to db in one transaction
+    """
+
+    global _pending, _flushing, _events
+
+    with _flush_lock:
+        with _lock:
+            if not _pending:
+                return
+
+            _pending, _flushing = {}, _pending
+            _events = 0
+
+        try:
+            with get_connection() as conn:
+                conn.executemany(FLUSH_QUERY, [(*counters, user_id) for user_id, counters in _flushing.items()])
+        except Exception as e:
+            print(e)
+
+            # Return counters back to write them next time
+            with _lock:
+                for user_id, counters in _flushing.items():
+                    pending = _pending.setdefault(user_id, [0, 0, 0])
+                    for i in range(3):
+                        pending[i] += counters[i]
+
+        with _lock:
+            _flushing = {}
+
+
+def start_flusher() -> None:
+    """
+    Start background thread which writes counters every STATS_FLUSH_INTERVAL
+    """
+
+    global _thread
+
+    def run() -> None:
+        while not _stopping.is_set():
+            _wakeup.wait(STATS_FLUSH_INTERVAL)
+            _wakeup.clear()
+            flush()
+
+    _stopping.clear()
+    _thread = threading.Thread(target=run, name="statistics", daemon=True)
+    _thread.start()
+
+
+def stop_flusher() -> None:
+    """
+    Stop background thread and write remaining counters (on shutdown)
+    """
+
+    global _thread
+
+    if _thread is not None:
+        _stopping.set()
+        _wakeup.set()
+        _thread.join()
+        _thread = None
+
+    flush()
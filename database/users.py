@@ -1,8 +1,71 @@
-import sqlite3
+import os, base64
 from models.admins import AdminModel
 from models.users import UserCreateModel
-from .general import DB_PATH
-from cipher.generate import generate_asymmetric_keys
+from .general import get_connection
+from .migrations import hot_query
+from . import statistics
+from cipher.generate import generate_asymmetric_keys, generate_x25519_keys
+from cipher.decrypting import forget_private_key
+from cipher.encrypting import SCHEME_X25519, X25519_WRAP_LENGTH
+from secure.caching import TTLCache
+
+
+# Short-lived cache of authenticated users by username (without password hash)
+users_cache = TTLCache(maxsize=int(os.getenv("USER_CACHE_SIZE", 4096)),
+                       ttl=float(os.getenv("USER_CACHE_TTL", 30)))
+
+GET_USER_QUERY = hot_query("get_user", """
+    SELECT * FROM users WHERE username = ?
+""")
+GET_AUTH_USER_QUERY = hot_query("get_auth_user", """
+    SELECT id, username, email, is_admin FROM users WHERE username = ?
+""")
+GET_STATISTICS_QUERY = hot_query("get_statistics", """
+    SELECT users.username,
+           users.email,
+           statistics.count_creating_note,
+           statistics.count_reading_note,
+           statistics.count_deleting_note
+    FROM users
+    INNER JOIN statistics ON users.id = statistics.user_id
+    WHERE users.id = ?
+""")
+GET_EMAIL_QUERY = hot_query("get_email", """
+    SELECT email FROM users WHERE id = ?
+""")
+GET_PUBLIC_KEYS_QUERY = hot_query("get_public_keys", """
+    SELECT public_key, x25519_public_key FROM users WHERE id = ?
+""")
+GET_PASSWORD_QUERY = hot_query("get_user_password", """
+    SELECT password FROM users WHERE id = ?
+""")
+RESET_PASSWORD_QUERY = hot_query("reset_password", """
+    UPDATE users SET password = ? WHERE id = ?
+""")
+GET_USERNAME_QUERY = hot_query("reset_password (username)", """
+    SELECT username FROM users WHERE id = ?
+""")
+ADD_STATISTICS_QUERY = hot_query("create_user (statistics)", """
+    INSERT INTO statistics VALUES ((SELECT id FROM users WHERE username = ?), ?, ?, ?)
+""")
+UPDATE_NOTE_KEY_QUERY = hot_query("update_wrapped_keys (notes)", """
+    UPDATE notes SET aes_key = ? WHERE id = ? AND from_user_id = ?
+""")
+UPDATE_ACCESS_KEY_QUERY = hot_query("update_wrapped_keys (accesses)", """
+    UPDATE accesses SET key = ? WHERE note_id = ? AND user_id = ?
+""")
+CLAIM_X25519_KEY_QUERY = hot_query("claim_x25519_public_key", """
+    UPDATE users SET x25519_public_key = ? WHERE id = ? AND x25519_public_key IS NULL
+""")
+
+
+def get_public_keys_many_query(count: int) -> str:
+    return f"""
+        SELECT id, public_key, x25519_public_key FROM users WHERE id IN ({", ".join("?" * count)})
+    """
+
+
+hot_query("get_public_keys_many", get_public_keys_many_query(2))
 
 
 def get_user(username: str) -> dict[str: str] | None:
@@ -10,41 +73,84 @@ def get_user(username: str) -> dict[str: str] | None:
     Getting user from db by username
     """
 
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT * FROM users WHERE username = ?
-        """, (username, ))
+        cursor.execute(GET_USER_QUERY, (username, ))
 
         user = cursor.fetchone()
         if user:
-            return { "id": user[0], "username": user[1], "password": user[2], "email": user[3], "is_admin": user[4] }
+            return { "id": user[0], "username": user[1], "password": user[2], "email": user[3], "is_admin": user[4],
+                     "x25519_public_key": user[6] }
 
         return None
 
 
+def get_auth_user(username: str) -> dict | None:
+    """
+    Getting user for authentication (from cache if possible), password hash isn't loaded
+    """
+
+    user = users_cache.get(username)
+    if user is None:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(GET_AUTH_USER_QUERY, (username, ))
+
+            row = cursor.fetchone()
+            if not row:
+                return None
+
+            user = { "id": row[0], "username": row[1], "email": row[2], "is_admin": row[3] }
+            users_cache.set(username, user)
+
+    return dict(user)  # Copy, so cached user can't be changed by handler
+
+
+def get_user_password(user_id: int) -> str:
+    """
+    Getting password hash of user
+    """
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(GET_PASSWORD_QUERY, (user_id,))
+
+        return cursor.fetchone()[0]
+
+
+# Drop user from cache (after changing or deleting)
+def forget_user(username: str | None = None) -> None:
+    if username is None:
+        users_cache.clear()
+        return
+
+    users_cache.delete(username)
+
+
 def create_user(user: UserCreateModel | AdminModel, is_admin=False) -> None:
     """
     Registration new user or admin and adding him to db
     """
 
-    # Get pub_key
+    # Get pub_keys
     public_key = generate_asymmetric_keys(user.username)
+    x25519_public_key = generate_x25519_keys(user.username)
+    forget_private_key(user.username)  # Old keys with the same name mustn't stay in cache
 
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         # Table users
         cursor.execute("""
-            INSERT INTO users (username, password, email, public_key, is_admin) VALUES (?, ?, ?, ?, ?)
-        """, (user.username, user.password, user.email, public_key, is_admin))
+            INSERT INTO users (username, password, email, public_key, x25519_public_key, is_admin) VALUES (?, ?, ?, ?, ?, ?)
+        """, (user.username, user.password, user.email, public_key, x25519_public_key, is_admin))
         conn.commit()
 
         # Table statistics
-        cursor.execute("""
-            INSERT INTO statistics VALUES ((SELECT id FROM users WHERE username = ?), ?, ?, ?)
-        """, (user.username, 0, 0, 0))
+        cursor.execute(ADD_STATISTICS_QUERY, (user.username, 0, 0, 0))
         conn.commit()
 
 
@@ -53,64 +159,164 @@ def reset_password(user_id: int, new_password: str) -> None:
     Reset password for user by user_id
     """
 
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            UPDATE users SET password = ? WHERE id = ?
-        """, (new_password, user_id))
+        cursor.execute(RESET_PASSWORD_QUERY, (new_password, user_id))
         conn.commit()
 
+        cursor.execute(GET_USERNAME_QUERY, (user_id,))
+
+        row = cursor.fetchone()
+        if row:
+            forget_user(row[0])
+
 
 def get_statistics(user_id: int) -> dict:
     """
     Get statistics for specific user
     """
 
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT users.username, 
-                   users.email, 
-                   statistics.count_creating_note, 
-                   statistics.count_reading_note, 
-                   statistics.count_deleting_note
-            FROM users
-            INNER JOIN statistics ON users.id = statistics.user_id 
-            WHERE users.id = ?
-        """, (user_id,))
+        cursor.execute(GET_STATISTICS_QUERY, (user_id,))
 
         data = cursor.fetchone()
         if not data or len(data) < 5:
             return { "message": "Something went wrong..." }
 
+        # Add counters which aren't written to db yet
+        created, read, deleted = statistics.get_pending(user_id)
+
         return {
             "username": data[0], "email": data[1], "statistics": {
-                "created": data[2],
-                "read": data[3],
-                "deleted": data[4]
+                "created": data[2] + created,
+                "read": data[3] + read,
+                "deleted": data[4] + deleted
             }
         }
 
 
 def get_email(user_id: int) -> str:
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT email FROM users WHERE id = ?
-        """, (user_id,))
+        cursor.execute(GET_EMAIL_QUERY, (user_id,))
 
         return cursor.fetchone()[0]
 
 
-def get_public_key(user_id: int) -> bytes:
-    with sqlite3.connect(DB_PATH) as conn:
+def get_public_keys(user_id: int) -> dict:
+    """
+    Get public keys of user for all wrapping schemes: { "rsa": PEM bytes, "x25519": raw bytes or None }
+    """
+
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT public_key FROM users WHERE id = ?
-        """, (user_id,))
+        cursor.execute(GET_PUBLIC_KEYS_QUERY, (user_id,))
 
-        return str(cursor.fetchone()[0]).encode()
+        data = cursor.fetchone()
+
+        return { "rsa": str(data[0]).encode(), "x25519": base64.b64decode(data[1]) if data[1] else None }
+
+
+def get_public_keys_many(user_ids: list[int]) -> dict:
+    """
+    Get public keys of many users by one query: { user_id: keys like in get_public_keys }
+    """
+
+    if not user_ids:
+        return {}
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(get_public_keys_many_query(len(user_ids)), user_ids)
+
+        return { row[0]: { "rsa": str(row[1]).encode(), "x25519": base64.b64decode(row[2]) if row[2] else None }
+                 for row in cursor.fetchall() }
+
+
+def claim_x25519_public_key(user_id: int, public_key: str) -> bool:
+    """
+    Set X25519 public key of user if the user has no key yet (several processes can generate keys at the same time)
+    :return: True if key is set, False if other key was set before
+    """
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(CLAIM_X25519_KEY_QUERY, (public_key, user_id))
+        conn.commit()
+
+        return cursor.rowcount == 1
+
+
+# Wrapped key isn't raw X25519 wrap (RSA wrap or base64 text of old rows)
+NOT_X25519_WRAP = f"""
+    (typeof({{column}}) != 'blob' OR length({{column}}) != {X25519_WRAP_LENGTH} OR hex(substr({{column}}, 1, 1)) != '{SCHEME_X25519:02X}')
+"""
+
+HAS_OLD_WRAPS_QUERY = hot_query("has_old_wraps", f"""
+    SELECT EXISTS (SELECT 1 FROM notes WHERE from_user_id = ? AND {NOT_X25519_WRAP.format(column="aes_key")})
+        OR EXISTS (SELECT 1 FROM accesses WHERE user_id = ? AND {NOT_X25519_WRAP.format(column="key")})
+""")
+
+OLD_WRAPS_QUERIES = {
+    "notes": hot_query("get_wrapped_keys (notes)", f"""
+        SELECT id, aes_key FROM notes
+        WHERE from_user_id = ? AND id > ? AND {NOT_X25519_WRAP.format(column="aes_key")} ORDER BY id LIMIT ?
+    """),
+    "accesses": hot_query("get_wrapped_keys (accesses)", f"""
+        SELECT note_id, key FROM accesses
+        WHERE user_id = ? AND note_id > ? AND {NOT_X25519_WRAP.format(column="key")} ORDER BY note_id LIMIT ?
+    """),
+}
+
+
+def has_old_wraps(user_id: int) -> bool:
+    """
+    Check if user has aes_keys which aren't wrapped by X25519 scheme (or aren't stored as raw bytes)
+    """
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(HAS_OLD_WRAPS_QUERY, (user_id, user_id))
+
+        return bool(cursor.fetchone()[0])
+
+
+def get_wrapped_keys(user_id: int, table: str, after_id: int, limit: int) -> list[tuple[int, bytes | str]]:
+    """
+    Get next batch of user's aes_keys which aren't raw X25519 wraps
+    :param table: "notes" (own notes) or "accesses"
+    :param after_id: last note id of previous batch
+    :return: [(note_id, key)]
+    """
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(OLD_WRAPS_QUERIES[table], (user_id, after_id, limit))
+
+        return cursor.fetchall()
+
+
+def update_wrapped_keys(user_id: int, notes: list[tuple[int, bytes]], accesses: list[tuple[int, bytes]]) -> None:
+    """
+    Replace wrapped aes_keys of user in one transaction
+    :param notes: (note_id, key) of own notes
+    :param accesses: (note_id, key) of accesses
+    """
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.executemany(UPDATE_NOTE_KEY_QUERY, [(key, note_id, user_id) for note_id, key in notes])
+
+        cursor.executemany(UPDATE_ACCESS_KEY_QUERY, [(key, note_id, user_id) for note_id, key in accesses])
+
+        conn.commit()
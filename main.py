@@ -1,17 +1,58 @@
 from fastapi import FastAPI
 
-from routers import users, notes, admins, accesses
-from database.general import init_db
+from contextlib import asynccontextmanager
 
+from routers import users, notes, admins, accesses, imports, metrics
+from database.general import init_db, close_connections, db_executor
+from database import statistics, notifications
+from database.backup import backup_executor
+from database.admin import purge_executor, files_executor
+from database.envelopes import start_converter, stop_converter
+from cipher.decrypting import decrypt_executor
+from cipher.executor import shutdown_executors
+from cipher.generate import start_keys_pool, stop_keys_pool
+from cipher.keystore import keystore
+from secure.hashing import Hasher
+from secure.metrics import MetricsMiddleware
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    init_db()  # Apply new migrations of schema
+    statistics.start_flusher()
+    start_keys_pool()
+    start_converter()  # Rewrite old notes to binary envelopes
+    notifications.start_notifier()
+
+    yield
+
+    stop_keys_pool()
+    stop_converter()
+    notifications.stop_notifier()
+    shutdown_executors()
+    Hasher.shutdown()
+    if decrypt_executor is not None:
+        decrypt_executor.shutdown()
+    db_executor.shutdown()
+    backup_executor.shutdown()
+    purge_executor.shutdown()  # Wait for started purge
+    files_executor.shutdown()
+    statistics.stop_flusher()  # Write remaining counters
+
+    # Close connections of all worker threads
+    close_connections()
+    keystore.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)  # Time of requests by route
 app.include_router(admins.router)
 app.include_router(users.router)
 app.include_router(notes.router)
+app.include_router(imports.router)
 app.include_router(accesses.router)
+app.include_router(metrics.router)
 
 if __name__ == "__main__":
-    init_db()
-
     import uvicorn
     uvicorn.run(app="main:app", host="127.0.0.1", port=80, reload=True)
@@ -15,3 +15,8 @@ class Permission(str, Enum):
 class AccessInternalModel(AccessModel):
     permission: int
     key: str | bytes | None
+
+
+class AccessBulkModel(BaseModel):
+    user_ids: list[int]  # Every user gets access to every note
+    note_ids: list[int]
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from enum import Enum
 
 
 class NoteModel(BaseModel):
@@ -10,6 +11,7 @@ class NoteModel(BaseModel):
 class NoteInternalModel(NoteModel):
     created_time: str
     aes_key: str | bytes
+    body: bytes | None = None  # Encrypted envelope of header, text and tags
 
 
 class NoteUpdateModel(NoteModel):
@@ -19,3 +21,19 @@ class NoteUpdateModel(NoteModel):
 class NoteUpdateInternalModel(NoteUpdateModel):
     last_edit_time: str
     last_edit_user: int
+    body: bytes | None = None  # Encrypted envelope of header, text and tags
+
+
+class NotesBulkModel(BaseModel):
+    notes: list[NoteModel]
+    all_or_nothing: bool = False  # If one note is incorrect, nothing is added
+
+
+class TagsMode(str, Enum):
+    any = "any"
+    all = "all"
+
+
+class ImportFormat(str, Enum):
+    ndjson = "ndjson"
+    markdown = "markdown"  # Zip of .md files
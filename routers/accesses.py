@@ -1,51 +1,85 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 
-import base64
-from models.accesses import AccessModel, AccessInternalModel, Permission
+import os, asyncio
+from dotenv import load_dotenv
+
+from models.accesses import AccessModel, AccessInternalModel, AccessBulkModel, Permission
 import database.accesses as db
-from database.users import get_public_key
+from database.users import get_public_keys, get_public_keys_many
 from database.notes import get_aes_key
-from cipher.encrypting import encrypt_aes_key
-from cipher.decrypting import decrypt_aes_key, get_private_key
+from cipher.encrypting import wrap_aes_key
+from cipher.decrypting import unwrap_aes_key, load_wrapped_key
+from cipher.executor import run_crypto
+from database.general import run_db
 from secure.tokens import JWT, CSRF
 
 
+load_dotenv()
+BULK_ACCESSES_LIMIT = int(os.getenv("BULK_ACCESSES_LIMIT", 1000))  # Max (note, user) pairs in one bulk request
+
 router = APIRouter(prefix="/accesses", tags=["Accesses"])
 
 
+# All (note, user) pairs of bulk request, which can be changed by owner
+async def bulk_pairs(bulk: AccessBulkModel, curr_user_id: int) -> tuple[list[AccessModel], list[dict], dict]:
+    """
+    :return: allowed pairs, results of rejected pairs and wrapped keys of owned notes
+    """
+
+    note_ids = list(dict.fromkeys(bulk.note_ids))  # Without duplicates, order is kept
+    user_ids = list(dict.fromkeys(bulk.user_ids))
+    if not note_ids or not user_ids or len(note_ids) * len(user_ids) > BULK_ACCESSES_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Send from 1 to {BULK_ACCESSES_LIMIT} pairs of note and user!")
+
+    owned_keys = await run_db(db.get_owned_keys, curr_user_id, note_ids)  # One query for all notes
+
+    pairs, rejected = [], []
+    for note_id in note_ids:
+        for user_id in user_ids:
+            if note_id not in owned_keys:
+                message = "This action can only be performed by owner of note"
+            elif user_id == curr_user_id:
+                message = "You can't change access of yourself!"
+            else:
+                pairs.append(AccessModel(note_id=note_id, user_id=user_id))
+                continue
+
+            rejected.append({ "note_id": note_id, "user_id": user_id, "message": message })
+
+    return pairs, rejected, owned_keys
+
+
 @router.post("/set-permission",
              summary="Set permission to your notes",
              description="Set permissions to your notes to be shared other users")
-def set_permission(access: AccessModel,
-                   permission: Permission = Permission.read,
-                   curr_user: dict = Depends(JWT.get_current_user),
-                   _ = Depends(CSRF.verify_csrf_token)) -> dict:
+async def set_permission(access: AccessModel,
+                         permission: Permission = Permission.read,
+                         curr_user: dict = Depends(JWT.get_current_user),
+                         _ = Depends(CSRF.verify_csrf_token)) -> dict:
 
     curr_user_id = curr_user["id"]
-    curr_user_name = curr_user["username"]
     if curr_user_id == access.user_id:  # If user enters his id
         return { "message": "You can't give access to yourself!" }
 
-    public_key = get_public_key(access.user_id)  # Public key of user who is gaining access
-    private_key = get_private_key(curr_user_name)  # Private key user who sharing note
+    public_keys = await run_db(get_public_keys, access.user_id)  # Public keys of user who is gaining access
 
-    aes_key = base64.b64decode(get_aes_key(access.note_id, curr_user_id))  # AES key for this note
-    decrypted_aes_key = decrypt_aes_key(private_key, aes_key)  # Decrypted aes_key
-    encrypted_aes_key = encrypt_aes_key(public_key, decrypted_aes_key)  # Encrypted aes_key
+    aes_key = load_wrapped_key(await run_db(get_aes_key, access.note_id, curr_user_id))  # AES key for this note
+    decrypted_aes_key = await run_crypto(unwrap_aes_key, access.note_id, curr_user, aes_key)  # Decrypted aes_key
+    encrypted_aes_key = await run_crypto(wrap_aes_key, public_keys, decrypted_aes_key)  # Encrypted aes_key
 
     permission_value = 1 if permission == Permission.read else 2
-    access = AccessInternalModel(**access.dict(), key=base64.b64encode(encrypted_aes_key), permission=permission_value)
+    access = AccessInternalModel(**access.dict(), key=encrypted_aes_key, permission=permission_value)
 
-    return db.set_permission(access, curr_user_id)
+    return await run_db(db.set_permission, access, curr_user_id)
 
 
 @router.patch("/edit-permission",
             summary="Edit permission",
             description="Edit permission for special user to your note")
-def edit_permission(access: AccessModel,
-                    permission: Permission = Permission.read,
-                    curr_user: dict = Depends(JWT.get_current_user),
-                    _ = Depends(CSRF.verify_csrf_token)) -> dict:
+async def edit_permission(access: AccessModel,
+                          permission: Permission = Permission.read,
+                          curr_user: dict = Depends(JWT.get_current_user),
+                          _ = Depends(CSRF.verify_csrf_token)) -> dict:
     curr_user_id = curr_user["id"]
     if curr_user_id == access.user_id:  # If user enters his id
         return {"message": "You can't change permission to yourself!"}
@@ -53,18 +87,85 @@ def edit_permission(access: AccessModel,
     permission_value = 1 if permission == Permission.read else 2
     access = AccessInternalModel(**access.dict(), key=None, permission=permission_value)
 
-    return db.edit_permission(access, curr_user_id)
+    return await run_db(db.edit_permission, access, curr_user_id)
 
 
 @router.delete("/delete-permission",
                summary="Delete permission to your notes",
                description="Delete permission to your notes to be shared other users")
-def delete_permission(access: AccessModel,
-                      curr_user: dict = Depends(JWT.get_current_user),
-                      _ = Depends(CSRF.verify_csrf_token)) -> dict:
+async def delete_permission(access: AccessModel,
+                            curr_user: dict = Depends(JWT.get_current_user),
+                            _ = Depends(CSRF.verify_csrf_token)) -> dict:
 
     curr_user_id = curr_user["id"]
     if curr_user_id == access.user_id:  # If user enters his id
         return { "message": "You can't take access away from yourself!" }
 
-    return db.delete_permission(access, curr_user_id)
+    return await run_db(db.delete_permission, access, curr_user_id)
+
+
+@router.post("/bulk-set-permission",
+             summary="Set permission to many notes for many users",
+             description="Every user gains access to every note, all accesses are written in one transaction")
+async def bulk_set_permission(bulk: AccessBulkModel,
+                              permission: Permission = Permission.read,
+                              curr_user: dict = Depends(JWT.get_current_user),
+                              _ = Depends(CSRF.verify_csrf_token)) -> dict:
+
+    pairs, results, owned_keys = await bulk_pairs(bulk, curr_user["id"])
+
+    # Public keys of all users by one query
+    public_keys = await run_db(get_public_keys_many, list({ pair.user_id for pair in pairs }))
+    for pair in [pair for pair in pairs if pair.user_id not in public_keys]:
+        results.append({ "note_id": pair.note_id, "user_id": pair.user_id, "message": "User not found" })
+    pairs = [pair for pair in pairs if pair.user_id in public_keys]
+
+    # Every note key is unwrapped once
+    note_ids = list({ pair.note_id for pair in pairs })
+    keys = await asyncio.gather(*(run_crypto(unwrap_aes_key, note_id, curr_user, load_wrapped_key(owned_keys[note_id]))
+                                  for note_id in note_ids))
+    keys = dict(zip(note_ids, keys))
+
+    # And wrapped for every user in parallel
+    wrapped_keys = await asyncio.gather(*(run_crypto(wrap_aes_key, public_keys[pair.user_id], keys[pair.note_id])
+                                          for pair in pairs))
+
+    permission_value = 1 if permission == Permission.read else 2
+    accesses = [AccessInternalModel(**pair.dict(), key=key, permission=permission_value)
+                for pair, key in zip(pairs, wrapped_keys)]
+    messages = await run_db(db.set_permissions, accesses, curr_user["id"]) if accesses else []
+
+    return { "results": results + [{ "note_id": access.note_id, "user_id": access.user_id, "message": message }
+                                   for access, message in zip(accesses, messages)] }
+
+
+@router.patch("/bulk-edit-permission",
+              summary="Edit permission of many users to many notes",
+              description="Permission of every user to every note is changed in one transaction")
+async def bulk_edit_permission(bulk: AccessBulkModel,
+                               permission: Permission = Permission.read,
+                               curr_user: dict = Depends(JWT.get_current_user),
+                               _ = Depends(CSRF.verify_csrf_token)) -> dict:
+
+    pairs, results, _ = await bulk_pairs(bulk, curr_user["id"])
+
+    permission_value = 1 if permission == Permission.read else 2
+    accesses = [AccessInternalModel(**pair.dict(), key=None, permission=permission_value) for pair in pairs]
+    messages = await run_db(db.edit_permissions, accesses, curr_user["id"]) if accesses else []
+
+    return { "results": results + [{ "note_id": access.note_id, "user_id": access.user_id, "message": message }
+                                   for access, message in zip(accesses, messages)] }
+
+
+@router.delete("/bulk-delete-permission",
+               summary="Delete permission of many users to many notes",
+               description="Every user loses access to every note, all accesses are deleted in one transaction")
+async def bulk_delete_permission(bulk: AccessBulkModel,
+                                 curr_user: dict = Depends(JWT.get_current_user),
+                                 _ = Depends(CSRF.verify_csrf_token)) -> dict:
+
+    pairs, results, _ = await bulk_pairs(bulk, curr_user["id"])
+    messages = await run_db(db.delete_permissions, pairs, curr_user["id"]) if pairs else []
+
+    return { "results": results + [{ "note_id": pair.note_id, "user_id": pair.user_id, "message": message }
+                                   for pair, message in zip(pairs, messages)] }
@@ -1,84 +1,110 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 
-import os, shutil
+import os
 from dotenv import load_dotenv
-from datetime import date
 
 from .users import check_logged
 from secure.tokens import JWT, CSRF
 from secure.hashing import Hasher
 from secure.validating import Checker
 from models.admins import AdminModel
-from database.general import DB_PATH
+from database.general import run_db
+from database.backup import create_backup_async, list_backups, read_chunks
+from database.envelopes import get_converter_stats
+from database.notifications import get_queue_stats
 from database.admin import delete_user_by_id, delete_note_by_id, delete_all_users
-from database.users import create_user
+from database.jobs import get_job
+from database.users import create_user, users_cache
+from cipher.decrypting import private_keys_cache, aes_keys_cache
+from cipher.executor import run_auth
+from cipher.generate import keys_pool_stats
 
 
 load_dotenv()
-BACKUP_FOLDER = os.getenv("BACKUP_FOLDER")
 ADMIN_KEY = os.getenv("ADMIN_KEY")
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
 
 @router.post("/create-admin", summary="Create superuser (admin)")
-def create_admin(request: Request, admin: AdminModel) -> dict:
+async def create_admin(request: Request, admin: AdminModel) -> dict:
     if check_logged(request):
         return { "message": "First you need to logout" }
 
     if admin.key != ADMIN_KEY:
         raise HTTPException(status_code=400, detail="Invalid admin key!")
 
-    Checker.check_user_data(admin)
+    await run_auth(Checker.check_user_data, admin)
 
-    admin.password = Hasher.get_password_hash(admin.password)
-    create_user(admin, True)
+    admin.password = await Hasher.get_password_hash_async(admin.password)
+    await run_auth(create_user, admin, True)  # Generates RSA keys
 
     return { "message": "Admin successfully created" }
 
 
 @router.post("/backup", summary="Create db backup")
-def backup(_ = Depends(JWT.get_admin),
-           __ = Depends(CSRF.verify_csrf_token)) -> dict:
-    if not os.path.exists(BACKUP_FOLDER):  # If not exists folder for backups
-        os.mkdir(BACKUP_FOLDER)
-
-    backup_path = os.path.join(BACKUP_FOLDER, "backup.sqlite3")
-    shutil.copy(DB_PATH, backup_path)
+async def backup(_ = Depends(JWT.get_admin),
+                 __ = Depends(CSRF.verify_csrf_token)) -> dict:
+    backup_path = await create_backup_async()
 
     return { "message": f"Backup successfully created: {backup_path}" }
 
 
 @router.get("/download-backup", summary="Download backup if exists to local")
-def download_backup(_: dict = Depends(JWT.get_admin),
-                    __: None = Depends(CSRF.verify_csrf_token)) -> FileResponse:
-    backup_path = os.path.join(BACKUP_FOLDER, "backup.sqlite3")
+async def download_backup(_: dict = Depends(JWT.get_admin),
+                          __: None = Depends(CSRF.verify_csrf_token)) -> StreamingResponse:
+    backups = list_backups()
 
-    if not os.path.exists(backup_path):  # If not exist any backups
+    if not backups:  # If not exist any backups
         raise HTTPException(status_code=404, detail="Backup files not found!")
 
-    return FileResponse(backup_path, filename=f"backup ({date.today()}).sqlite3")
+    backup_path = backups[0]  # The newest
+
+    return StreamingResponse(read_chunks(backup_path), media_type="application/gzip",
+                             headers={ "Content-Disposition": f'attachment; filename="{os.path.basename(backup_path)}"',
+                                       "Content-Length": str(os.path.getsize(backup_path)) })
+
+
+@router.get("/cache-statistics", summary="Get statistics of in-memory caches and pools")
+async def cache_statistics(_ = Depends(JWT.get_admin),
+                           __ = Depends(CSRF.verify_csrf_token)) -> dict:
+
+    return { "private_keys": private_keys_cache.stats(), "aes_keys": aes_keys_cache.stats(),
+             "users": users_cache.stats(), "keys_pool": keys_pool_stats(), "envelopes": get_converter_stats(),
+             "notifications": await run_db(get_queue_stats) }
 
 
 @router.delete("/delete-user/{user_id}", summary="Delete user by id")
-def delete_user(user_id: int,
-                _ = Depends(JWT.get_admin),
-                __ = Depends(CSRF.verify_csrf_token)) -> dict:
+async def delete_user(user_id: int,
+                      _ = Depends(JWT.get_admin),
+                      __ = Depends(CSRF.verify_csrf_token)) -> dict:
 
-    return delete_user_by_id(user_id)
+    return await run_db(delete_user_by_id, user_id)
 
 
 @router.delete("/delete-users", summary="Delete all users")
-def delete_users(_ = Depends(JWT.get_admin),
-                __ = Depends(CSRF.verify_csrf_token)) -> dict:
+async def delete_users(_ = Depends(JWT.get_admin),
+                       __ = Depends(CSRF.verify_csrf_token)) -> dict:
+
+    return await run_db(delete_all_users)
+
+
+@router.get("/purge/{job_id}", summary="Get progress of deleting users")
+async def purge_status(job_id: str,
+                       _ = Depends(JWT.get_admin),
+                       __ = Depends(CSRF.verify_csrf_token)) -> dict:
+
+    job = get_job("purge", job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Purge job not found!")
 
-    return delete_all_users()
+    return job
 
 
 @router.delete("/delete-note/{note_id}", summary="Delete note by id")
-def delete_note(note_id: int,
-                _=Depends(JWT.get_admin),
-                __=Depends(CSRF.verify_csrf_token)) -> dict:
+async def delete_note(note_id: int,
+                      _=Depends(JWT.get_admin),
+                      __=Depends(CSRF.verify_csrf_token)) -> dict:
 
-    return delete_note_by_id(note_id)
+    return await run_db(delete_note_by_id, note_id)
@@ -0,0 +1,234 @@
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+
+import os, json, asyncio, zipfile, tempfile
+from typing import AsyncIterator
+from dotenv import load_dotenv
+
+from .notes import encrypt_notes
+from secure.tokens import JWT, CSRF
+from models.notes import NoteModel, ImportFormat
+from database.general import run_db
+from database.users import get_public_keys
+from database.notes import add_notes
+from database.jobs import create_job, get_job, update_job, finish_job
+
+
+load_dotenv()
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", 100))  # Notes per transaction
+IMPORT_MAX_RECORD = int(os.getenv("IMPORT_MAX_RECORD", 1024 * 1024))  # Max size of one note (bytes)
+IMPORT_SPOOL_SIZE = int(os.getenv("IMPORT_SPOOL_SIZE", 8 * 1024 * 1024))  # Zip upload is kept in memory up to it, then on disk
+
+router = APIRouter(prefix="/notes", tags=["Notes"])
+
+
+@router.post("/import",
+             summary="Creating import job",
+             description="Create job, then upload notes to it and check its status")
+async def create_import(curr_user: dict = Depends(JWT.get_current_user),
+                        _ = Depends(CSRF.verify_csrf_token)) -> dict:
+
+    job = create_job("import", curr_user["id"])
+
+    return { "job_id": job["id"] }
+
+
+@router.put("/import/{job_id}",
+            summary="Uploading notes to import",
+            description="Stream NDJSON (one note per line: header, text, tags) or zip of Markdown files (one note per file)")
+async def upload_import(job_id: str,
+                        request: Request,
+                        curr_user: dict = Depends(JWT.get_current_user),
+                        _ = Depends(CSRF.verify_csrf_token),
+                        format: ImportFormat = Query(ImportFormat.ndjson, description="Format of uploaded data")) -> dict:
+
+    job = get_job("import", job_id, curr_user["id"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found!")
+    if job["status"] != "waiting":
+        raise HTTPException(status_code=409, detail="Data is already uploaded to this job!")
+
+    update_job(job)  # Running
+    records = ndjson_records(request.stream()) if format == ImportFormat.ndjson else markdown_records(request.stream())
+    try:
+        await import_notes(job, curr_user["id"], records)
+    except Exception as e:
+        print(e)
+        finish_job(job, "Import was interrupted")
+    else:
+        finish_job(job)
+
+    return job
+
+
+@router.get("/import/{job_id}",
+            summary="Viewing import job",
+            description="Progress and errors of every record which wasn't imported")
+async def get_import(job_id: str,
+                     curr_user: dict = Depends(JWT.get_current_user),
+                     _ = Depends(CSRF.verify_csrf_token)) -> dict:
+
+    job = get_job("import", job_id, curr_user["id"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found!")
+
+    return job
+
+
+async def import_notes(job: dict, user_id: int, records: AsyncIterator[tuple[str, NoteModel | str]]) -> None:
+    """
+    Encrypt and save notes by batches, next batch is encrypted while previous one is written
+    :param records: (number of record, note or error)
+    """
+
+    public_keys = await run_db(get_public_keys, user_id)
+    batch, pending = [], None
+
+    async for record, note in records:
+        if isinstance(note, str):  # Incorrect record
+            update_job(job, processed=1, errors=[{ "record": record, "error": note }])
+            continue
+
+        batch.append((record, note))
+        if len(batch) >= IMPORT_BATCH:
+            pending = await save_batch(job, user_id, public_keys, batch, pending)
+            batch = []
+
+    if batch:
+        pending = await save_batch(job, user_id, public_keys, batch, pending)
+    if pending is not None:
+        await pending
+
+
+async def save_batch(job: dict, user_id: int, public_keys: dict,
+                     batch: list[tuple[str, NoteModel]], pending: asyncio.Future | None) -> asyncio.Future:
+    """
+    Encrypt batch and start writing it, when previous batch is written
+    :return: writing of this batch
+    """
+
+    errors = {}
+    notes, tokens, words = await encrypt_notes([note for _, note in batch], user_id, public_keys, errors)
+
+    if pending is not None:  # Only one transaction at a time
+        await pending
+
+    async def write() -> None:
+        note_ids = await run_db(add_notes, [note for _, note in notes], user_id, tokens, words) if notes else []
+        for (i, _), note_id in zip(notes, note_ids):
+            if isinstance(note_id, str):  # Error of db
+                errors[i] = f"Note can't be saved: {note_id}"
+
+        update_job(job, processed=len(batch), done=len(batch) - len(errors),
+                   errors=[{ "record": batch[i][0], "error": error } for i, error in sorted(errors.items())])
+
+    return asyncio.ensure_future(write())
+
+
+def make_note(header: str, text: str, tags: str | None) -> NoteModel | str:
+    if not isinstance(header, str) or not isinstance(text, str) or not header or not text:
+        return "Incorrect input of note!"
+    if tags is not None and not isinstance(tags, str):
+        return "Tags must be a string"
+
+    return NoteModel(header=header, text=text, tags=tags or None)
+
+
+async def ndjson_records(stream: AsyncIterator[bytes]) -> AsyncIterator[tuple[str, NoteModel | str]]:
+    """
+    Parse notes line by line while body is received, only one line is kept in memory
+    """
+
+    buffer = b""
+    line_number = 0
+    skipping = False  # Rest of too long line
+
+    async for chunk in stream:
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+
+        for line in lines:
+            line_number += 1
+            if skipping or len(line) > IMPORT_MAX_RECORD:
+                skipping = False
+                yield str(line_number), "Record is too long"
+                continue
+
+            if line.strip():
+                yield str(line_number), parse_ndjson_line(line)
+
+        if len(buffer) > IMPORT_MAX_RECORD:
+            buffer = b""
+            skipping = True
+
+    if skipping:
+        yield str(line_number + 1), "Record is too long"
+    elif buffer.strip():
+        yield str(line_number + 1), parse_ndjson_line(buffer)
+
+
+def parse_ndjson_line(line: bytes) -> NoteModel | str:
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return "Incorrect JSON"
+
+    if not isinstance(data, dict):
+        return "Record must be JSON object"
+
+    # "content" is accepted too, as in export
+    return make_note(data.get("header"), data.get("text", data.get("content")), data.get("tags"))
+
+
+async def markdown_records(stream: AsyncIterator[bytes]) -> AsyncIterator[tuple[str, NoteModel | str]]:
+    """
+    Zip can be read only with its end (central directory), so upload is spooled to disk first,
+    then files are read one by one
+    """
+
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE) as file:
+        async for chunk in stream:
+            await run_in_threadpool(file.write, chunk)
+
+        try:
+            archive = zipfile.ZipFile(file)
+        except zipfile.BadZipFile:
+            yield "archive", "Incorrect zip archive"
+            return
+
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(".md"):
+                    continue
+                if info.file_size > IMPORT_MAX_RECORD:
+                    yield info.filename, "Record is too long"
+                    continue
+
+                try:
+                    text = (await run_in_threadpool(archive.read, info)).decode()
+                except (zipfile.BadZipFile, UnicodeDecodeError):
+                    yield info.filename, "File can't be read"
+                    continue
+
+                yield info.filename, parse_markdown(info.filename, text)
+
+
+def parse_markdown(filename: str, text: str) -> NoteModel | str:
+    """
+    Header is first "# " line (or name of file), optional "Tags:" line after it, rest is text
+    """
+
+    lines = text.strip().splitlines()
+    header = os.path.splitext(os.path.basename(filename))[0]
+    if lines and lines[0].startswith("# "):
+        header = lines.pop(0)[2:].strip()
+
+    while lines and not lines[0].strip():
+        lines.pop(0)
+
+    tags = None
+    if lines and lines[0].lower().startswith("tags:"):
+        tags = lines.pop(0)[5:].strip()
+
+    return make_note(header, "\n".join(lines).strip(), tags)
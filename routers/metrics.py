@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from secure.tokens import JWT
+from secure import metrics
+
+
+router = APIRouter(tags=["Admin"])
+
+
+# Without CSRF token: read-only, scraper sends only access_token cookie of admin
+@router.get("/metrics", summary="Get metrics in Prometheus text format", response_class=PlainTextResponse)
+async def get_metrics(_ = Depends(JWT.get_admin)) -> PlainTextResponse:
+
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,119 +1,308 @@
 from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi.responses import StreamingResponse
 
-import base64
-from typing import Optional
+import os, asyncio, json, zlib
+from typing import Optional, AsyncIterator
 from datetime import datetime
+from dotenv import load_dotenv
 
 from secure.tokens import JWT, CSRF
-from models.notes import NoteModel, NoteUpdateModel, NoteInternalModel, NoteUpdateInternalModel
-from cipher.encrypting import symmetric_encrypt_note, encrypt_aes_key
-from cipher.decrypting import decrypt_note, decrypt_aes_key, get_private_key
+from models.notes import (NoteModel, NoteUpdateModel, NoteInternalModel, NoteUpdateInternalModel,
+                          NotesBulkModel, TagsMode)
+from cipher.encrypting import symmetric_encrypt_note, wrap_aes_key
+from cipher.decrypting import decrypt_note, decrypt_notes, unwrap_aes_key, load_wrapped_key
 from cipher.generate import generate_aes_key
-from database.users import get_public_key
-from database.notes import (add_note, delete_note_by_id,
+from cipher.indexing import normalize_tags, tag_tokens, search_tokens, search_query
+from cipher.executor import run_crypto
+from database.general import run_db
+from database.users import get_public_keys
+from database.notes import (add_note, add_notes, delete_note_by_id,
                             get_all_notes, get_note_by_id,
-                            check_access, update_note, get_aes_key)
+                            check_access, update_note, get_aes_key,
+                            search_notes, get_note_owner, NOTE_FIELDS)
 
 
+load_dotenv()
+BULK_NOTES_LIMIT = int(os.getenv("BULK_NOTES_LIMIT", 100))  # Max notes in one bulk request
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", 200))  # Notes read from db per step of export
+
 router = APIRouter(prefix="/notes", tags=["Notes"])
 
 
+# Blind index tokens of note with key of its owner: (tag tokens, search tokens)
+def index_note(owner_id: int, note: NoteModel) -> tuple[list[bytes], tuple[str, str]]:
+    return tag_tokens(owner_id, note.tags), search_tokens(owner_id, note.header, note.text)
+
+
+# Index new note, wrap new AES key for owner and encrypt note with it (all in crypto thread)
+def encrypt_new_note(public_keys: dict, note: NoteModel, created_time: str,
+                     owner_id: int) -> tuple[NoteInternalModel, list[bytes], tuple[str, str]]:
+    tokens, words = index_note(owner_id, note)  # Before note is encrypted
+    aes_key = generate_aes_key()
+    note = NoteInternalModel(**note.dict(), aes_key=wrap_aes_key(public_keys, aes_key), created_time=created_time)
+
+    return symmetric_encrypt_note(aes_key, note), tokens, words
+
+
+# Index edited note with key of note's owner and encrypt it with AES key of note (in crypto thread)
+def encrypt_edited_note(aes_key: bytes, note: NoteUpdateInternalModel,
+                        owner_id: int) -> tuple[NoteUpdateInternalModel, list[bytes], tuple[str, str]]:
+    tokens, words = index_note(owner_id, note)
+
+    return symmetric_encrypt_note(aes_key, note), tokens, words
+
+
+# Encrypt new notes in parallel, with blind index tokens for every note
+async def encrypt_notes(notes: list[NoteModel], user_id: int, public_keys: dict,
+                        errors: dict) -> tuple[list[tuple[int, NoteInternalModel]], list, list]:
+    """
+    :param errors: index -> error of notes which are skipped, errors of encryption are added to it
+    :return: (index, encrypted note), tag tokens and search tokens of every encrypted note
+    """
+
+    created_time = datetime.now().strftime("%H:%M:%S %d-%m-%Y")
+    indexes = [i for i in range(len(notes)) if i not in errors]
+    encrypted = await asyncio.gather(*(run_crypto(encrypt_new_note, public_keys, notes[i], created_time, user_id)
+                                       for i in indexes), return_exceptions=True)
+
+    encrypted_notes, tokens, words = [], [], []
+    for i, result in zip(indexes, encrypted):
+        if isinstance(result, Exception):
+            errors[i] = f"Note can't be encrypted: {result}"
+            continue
+
+        note, note_tokens, note_words = result
+        encrypted_notes.append((i, note))
+        tokens.append(note_tokens)
+        words.append(note_words)
+
+    return encrypted_notes, tokens, words
+
+
+# Parse requested fields of notes (comma separated)
+def parse_fields(fields: Optional[str]) -> Optional[list[str]]:
+    if fields is None:
+        return None
+
+    fields = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in NOTE_FIELDS]
+    if not fields or unknown:
+        raise HTTPException(status_code=400, detail=f"Incorrect fields! Available: {', '.join(NOTE_FIELDS)}")
+
+    return fields
+
+
 @router.post("/create",
           summary="Adding new note",
           description="Adding new note which contain: header, text (main content) and tags (if needed)")
-def create_note(note: NoteModel,
-                curr_user: dict = Depends(JWT.get_current_user),
-                _ = Depends(CSRF.verify_csrf_token)) -> dict:
+async def create_note(note: NoteModel,
+                      curr_user: dict = Depends(JWT.get_current_user),
+                      _ = Depends(CSRF.verify_csrf_token)) -> dict:
     if not note.header or not note.text:
         raise HTTPException(status_code=400, detail="Incorrect input of note!")
 
     user_id = curr_user["id"]
-    public_key = get_public_key(user_id)
-    aes_key = generate_aes_key()
-    note = NoteInternalModel(**note.dict(), aes_key=encrypt_aes_key(public_key, aes_key), created_time=datetime.now().strftime("%H:%M:%S %d-%m-%Y"))
+    public_keys = await run_db(get_public_keys, user_id)
+    note, tokens, words = await run_crypto(encrypt_new_note, public_keys, note,
+                                           datetime.now().strftime("%H:%M:%S %d-%m-%Y"), user_id)
 
-    add_note(symmetric_encrypt_note(aes_key, note), user_id)
+    await run_db(add_note, note, user_id, tokens, words)
 
     return { "message": "Note added successfully" }
 
 
+@router.post("/bulk",
+             summary="Adding many notes",
+             description="Adding list of notes in one transaction (errors are reported for every note)")
+async def create_notes(bulk: NotesBulkModel,
+                       curr_user: dict = Depends(JWT.get_current_user),
+                       _ = Depends(CSRF.verify_csrf_token)) -> dict:
+    if not bulk.notes or len(bulk.notes) > BULK_NOTES_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Send from 1 to {BULK_NOTES_LIMIT} notes!")
+
+    user_id = curr_user["id"]
+    errors = { i: "Incorrect input of note!" for i, note in enumerate(bulk.notes) if not note.header or not note.text }
+    if errors and bulk.all_or_nothing:
+        raise HTTPException(status_code=400, detail={ "errors": errors })
+
+    # Public keys once, notes are encrypted in parallel
+    public_keys = await run_db(get_public_keys, user_id)
+    notes, tokens, words = await encrypt_notes(bulk.notes, user_id, public_keys, errors)
+
+    if errors and bulk.all_or_nothing:
+        raise HTTPException(status_code=400, detail={ "errors": errors })
+
+    note_ids = []
+    if notes:
+        try:
+            note_ids = await run_db(add_notes, [note for _, note in notes], user_id, tokens, words, bulk.all_or_nothing)
+        except Exception as e:  # Only with all_or_nothing, transaction is rolled back
+            raise HTTPException(status_code=400, detail=f"Notes can't be saved, nothing was added: {e}")
+
+    # Ids of added notes in order of request
+    created = {}
+    for (i, _), note_id in zip(notes, note_ids):
+        if isinstance(note_id, str):  # Error of db
+            errors[i] = f"Note can't be saved: {note_id}"
+        else:
+            created[i] = note_id
+
+    return { "message": f"{len(created)} of {len(bulk.notes)} notes added",
+             "created": created, "errors": dict(sorted(errors.items())) }
+
+
 @router.get("/",
          summary="Viewing all notes",
          description="Viewing all notes which you posted")
-def get_notes(curr_user: dict = Depends(JWT.get_current_user),
-              _ = Depends(CSRF.verify_csrf_token),
-              page: int = Query(1, ge=1, description="Page number"),
-              limit: int = Query(10, ge=1, le=100, description="Notes per page"),
-              tags: Optional[str] = Query(None, description="Filter by tag(s)")) -> dict:
+async def get_notes(curr_user: dict = Depends(JWT.get_current_user),
+                    _ = Depends(CSRF.verify_csrf_token),
+                    page: int = Query(1, ge=1, description="Page number"),
+                    limit: int = Query(10, ge=1, le=100, description="Notes per page"),
+                    tags: Optional[str] = Query(None, description="Filter by tag(s), separated by comma"),
+                    tags_mode: TagsMode = Query(TagsMode.any, description="Note must have any or all of tags"),
+                    after_id: Optional[int] = Query(None, ge=0, description="Cursor: get notes after this id (instead of page)"),
+                    fields: Optional[str] = Query(None, description="Return only these fields, separated by comma")) -> dict:
 
     user_id = curr_user["id"]
-    username = curr_user["username"]
     offset = (page - 1) * limit
+    fields = parse_fields(fields)
 
-    # Get all encrypted notes
-    notes = get_all_notes(user_id, offset, limit, tags)
+    # Get all encrypted notes (only requested fields)
+    notes = await run_db(get_all_notes, user_id, offset, limit, normalize_tags(tags), tags_mode == TagsMode.all, after_id, fields)
     if "message" in notes.keys():  # If no notes
         return notes
 
-    decrypted_notes = {}
+    # Cursor for next page (if page is full)
+    next_cursor = max(notes.keys()) if len(notes) == limit else None
 
     # Decrypted receiver notes
-    for key_note in notes.keys():
-        aes_key = base64.b64decode(notes[key_note]["aes_key"])
-        decrypted_notes.update({ key_note: decrypt_note(notes[key_note], username, aes_key) })
-        del decrypted_notes[key_note]["aes_key"]
+    return { "notes": await run_crypto(decrypt_notes, notes, curr_user), "next_cursor": next_cursor }
+
+
+@router.get("/export",
+            summary="Exporting all notes",
+            description="Download all your notes as NDJSON (one note per line), optionally gzipped")
+async def export_notes(curr_user: dict = Depends(JWT.get_current_user),
+                       _ = Depends(CSRF.verify_csrf_token),
+                       compress: bool = Query(False, description="Compress with gzip"),
+                       fields: Optional[str] = Query(None, description="Export only these fields, separated by comma")) -> StreamingResponse:
+
+    lines = export_lines(curr_user, parse_fields(fields))
+    if compress:
+        return StreamingResponse(gzip_chunks(lines), media_type="application/gzip",
+                                 headers={ "Content-Disposition": 'attachment; filename="notes.ndjson.gz"' })
+
+    return StreamingResponse(lines, media_type="application/x-ndjson",
+                             headers={ "Content-Disposition": 'attachment; filename="notes.ndjson"' })
+
+
+async def export_lines(user: dict, fields: Optional[list[str]]) -> AsyncIterator[bytes]:
+    """
+    Read notes by keyset chunks and decrypt them, next chunk is read while current is decrypted
+    """
+
+    def read_chunk(after_id: int) -> asyncio.Future:
+        return asyncio.ensure_future(run_db(get_all_notes, user["id"], 0, EXPORT_CHUNK, None, False, after_id, fields))
+
+    next_chunk = read_chunk(0)
+    while next_chunk is not None:
+        notes = await next_chunk
+        if "message" in notes.keys():  # No notes left
+            return
+
+        next_chunk = read_chunk(max(notes.keys())) if len(notes) == EXPORT_CHUNK else None
+
+        notes = await run_crypto(decrypt_notes, notes, user)
+        yield "".join(json.dumps({ "id": note_id, **note }, ensure_ascii=False) + "\n"
+                      for note_id, note in notes.items()).encode()
+
 
-    return { "notes": decrypted_notes }
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+@router.get("/search",
+            summary="Searching notes",
+            description="Full-text search by words of header and content of your notes")
+async def search(curr_user: dict = Depends(JWT.get_current_user),
+                 _ = Depends(CSRF.verify_csrf_token),
+                 q: str = Query(..., min_length=1, description="Words to search"),
+                 page: int = Query(1, ge=1, description="Page number"),
+                 limit: int = Query(10, ge=1, le=100, description="Notes per page")) -> dict:
+
+    user_id = curr_user["id"]
+    offset = (page - 1) * limit
+
+    query = search_query(user_id, q)
+    if not query:  # If no words
+        raise HTTPException(status_code=400, detail="Incorrect search query!")
+
+    # Decrypt only found page
+    notes = await run_db(search_notes, user_id, query, offset, limit)
+    if "message" in notes.keys():  # If no notes
+        return notes
+
+    return { "notes": await run_crypto(decrypt_notes, notes, curr_user) }
 
 
 @router.get("/{note_id}",
          summary="Viewing note by id")
-def get_note(note_id: int,
-             curr_user: dict = Depends(JWT.get_current_user),
-             _ = Depends(CSRF.verify_csrf_token)) -> dict:
+async def get_note(note_id: int,
+                   curr_user: dict = Depends(JWT.get_current_user),
+                   _ = Depends(CSRF.verify_csrf_token),
+                   fields: Optional[str] = Query(None, description="Return only these fields, separated by comma")) -> dict:
     user_id = curr_user["id"]
-    username = curr_user["username"]
 
-    note = get_note_by_id(note_id, user_id)
-    aes_key = note["aes_key"]
-    if aes_key == "None":  # If no aes_key
+    note = await run_db(get_note_by_id, note_id, user_id, parse_fields(fields))
+    if "message" in note.keys():  # If note not found
         raise HTTPException(status_code=400, detail="Note not found!")
 
-    decrypted_note = decrypt_note(note, username, base64.b64decode(aes_key))
-    del note["aes_key"]
+    if "aes_key" not in note:  # No encrypted fields requested
+        return { "note": note }
+
+    aes_key = note.pop("aes_key")
+    decrypted_note = await run_crypto(decrypt_note, note, note_id, curr_user, load_wrapped_key(aes_key))
 
     return { "note": decrypted_note }
 
 
 @router.delete("/{note_id}",
             summary="Deleting note by id")
-def delete_note(note_id: int,
-                curr_user: dict = Depends(JWT.get_current_user),
-                _ = Depends(CSRF.verify_csrf_token)) -> dict:
+async def delete_note(note_id: int,
+                      curr_user: dict = Depends(JWT.get_current_user),
+                      _ = Depends(CSRF.verify_csrf_token)) -> dict:
     user_id = curr_user["id"]
 
-    return delete_note_by_id(note_id, user_id)
+    return await run_db(delete_note_by_id, note_id, user_id)
 
 
 @router.put("/edit-note/{note_id}",
             summary="Editing note")
-def editing_note(note: NoteUpdateModel,
-                 curr_user: dict = Depends(JWT.get_current_user),
-                 _ = Depends(CSRF.verify_csrf_token)) -> dict:
+async def editing_note(note: NoteUpdateModel,
+                       curr_user: dict = Depends(JWT.get_current_user),
+                       _ = Depends(CSRF.verify_csrf_token)) -> dict:
 
-    if not check_access(note.id, curr_user["id"]):
+    if not await run_db(check_access, note.id, curr_user["id"]):
         return { "message": "Note not found or access denied" }
 
     if not note.header or not note.text:
         raise HTTPException(status_code=400, detail="Incorrect input of note!")
 
     user_id = curr_user["id"]
-    username = curr_user["username"]
 
-    private_key = get_private_key(username)  # Private key of user who want to edit this note
     note = NoteUpdateInternalModel(**note.dict(), last_edit_time=datetime.now().strftime("%H:%M:%S %d-%m-%Y"), last_edit_user=user_id)
-    aes_key = base64.b64decode(get_aes_key(note.id, user_id))  # Get AES key for accessing to this note
+    aes_key = load_wrapped_key(await run_db(get_aes_key, note.id, user_id))  # Get AES key for accessing to this note
 
-    decrypted_aes_key = decrypt_aes_key(private_key, aes_key)  # Decrypted aes_key
+    decrypted_aes_key = await run_crypto(unwrap_aes_key, note.id, curr_user, aes_key)  # Decrypted aes_key
+    # Tags and words are indexed with key of note's owner
+    owner_id = await run_db(get_note_owner, note.id)
+    note, tokens, words = await run_crypto(encrypt_edited_note, decrypted_aes_key, note, owner_id)
 
-    return update_note(symmetric_encrypt_note(decrypted_aes_key, note))
+    return await run_db(update_note, note, tokens, words)
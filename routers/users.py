@@ -1,51 +1,73 @@
 from fastapi import HTTPException, Depends, status, Response, Request, APIRouter
 from fastapi.security import OAuth2PasswordRequestForm
 
-import secrets
+import os, secrets, base64, threading
 from datetime import timedelta
 
-from database.users import create_user, get_user, get_statistics, reset_password
+from database.users import (create_user, get_user, get_statistics, reset_password, get_user_password,
+                            claim_x25519_public_key, has_old_wraps, get_wrapped_keys, update_wrapped_keys)
 from secure.tokens import JWT, CSRF
 from secure.validating import Validator
 from models.users import UserCreateModel, ResetPasswordModel, RestorePasswordModel, ConfirmRestoringPasswordModel
 from secure.validating import Checker
 from secure.hashing import Hasher
+from database.general import run_db
+from cipher.executor import run_auth, upgrade_executor
+from cipher.generate import new_x25519_keys
+from cipher.keystore import keystore, x25519_key_name
+from cipher.encrypting import KEY_WRAP_SCHEME, encrypt_aes_key_x25519
+from cipher.decrypting import decrypt_wrapped_key, is_x25519_wrap, load_wrapped_key
 
 
+UPGRADE_BATCH = int(os.getenv("UPGRADE_BATCH", 200))  # aes_keys rewrapped in one transaction
+
 router = APIRouter(prefix="/users", tags=["Users"])
 
+# Users whose keys are being upgraded (keys of user mustn't be upgraded twice at the same time)
+upgrading: set[int] = set()
+upgrading_lock = threading.Lock()
+
 
 @router.post("/signup",
              summary="Registration new user")
-def signup(request: Request, user: UserCreateModel) -> dict:
+async def signup(request: Request, user: UserCreateModel) -> dict:
     if check_logged(request):
         return { "message": "First you need to logout" }
 
-    Checker.check_user_data(user)
+    await run_auth(Checker.check_user_data, user)
 
     # Hash password and register new user
-    user.password = Hasher.get_password_hash(user.password)
-    create_user(user)
+    user.password = await Hasher.get_password_hash_async(user.password)
+    await run_auth(create_user, user)  # Generates RSA keys
 
     return { "message": "User registered successfully" }
 
 
 @router.post("/signin",
              summary="Authentication user")
-def login(request: Request, response: Response, data: OAuth2PasswordRequestForm = Depends()) -> dict:
+async def login(request: Request, response: Response, data: OAuth2PasswordRequestForm = Depends()) -> dict:
     if check_logged(request):
         return { "message": "You already logged" }
 
-    user = get_user(data.username)
+    user = await run_db(get_user, data.username)
 
     # Check username and password
-    if not user or not Hasher.verify_password(data.password, user["password"]):
+    if not user or not await Hasher.verify_password_async(data.password, user["password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password!",
             headers={ "WWW-Authenticate": "Bearer" }
         )
 
+    # Rewrap user's aes_keys by X25519 scheme in background (if some are left)
+    if KEY_WRAP_SCHEME == "x25519" and (not user["x25519_public_key"] or await run_db(has_old_wraps, user["id"])):
+        with upgrading_lock:
+            queued = user["id"] in upgrading
+            upgrading.add(user["id"])
+
+        if not queued:
+            upgrade_executor.submit(upgrade_key_wraps, user)
+
     # Create jwt access token
     access_token_expires = timedelta(minutes=JWT.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = JWT.create_access_token({ "sub": user["username"] },
@@ -76,7 +98,7 @@ def login(request: Request, response: Response, data: OAuth2PasswordRequestForm
 
 @router.post("/logout",
              summary="Logout from service")
-def logout(request: Request, response: Response) -> dict:
+async def logout(request: Request, response: Response) -> dict:
     if check_logged(request):  # If user is logged in
         response.delete_cookie("access_token")
         response.delete_cookie("csrf_token")
@@ -87,14 +109,14 @@ def logout(request: Request, response: Response) -> dict:
 
 @router.patch("/reset-password", summary="Reset password",
              description="Change old password to new")
-def change_password(password: ResetPasswordModel,
-                    curr_user: dict = Depends(JWT.get_current_user),
-                    _ = Depends(CSRF.verify_csrf_token)) -> dict:
+async def change_password(password: ResetPasswordModel,
+                          curr_user: dict = Depends(JWT.get_current_user),
+                          _ = Depends(CSRF.verify_csrf_token)) -> dict:
     user_id = curr_user["id"]
-    user_password = curr_user["password"]
+    user_password = await run_db(get_user_password, user_id)
 
     # Check old password
-    if not Hasher.verify_password(password.old_password, user_password):
+    if not await Hasher.verify_password_async(password.old_password, user_password):
         return { "message": "Invalid old password!" }
 
     # Check new passwords identity
@@ -105,39 +127,87 @@ def change_password(password: ResetPasswordModel,
     if password.old_password == password.new_password:
         return { "message": "You can't change your password to your old password!" }
 
-    password_error = Validator.check_password_complexity(password.new_password)
+    password_error = await run_auth(Validator.check_password_complexity, password.new_password)
     if password_error is not None:
         raise HTTPException(status_code=400, detail=password_error)
 
     # Hash password and change it
-    password.new_password = Hasher.get_password_hash(password.new_password)
-    reset_password(user_id, password.new_password)
+    password.new_password = await Hasher.get_password_hash_async(password.new_password)
+    await run_db(reset_password, user_id, password.new_password)
 
     return { "message": "Password was changed successfully" }
 
 
 @router.post("/recover-password", summary="Restore password",
              description="Restore password if user forget it")
-def restore_password(user_data: ConfirmRestoringPasswordModel) -> dict:
+async def restore_password(user_data: ConfirmRestoringPasswordModel) -> dict:
     ...
 
 
 @router.patch("/recover-password/{user_id}/{key_code}", summary="Restore password",
              description="Restore password if user forget it")
-def restore_password(user_id: int, key_code: str) -> dict:
+async def restore_password(user_id: int, key_code: str) -> dict:
     ...
 
 
 @router.get("/statistics",
             summary="Get activity statistics",
             description="Getting statistics about user activity by id")
-def statistics(curr_user: dict = Depends(JWT.get_current_user),
-               _ = Depends(CSRF.verify_csrf_token)) -> dict:
+async def statistics(curr_user: dict = Depends(JWT.get_current_user),
+                     _ = Depends(CSRF.verify_csrf_token)) -> dict:
     user_id = curr_user["id"]
 
-    return get_statistics(user_id)
+    return await run_db(get_statistics, user_id)
 
 
 # Check if user logged
 def check_logged(request: Request) -> bool:
     return bool(request.cookies.get("access_token"))
+
+
+def upgrade_key_wraps(user: dict) -> None:
+    """
+    Lazy migration of user's wrapped aes_keys from RSA-OAEP to X25519 scheme (after login)
+    """
+
+    try:
+        _upgrade_key_wraps(get_user(user["username"]))  # Fresh user, keys may be already generated
+    except Exception as e:
+        print(e)
+    finally:
+        with upgrading_lock:
+            upgrading.discard(user["id"])
+
+
+def _upgrade_key_wraps(user: dict) -> None:
+    public_key = user["x25519_public_key"]
+    if not public_key:  # User was created before X25519 scheme
+        private_pem, public_key = new_x25519_keys()
+        # Private key is saved only by process which has set its public key, so keys always match
+        if claim_x25519_public_key(user["id"], public_key):
+            keystore.put_key(x25519_key_name(user["username"]), private_pem)
+        else:
+            public_key = get_user(user["username"])["x25519_public_key"]
+
+    public_raw = base64.b64decode(public_key)
+
+    # Rewrap RSA wraps by batches (X25519 wraps in base64 are only stored as raw bytes)
+    for table in ("notes", "accesses"):
+        last_id = 0
+        while True:
+            keys = get_wrapped_keys(user["id"], table, last_id, UPGRADE_BATCH)
+            if not keys:
+                break
+
+            rewrapped = []
+            for note_id, key in keys:
+                wrapped_key = load_wrapped_key(key)
+                if not is_x25519_wrap(wrapped_key):
+                    wrapped_key = encrypt_aes_key_x25519(public_raw, decrypt_wrapped_key(user["username"], wrapped_key))
+                rewrapped.append((note_id, wrapped_key))
+
+            if table == "notes":
+                update_wrapped_keys(user["id"], rewrapped, [])
+            else:
+                update_wrapped_keys(user["id"], [], rewrapped)
+            last_id = keys[-1][0]
@@ -0,0 +1,90 @@
+import threading, time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+# Bounded in-memory cache: LRU eviction and time to live for every entry
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float, on_evict: Callable[[Any], None] | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl  # Seconds
+        self.on_evict = on_evict  # Called with value which leaves cache (e.g. to wipe secrets)
+        self.hits = 0
+        self.misses = 0
+
+        self.__data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()  # key -> (expire time, value)
+        self.__lock = threading.Lock()
+
+    def get(self, key: Hashable, copy: Callable[[Any], Any] | None = None) -> Any | None:
+        """
+        :param copy: makes copy of value under lock (value can be wiped by other thread right after return)
+        """
+
+        with self.__lock:
+            item = self.__data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+
+            expire, value = item
+            if expire < time.monotonic():  # Expired
+                del self.__data[key]
+                self.__evict(value)
+                self.misses += 1
+                return None
+
+            self.__data.move_to_end(key)  # Mark as recently used
+            self.hits += 1
+
+            return value if copy is None else copy(value)
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:  # Cache is disabled
+            return
+
+        with self.__lock:
+            old = self.__data.pop(key, None)
+            if old is not None and old[1] is not value:
+                self.__evict(old[1])
+
+            self.__data[key] = (time.monotonic() + self.ttl, value)
+
+            # Remove least recently used entries
+            while len(self.__data) > self.maxsize:
+                self.__evict(self.__data.popitem(last=False)[1][1])
+
+    def delete(self, key: Hashable) -> None:
+        with self.__lock:
+            item = self.__data.pop(key, None)
+            if item is not None:
+                self.__evict(item[1])
+
+    def delete_where(self, predicate: Callable[[Hashable], bool]) -> None:
+        """
+        Delete all entries which keys match predicate
+        """
+
+        with self.__lock:
+            for key in [key for key in self.__data if predicate(key)]:
+                self.__evict(self.__data.pop(key)[1])
+
+    def clear(self) -> None:
+        with self.__lock:
+            for _, value in self.__data.values():
+                self.__evict(value)
+            self.__data.clear()
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return { "size": len(self.__data), "maxsize": self.maxsize, "ttl": self.ttl,
+                     "hits": self.hits, "misses": self.misses }
+
+    def __evict(self, value: Any) -> None:
+        if self.on_evict is not None:
+            self.on_evict(value)
+
+
+# Overwrite secret bytes in memory
+def zeroize(value: bytearray) -> None:
+    for i in range(len(value)):
+        value[i] = 0
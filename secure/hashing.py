@@ -1,15 +1,73 @@
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
+import os, time, asyncio, threading, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from cipher.executor import run_auth
+from secure.metrics import hash_seconds
+
+
+load_dotenv()
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))  # bcrypt cost
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", 0))  # Processes for bcrypt, 0 - use auth threads
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", 64))  # Max hashing operations in progress or waiting
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+# Module level functions, so they can be sent to worker process
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
 
 
 # Password hash and verify
 class Hasher:
+    __executor = ProcessPoolExecutor(max_workers=HASH_WORKERS,
+                                     mp_context=multiprocessing.get_context("spawn")) if HASH_WORKERS > 0 else None
+    __slots = threading.BoundedSemaphore(HASH_QUEUE_SIZE)
+
     @staticmethod
     def get_password_hash(password: str) -> str:
-        return pwd_context.hash(password)
+        return _hash(password)
 
     @staticmethod
     def verify_password(password: str, hashed_password: str) -> bool:
-        return pwd_context.verify(password, hashed_password)
+        return _verify(password, hashed_password)
+
+    # Non-blocking variants for async handlers
+    @staticmethod
+    async def get_password_hash_async(password: str) -> str:
+        return await Hasher.__run(_hash, password)
+
+    @staticmethod
+    async def verify_password_async(password: str, hashed_password: str) -> bool:
+        return await Hasher.__run(_verify, password, hashed_password)
+
+    @staticmethod
+    def shutdown() -> None:
+        if Hasher.__executor is not None:
+            Hasher.__executor.shutdown()
+
+    # Run in process pool (or auth threads), fail fast if queue is full
+    @staticmethod
+    async def __run(func, *args):
+        if not Hasher.__slots.acquire(blocking=False):
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Server is busy, try again later",
+                                headers={ "Retry-After": "1" })
+
+        start = time.perf_counter()
+        try:
+            if Hasher.__executor is None:
+                return await run_auth(func, *args)
+
+            return await asyncio.wrap_future(Hasher.__executor.submit(func, *args))
+        finally:
+            Hasher.__slots.release()
+            hash_seconds.observe(time.perf_counter() - start, func.__name__[1:])  # hash or verify
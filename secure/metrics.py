@@ -0,0 +1,191 @@
+import os, time, bisect, threading
+from functools import partial, wraps
+from typing import Any, Callable
+from dotenv import load_dotenv
+
+
+load_dotenv()
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"  # Instrumentation of routes, db, crypto and bcrypt
+
+# Upper bounds of histogram buckets (seconds): from 50 us (AES-GCM) to 10 s (bcrypt under load)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# Metrics in Prometheus text format, values are kept in memory by label values
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.__values: dict[tuple, float] = {}
+        self.__lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, *label_values: str, value: float = 1) -> None:
+        if not METRICS_ENABLED:
+            return
+
+        with self.__lock:
+            self.__values[label_values] = self.__values.get(label_values, 0) + value
+
+    def render(self) -> list[str]:
+        with self.__lock:
+            values = list(self.__values.items())
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{format_labels(self.labels, label_values)} {value}" for label_values, value in values]
+
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.__values: dict[tuple, list] = {}  # label values -> [count in every bucket (+Inf last), sum]
+        self.__lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value: float, *label_values: str) -> None:
+        if not METRICS_ENABLED:
+            return
+
+        i = bisect.bisect_left(self.buckets, value)
+        with self.__lock:
+            item = self.__values.get(label_values)
+            if item is None:
+                item = self.__values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            item[0][i] += 1
+            item[1] += value
+
+    def render(self) -> list[str]:
+        with self.__lock:
+            values = [(label_values, list(counts), total) for label_values, (counts, total) in self.__values.items()]
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = format_labels((*self.labels, "le"), (*label_values, str(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+        return lines
+
+
+registry: list[Counter | Histogram] = []
+
+route_seconds = Histogram("notes_http_request_duration_seconds", "Time of handling request by route",
+                          ("method", "route", "status"))
+db_seconds = Histogram("notes_db_call_duration_seconds", "Time of DAO function in db worker", ("function",))
+task_seconds = Histogram("notes_executor_task_duration_seconds", "Time of task in crypto or auth worker",
+                         ("executor", "function"))
+wait_seconds = Histogram("notes_executor_wait_duration_seconds", "Time of waiting for free worker", ("executor",))
+cipher_seconds = Histogram("notes_cipher_duration_seconds", "Time of cipher operation", ("operation",))
+hash_seconds = Histogram("notes_password_hash_duration_seconds", "Time of bcrypt (with waiting for worker)",
+                         ("operation",))
+db_connections = Counter("notes_db_connections_opened_total", "Opened connections to db")
+db_rows = Counter("notes_db_rows_read_total", "Rows read from db")
+cipher_bytes = Counter("notes_cipher_bytes_total", "Bytes of notes encrypted or decrypted", ("operation",))
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def render() -> str:
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+def call_timed(histogram: Histogram, labels: tuple[str, ...], executor: str, func: Callable, *args, **kwargs) -> Callable:
+    """
+    Make call for executor which observes time of waiting for worker and time of call
+    :param labels: label values of call in histogram
+    """
+
+    if not METRICS_ENABLED:
+        return partial(func, *args, **kwargs)
+
+    submitted = time.perf_counter()
+
+    def run() -> Any:
+        start = time.perf_counter()
+        wait_seconds.observe(start - submitted, executor)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start, *labels)
+
+    return run
+
+
+def timed(histogram: Histogram, label: str | None = None) -> Callable:
+    """
+    Decorator: observe time of every call (label is name of function by default)
+    """
+
+    def decorator(func: Callable) -> Callable:
+        if not METRICS_ENABLED:
+            return func
+
+        name = label or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs) -> Any:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+
+        return wrapper
+
+    return decorator
+
+
+def count_row(_, row: tuple) -> tuple:
+    """
+    Row factory of db connections which counts read rows
+    """
+
+    db_rows.inc()
+    return row
+
+
+# ASGI middleware: time of every request by route template (not by path, so ids don't make new series)
+class MetricsMiddleware:
+    def __init__(self, app: Callable) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = { "code": 500 }
+
+        async def send_status(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            route_seconds.observe(time.perf_counter() - start, scope["method"],
+                                  route.path if route is not None else "unmatched", str(status["code"]))
@@ -1,4 +1,5 @@
 import smtplib, os
+from typing import Callable
 from email.mime.text import MIMEText
 from dotenv import load_dotenv
 
@@ -7,21 +8,63 @@ load_dotenv()
 EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
 EMAIL_TOKEN = os.getenv("EMAIL_TOKEN")
 
-smtp_server = "smtp.gmail.com"
-smtp_port = 465
+smtp_server = os.getenv("SMTP_HOST", "smtp.gmail.com")
+smtp_port = int(os.getenv("SMTP_PORT", 465))
+smtp_ssl = os.getenv("SMTP_SSL", "1") == "1"  # 0 - plain SMTP (e.g. local test server)
+smtp_timeout = float(os.getenv("SMTP_TIMEOUT", 30))
 
 
-def notify(receiver: str, text: str) -> None:
-    try:
+def make_message(receiver: str, text: str) -> MIMEText:
+    message = MIMEText(text)
+    message["Subject"] = "NoteAPI: note access notification"
+    message["From"] = EMAIL_ADDRESS or "noreply@localhost"
+    message["To"] = receiver
+
+    return message
+
 
-        message = MIMEText(text)
-        message["Subject"] = "NoteAPI: note access notification"
-        message["To"] = receiver
+def open_session() -> smtplib.SMTP:
+    """
+    Connect and login to SMTP server (session can be used for many messages)
+    """
 
-        # Securely sending
-        with smtplib.SMTP_SSL(smtp_server, smtp_port) as server:
+    if smtp_ssl:
+        server = smtplib.SMTP_SSL(smtp_server, smtp_port, timeout=smtp_timeout)
+    else:
+        server = smtplib.SMTP(smtp_server, smtp_port, timeout=smtp_timeout)
+
+    try:
+        if EMAIL_ADDRESS and EMAIL_TOKEN:
             server.login(EMAIL_ADDRESS, EMAIL_TOKEN)
-            server.send_message(message)
+    except smtplib.SMTPException:
+        server.close()
+        raise
+
+    return server
+
+
+def send_messages(messages: list[tuple[str, str]],
+                  on_result: Callable[[int, bool], None] | None = None) -> list[bool]:
+    """
+    Send messages by one authenticated session
+    :param messages: (receiver, text)
+    :param on_result: called with index of message and result right after it's sent (before next message)
+    :return: was every message sent (error of connection is raised)
+    """
+
+    results = []
+    with open_session() as server:
+        for receiver, text in messages:
+            try:
+                server.send_message(make_message(receiver, text))
+                results.append(True)
+            except smtplib.SMTPServerDisconnected:
+                raise
+            except smtplib.SMTPException as e:
+                print(e)
+                results.append(False)
+
+            if on_result is not None:
+                on_result(len(results) - 1, results[-1])
 
-    except smtplib.SMTPConnectError as e:
-        print(e.smtp_error)
\ No newline at end of file
+    return results
@@ -4,7 +4,8 @@ from fastapi.security import OAuth2PasswordBearer
 import jwt, os
 from datetime import datetime, timedelta, UTC
 
-from database.users import get_user
+from database.users import get_auth_user
+from database.general import run_db
 
 
 class JWT:
@@ -24,7 +25,7 @@ class JWT:
 
     # Get user by JWT
     @staticmethod
-    def get_current_user(request: Request) -> dict:
+    async def get_current_user(request: Request) -> dict:
         auth_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate authentication data",
@@ -45,15 +46,15 @@ class JWT:
         except jwt.PyJWTError:
             raise auth_exception
 
-        user = get_user(username)
+        user = await run_db(get_auth_user, username)  # Db isn't queried on event loop when user isn't cached
         if not user:
             raise auth_exception
 
         return user
 
-    # Check admin by JWT
+    # Check admin by JWT (dependency is function itself, staticmethod object wouldn't be awaited)
     @staticmethod
-    def get_admin(curr_user: dict = Depends(get_current_user)) -> dict:
+    def get_admin(curr_user: dict = Depends(get_current_user.__func__)) -> dict:
         if not curr_user["is_admin"]:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail="Access denied!")
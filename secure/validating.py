@@ -6,12 +6,16 @@ from database.users import get_user
 from database.general import check_existing_email
 from models.users import UserCreateModel
 from models.admins import AdminModel
+from cipher.keystore import LEGACY_X25519_SUFFIX
 
 
 class Checker:
     @staticmethod
     def check_user_data(user: UserCreateModel | AdminModel) -> None:
         # Check username
+        if not Validator.check_valid_username(user.username):
+            raise HTTPException(status_code=400, detail="Username isn't valid!")
+
         existing_user = get_user(user.username)
         if existing_user:
             raise HTTPException(status_code=400, detail="Username already busy!")
@@ -48,6 +52,12 @@ class Validator:
 
         return None
 
+    @staticmethod
+    def check_valid_username(username: str) -> bool:
+        # Username is name of private key in keystore: "/" is reserved for namespaces (and paths of PEM files),
+        # ending of old names of X25519 keys is reserved too
+        return bool(username) and not any(char in username for char in "/\\") and not username.endswith(LEGACY_X25519_SUFFIX)
+
     @staticmethod
     def check_valid_email(email: str) -> bool:
         pattern: str = r"^[A-Za-z0-9._-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$"
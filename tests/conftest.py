@@ -0,0 +1,92 @@
+import os, sys, time, tempfile, itertools
+
+import pytest
+
+
+# Settings are read on import, so environment of tests is set before app is imported
+TMP_DIR = tempfile.mkdtemp(prefix="notes-tests-")
+os.environ.update({
+    "DB_PATH": f"{TMP_DIR}/db/sqlite.db",
+    "KEYS_PATH": f"{TMP_DIR}/private_keys",
+    "BACKUP_FOLDER": f"{TMP_DIR}/backups",
+    "KEY": "test-key",
+    "ADMIN_KEY": "test-admin-key",
+    "EMAIL_ADDRESS": "",
+    "EMAIL_TOKEN": "",
+    "NOTIFY_ENABLED": "0",  # Queue is sent by tests themselves
+    "ENVELOPE_CONVERTER": "0",
+    "BCRYPT_ROUNDS": "4",
+    "KEYS_POOL_SIZE": "0",
+    "AES_KEY_CACHE_SIZE": "100",
+    "PURGE_PAUSE": "0",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+PASSWORD = "Str0ngPassw0rd!x"
+_numbers = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def app():
+    # Lifespan (migrations, background threads) is run once for all tests
+    with TestClient(main.app):
+        yield main.app
+
+
+@pytest.fixture
+def make_user(app):
+    """
+    Sign up new user and return logged client of him: make_user() -> (client, user)
+    """
+
+    def make(is_admin: bool = False) -> tuple[TestClient, dict]:
+        username = f"user{next(_numbers)}"
+        client = TestClient(app)
+
+        if is_admin:
+            response = client.post("/admin/create-admin", json={ "username": username, "password": PASSWORD,
+                                                                 "repeat_password": PASSWORD,
+                                                                 "email": f"{username}@example.com",
+                                                                 "key": os.environ["ADMIN_KEY"] })
+        else:
+            response = client.post("/users/signup", json={ "username": username, "password": PASSWORD,
+                                                           "repeat_password": PASSWORD,
+                                                           "email": f"{username}@example.com" })
+        assert response.status_code == 200, response.text
+
+        login(client, username)
+
+        from database.users import get_user
+        return client, get_user(username)
+
+    return make
+
+
+def login(client: TestClient, username: str) -> None:
+    client.cookies.clear()
+    response = client.post("/users/signin", data={ "username": username, "password": PASSWORD })
+    assert response.status_code == 200, response.text
+    client.headers["X-CSRF-Token"] = client.cookies.get("csrf_token")
+
+
+def purge(admin: TestClient, path: str, timeout: float = 10) -> dict:
+    """
+    Start purge job by admin and wait until it's finished
+    """
+
+    response = admin.delete(path)
+    assert "job_id" in response.json(), response.text
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = admin.get(f"/admin/purge/{response.json()['job_id']}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+
+    raise TimeoutError(path)
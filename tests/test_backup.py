@@ -0,0 +1,30 @@
+import io, os, sqlite3, tarfile
+
+from database import backup
+from database.general import DB_PATH
+
+
+def test_backups_are_rotated_and_newest_is_downloaded(make_user, monkeypatch, tmp_path):
+    monkeypatch.setattr(backup, "BACKUP_FOLDER", str(tmp_path))
+    monkeypatch.setattr(backup, "BACKUP_KEEP", 2)
+    admin, admin_user = make_user(is_admin=True)
+
+    assert admin.get("/admin/download-backup").status_code == 404
+    for _ in range(3):
+        assert admin.post("/admin/backup").status_code == 200
+
+    backups = backup.list_backups()
+    assert len(backups) == 2 and sorted(os.listdir(tmp_path)) == sorted(map(os.path.basename, backups))
+
+    response = admin.get("/admin/download-backup")
+    assert response.status_code == 200
+    assert os.path.basename(backups[0]) in response.headers["Content-Disposition"]
+
+    with tarfile.open(fileobj=io.BytesIO(response.content), mode="r:gz") as tar:
+        names = tar.getnames()
+        tar.extract(os.path.basename(DB_PATH), tmp_path / "restored")
+
+    assert any(name.endswith(f"/{admin_user['username']}_key.pem") for name in names)  # Private key of admin
+    with sqlite3.connect(tmp_path / "restored" / os.path.basename(DB_PATH)) as conn:
+        assert conn.execute("SELECT username FROM users WHERE id = ?", (admin_user["id"],)).fetchone() \
+            == (admin_user["username"],)
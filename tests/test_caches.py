@@ -0,0 +1,114 @@
+from fastapi.testclient import TestClient
+
+from cipher.decrypting import aes_keys_cache, private_keys_cache
+from database.admin import delete_user_pkey
+from database.users import users_cache
+from tests.conftest import PASSWORD, login, purge
+
+
+def share(owner, user_id: int, note_id: int, permission: str = "read") -> None:
+    response = owner.post("/accesses/set-permission", json={ "user_id": user_id, "note_id": note_id },
+                          params={ "permission": permission })
+    assert response.json() == { "message": "User successfully gained access" }
+
+
+def test_private_key_is_parsed_once_and_dropped_with_keys(make_user):
+    client, user = make_user()
+    client.post("/notes/bulk", json={ "notes": [{ "header": f"Note {i}", "text": "text", "tags": None }
+                                                for i in range(3)] })
+    private_keys_cache.delete((user["username"], "x25519"))
+
+    misses = private_keys_cache.stats()["misses"]
+    note_id = min(map(int, client.get("/notes/", params={ "fields": "created_time" }).json()["notes"]))
+    assert client.get(f"/notes/{note_id}").json()["note"]["content"] == "text"
+    assert private_keys_cache.stats()["misses"] == misses + 1
+
+    notes = client.get("/notes/").json()["notes"]  # Page uses parsed key
+    assert [note["content"] for note in notes.values()] == ["text"] * 3
+    assert private_keys_cache.stats()["misses"] == misses + 1
+    assert private_keys_cache.get((user["username"], "x25519")) is not None
+
+    delete_user_pkey(user["username"])
+    assert private_keys_cache.get(user["username"]) is None
+    assert private_keys_cache.get((user["username"], "x25519")) is None
+
+
+def test_revoked_access_drops_cached_aes_key(make_user):
+    owner, _ = make_user()
+    reader, reader_user = make_user()
+    owner.post("/notes/create", json={ "header": "Shared", "text": "secret", "tags": None })
+    note_id = int(next(iter(owner.get("/notes/").json()["notes"])))
+    share(owner, reader_user["id"], note_id)
+
+    assert reader.get(f"/notes/{note_id}").json()["note"]["content"] == "secret"
+    assert aes_keys_cache.get((reader_user["id"], note_id)) is not None
+
+    response = owner.request("DELETE", "/accesses/delete-permission",
+                             json={ "user_id": reader_user["id"], "note_id": note_id })
+    assert response.json() == { "message": "User successfully lost access" }
+    assert aes_keys_cache.get((reader_user["id"], note_id)) is None
+    assert "note" not in reader.get(f"/notes/{note_id}").json()
+
+
+def test_deleted_note_drops_cached_aes_keys(make_user):
+    owner, owner_user = make_user()
+    reader, reader_user = make_user()
+    owner.post("/notes/create", json={ "header": "Deleted", "text": "soon", "tags": None })
+    note_id = int(next(iter(owner.get("/notes/").json()["notes"])))
+    share(owner, reader_user["id"], note_id)
+    reader.get(f"/notes/{note_id}")
+
+    assert owner.delete(f"/notes/{note_id}").status_code == 200
+    assert aes_keys_cache.get((owner_user["id"], note_id)) is None
+    assert aes_keys_cache.get((reader_user["id"], note_id)) is None
+
+
+def test_changed_password_drops_cached_user(make_user):
+    client, user = make_user()
+    assert client.get("/users/statistics").status_code == 200
+    assert users_cache.get(user["username"]) is not None
+
+    response = client.patch("/users/reset-password", json={ "old_password": "Str0ngPassw0rd!x",
+                                                            "new_password": "Str0ngPassw0rd!y",
+                                                            "repeat_password": "Str0ngPassw0rd!y" })
+    assert response.status_code == 200, response.text
+    assert users_cache.get(user["username"]) is None
+
+
+def test_purged_user_is_dropped_from_caches(make_user, app):
+    admin, _ = make_user(is_admin=True)
+    client, user = make_user()
+    client.post("/notes/create", json={ "header": "Old", "text": "keys", "tags": None })
+    client.get("/notes/")
+    assert users_cache.get(user["username"]) is not None
+    assert private_keys_cache.get((user["username"], "x25519")) is not None
+
+    purge(admin, f"/admin/delete-user/{user['id']}")
+
+    assert users_cache.get(user["username"]) is None
+    assert private_keys_cache.get((user["username"], "x25519")) is None
+    assert client.get("/users/statistics").status_code == 401  # Token is still valid, user isn't
+
+    # User with the same name gets new keys and id, nothing old is used from caches
+    client = TestClient(app)
+    response = client.post("/users/signup", json={ "username": user["username"], "password": PASSWORD,
+                                                   "repeat_password": PASSWORD, "email": user["email"] })
+    assert response.status_code == 200, response.text
+    login(client, user["username"])
+
+    client.post("/notes/create", json={ "header": "New", "text": "keys", "tags": None })
+    notes = client.get("/notes/").json()["notes"]
+    assert [note["header"] for note in notes.values()] == ["New"]
+
+
+def test_copy_of_cached_secret_isnt_wiped_on_eviction():
+    from secure.caching import TTLCache, zeroize
+
+    cache = TTLCache(maxsize=1, ttl=60, on_evict=zeroize)
+    secret = bytearray(b"secret")
+    cache.set("key", secret)
+
+    copy = cache.get("key", copy=bytes)
+    cache.set("other", bytearray(b"other"))  # Evicts and wipes "key"
+
+    assert secret == bytearray(6) and copy == b"secret"
@@ -0,0 +1,113 @@
+import os, base64
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from cipher.encrypting import encrypt_aes_key
+from cipher.generate import generate_aes_key
+from database import envelopes
+from database.general import get_connection
+from database.users import get_public_keys
+
+
+def encrypt_legacy_field(key: bytes, data: str) -> str:
+    """
+    Field in format before envelopes: base64 of iv | tag | AES-GCM ciphertext
+    """
+
+    iv = os.urandom(12)
+    sealed = AESGCM(key).encrypt(iv, data.encode(), None)  # Ciphertext | tag
+
+    return base64.b64encode(iv + sealed[-16:] + sealed[:-16]).decode()
+
+
+def add_legacy_note(user: dict, header: str, text: str, tags: str | None) -> int:
+    """
+    Note in format before envelopes: 3 fields in base64 and RSA-wrapped key in base64, without blind tokens
+    """
+
+    key = generate_aes_key()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO notes (header, content, tags, aes_key, created_time, from_user_id) VALUES (?, ?, ?, ?, ?, ?)
+        """, (encrypt_legacy_field(key, header), encrypt_legacy_field(key, text),
+              encrypt_legacy_field(key, tags) if tags is not None else None,
+              base64.b64encode(encrypt_aes_key(get_public_keys(user["id"])["rsa"], key)).decode(),
+              "00:00:00 01-01-2026", user["id"]))
+        conn.commit()
+
+        return cursor.lastrowid
+
+
+def convert_all() -> None:
+    last_id = 0
+    while last_id is not None:
+        last_id = envelopes.convert_batch(last_id, 2)
+
+
+def get_note(client, note_id: int) -> dict:
+    note = client.get(f"/notes/{note_id}").json()["note"]
+
+    return { field: note[field] for field in ("header", "content", "tags") }
+
+
+def test_legacy_and_envelope_notes_are_read_the_same(make_user):
+    client, user = make_user()
+    legacy_id = add_legacy_note(user, "Legacy", "old text", "a, b")
+    client.post("/notes/create", json={ "header": "Envelope", "text": "new text", "tags": None })
+
+    notes = client.get("/notes/").json()["notes"]
+    assert sorted((note["header"], note["content"], note["tags"]) for note in notes.values()) == [
+        ("Envelope", "new text", None), ("Legacy", "old text", "a, b")]
+    assert get_note(client, legacy_id) == { "header": "Legacy", "content": "old text", "tags": "a, b" }
+
+
+def test_converter_rewrites_legacy_note_to_envelope(make_user):
+    client, user = make_user()
+    note_id = add_legacy_note(user, "Legacy", "old text", None)
+
+    convert_all()
+
+    with get_connection() as conn:
+        header, body, aes_key, indexed = conn.execute("""
+            SELECT header, body, aes_key, indexed FROM notes WHERE id = ?
+        """, (note_id,)).fetchone()
+
+    assert header == "" and body is not None and indexed == 1
+    assert isinstance(aes_key, bytes) and len(aes_key) == 256  # Raw RSA wrap instead of base64
+    assert get_note(client, note_id) == { "header": "Legacy", "content": "old text", "tags": None }
+
+
+def test_converter_indexes_tags_and_words_of_old_notes(make_user):
+    client, user = make_user()
+    legacy_id = add_legacy_note(user, "Legacy", "searchable words", "old-tag")
+    client.post("/notes/create", json={ "header": "Envelope", "text": "other words", "tags": "old-tag" })
+    envelope_id = max(map(int, client.get("/notes/").json()["notes"]))
+
+    # Envelope note written before tokens were keyed by owner
+    with get_connection() as conn:
+        conn.execute("UPDATE notes SET indexed = 0 WHERE id = ?", (envelope_id,))
+        conn.execute("DELETE FROM note_tags WHERE note_id = ?", (envelope_id,))
+        conn.commit()
+
+    assert client.get("/notes/", params={ "tags": "old-tag" }).json() == { "message": "No notes found!" }
+
+    convert_all()
+
+    found = client.get("/notes/", params={ "tags": "old-tag" }).json()["notes"]
+    assert sorted(map(int, found)) == [legacy_id, envelope_id]
+    assert list(map(int, client.get("/notes/search", params={ "q": "searchable" }).json()["notes"])) == [legacy_id]
+
+
+def test_converter_keeps_edited_notes(make_user):
+    client, user = make_user()
+    note_id = add_legacy_note(user, "Legacy", "old text", None)
+
+    response = client.put(f"/notes/edit-note/{note_id}", json={ "id": note_id, "header": "Edited", "text": "new",
+                                                                "tags": "edited" })
+    assert response.status_code == 200, response.text
+
+    convert_all()
+
+    assert get_note(client, note_id) == { "header": "Edited", "content": "new", "tags": "edited" }
+    assert list(map(int, client.get("/notes/", params={ "tags": "edited" }).json()["notes"])) == [note_id]
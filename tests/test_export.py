@@ -0,0 +1,38 @@
+import gzip, json
+
+from tests.test_notes import add_notes, share
+
+
+def lines(content: bytes) -> list[dict]:
+    return [json.loads(line) for line in content.decode().splitlines()]
+
+
+def test_export_has_all_notes_by_chunks_plain_and_gzipped(make_user, monkeypatch):
+    from routers import notes
+
+    monkeypatch.setattr(notes, "EXPORT_CHUNK", 2)
+    owner, _ = make_user()
+    client, user = make_user()
+    own_ids = add_notes(client, 4, "tag")
+    shared_id, = add_notes(owner, 1)
+    share(owner, [user["id"]], [shared_id])
+
+    response = client.get("/notes/export")
+    assert response.status_code == 200 and response.headers["content-type"] == "application/x-ndjson"
+    exported = lines(response.content)
+    assert [note["id"] for note in exported] == sorted(own_ids + [shared_id])
+    assert exported[0]["content"] == "text 0" and exported[0]["tags"] == "tag"
+
+    response = client.get("/notes/export", params={ "compress": True })
+    assert response.headers["content-type"] == "application/gzip"
+    assert lines(gzip.decompress(response.content)) == exported
+
+    projected = lines(client.get("/notes/export", params={ "fields": "header" }).content)
+    assert projected == [{ "id": note["id"], "header": note["header"] } for note in exported]
+
+
+def test_export_of_user_without_notes_is_empty(make_user):
+    client, _ = make_user()
+
+    assert client.get("/notes/export").content == b""
+    assert gzip.decompress(client.get("/notes/export", params={ "compress": True }).content) == b""
@@ -0,0 +1,18 @@
+import threading
+
+from secure.hashing import Hasher
+from tests.conftest import PASSWORD, login
+
+
+def test_signin_fails_fast_when_hashing_queue_is_full(make_user, monkeypatch):
+    client, user = make_user()
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(Hasher, "_Hasher__slots", slots)
+
+    slots.acquire()  # Queue is full
+    client.cookies.clear()
+    response = client.post("/users/signin", data={ "username": user["username"], "password": PASSWORD })
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+
+    slots.release()
+    login(client, user["username"])
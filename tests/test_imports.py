@@ -0,0 +1,102 @@
+import io, json, zipfile
+
+from routers import imports
+
+
+def start_import(client) -> str:
+    response = client.post("/notes/import")
+    assert response.status_code == 200, response.text
+
+    return response.json()["job_id"]
+
+
+def upload(client, data, format: str = "ndjson") -> dict:
+    response = client.put(f"/notes/import/{start_import(client)}", content=data, params={ "format": format })
+    assert response.status_code == 200, response.text
+
+    return response.json()
+
+
+def chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def headers(client) -> dict:
+    notes = client.get("/notes/", params={ "fields": "header,tags", "limit": 100 }).json().get("notes", {})
+
+    return { note["header"]: note["tags"] for note in notes.values() }
+
+
+def test_ndjson_reports_bad_and_too_long_lines(make_user, monkeypatch):
+    monkeypatch.setattr(imports, "IMPORT_MAX_RECORD", 100)
+    client, _ = make_user()
+    data = "\n".join([
+        json.dumps({ "header": "First", "text": "text", "tags": "a" }),
+        json.dumps({ "header": "Long", "text": "x" * 300 }),  # Longer than buffer and than chunks
+        "{not json",
+        "",
+        json.dumps(["list"]),
+        json.dumps({ "header": "Exported", "content": "text" }),
+        json.dumps({ "header": "", "text": "text" }),
+        json.dumps({ "header": "Last", "text": "text" }),  # Without line break
+    ]).encode()
+
+    job = upload(client, chunks(data, 64))
+
+    assert job["status"] == "done" and job["processed"] == 7 and job["done"] == 3
+    assert job["errors"] == [{ "record": "2", "error": "Record is too long" },
+                             { "record": "3", "error": "Incorrect JSON" },
+                             { "record": "5", "error": "Record must be JSON object" },
+                             { "record": "7", "error": "Incorrect input of note!" }]
+    assert headers(client) == { "First": "a", "Exported": None, "Last": None }
+
+
+def test_too_long_last_line_is_reported(make_user, monkeypatch):
+    monkeypatch.setattr(imports, "IMPORT_MAX_RECORD", 100)
+    client, _ = make_user()
+
+    job = upload(client, chunks(b'{"header": "Ok", "text": "text"}\n' + b"x" * 300, 50))
+
+    assert job["done"] == 1 and job["errors"] == [{ "record": "2", "error": "Record is too long" }]
+
+
+def test_markdown_files_of_zip_are_parsed(make_user, monkeypatch):
+    monkeypatch.setattr(imports, "IMPORT_MAX_RECORD", 100)
+    client, _ = make_user()
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as file:
+        file.writestr("notes/first.md", "# Shopping list\n\nTags: home, #todo\nmilk\nbread\n")
+        file.writestr("Untitled idea.md", "Just text")
+        file.writestr("empty.md", "# Header only\n")
+        file.writestr("big.md", "x" * 300)
+        file.writestr("image.png", b"\x89PNG")
+        file.writestr("folder/", "")
+
+    job = upload(client, archive.getvalue(), "markdown")
+
+    assert job["done"] == 2
+    assert job["errors"] == [{ "record": "empty.md", "error": "Incorrect input of note!" },
+                             { "record": "big.md", "error": "Record is too long" }]
+    assert headers(client) == { "Shopping list": "home, #todo", "Untitled idea": None }
+
+    note_id = next(iter(client.get("/notes/", params={ "tags": "todo" }).json()["notes"]))
+    assert client.get(f"/notes/{note_id}").json()["note"]["content"] == "milk\nbread"
+
+    assert upload(client, b"not zip", "markdown")["errors"] == [{ "record": "archive", "error": "Incorrect zip archive" }]
+
+
+def test_job_is_seen_and_uploaded_only_by_owner_once(make_user):
+    client, _ = make_user()
+    other, _ = make_user()
+    job_id = start_import(client)
+
+    assert client.get(f"/notes/import/{job_id}").json()["status"] == "waiting"
+    assert other.get(f"/notes/import/{job_id}").status_code == 404
+    assert other.put(f"/notes/import/{job_id}", content=b"").status_code == 404
+    assert client.get("/notes/import/unknown").status_code == 404
+
+    assert client.put(f"/notes/import/{job_id}", content=b'{"header": "h", "text": "t"}').status_code == 200
+    assert client.put(f"/notes/import/{job_id}", content=b"").status_code == 409
+    assert client.get(f"/notes/import/{job_id}").json()["done"] == 1
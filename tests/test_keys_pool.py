@@ -0,0 +1,33 @@
+import time
+
+from cipher import generate
+
+
+def wait_depth(depth: int, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while generate.keys_pool_stats()["depth"] < depth:
+        assert time.monotonic() < deadline, "Pool isn't refilled"
+        time.sleep(0.01)
+
+
+def test_pool_is_refilled_and_key_is_generated_when_its_empty(monkeypatch):
+    monkeypatch.setattr(generate, "KEYS_POOL_SIZE", 2)
+    monkeypatch.setattr(generate, "KEYS_POOL_INTERVAL", 0)
+    before = generate.keys_pool_stats()
+
+    generate.start_keys_pool()
+    try:
+        wait_depth(2)
+        pooled = list(generate._pool)
+        assert generate.take_private_key() is pooled[0]
+        wait_depth(2)  # Taken key is replaced
+    finally:
+        generate.stop_keys_pool()
+
+    stats = generate.keys_pool_stats()
+    assert stats["depth"] == 0
+    assert stats["taken"] == before["taken"] + 1 and stats["refilled"] == before["refilled"] + 3
+
+    key = generate.take_private_key()  # Pool is empty
+    assert key.key_size == 2048 and key not in pooled
+    assert generate.keys_pool_stats()["generated_inline"] == before["generated_inline"] + 1
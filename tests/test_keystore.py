@@ -0,0 +1,162 @@
+import os, io, uuid, tarfile
+
+import pytest
+
+from cipher.keystore import FileKeystore, PemKeystore, SqliteKeystore, x25519_key_name
+
+
+@pytest.fixture(params=["pem", "file", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "file":
+        store = FileKeystore(str(tmp_path / "keys.store"))
+    elif request.param == "sqlite":
+        store = SqliteKeystore(str(tmp_path / "keys.db"))
+    else:
+        store = PemKeystore()
+
+    yield store
+    store.close()
+
+
+def unique_name() -> str:
+    return f"test-{uuid.uuid4().hex}"  # PEM files are shared with other tests
+
+
+def test_put_get_replace_delete(store):
+    name = unique_name()
+
+    store.put_key(name, b"first")
+    assert store.get_key(name) == b"first"
+
+    store.put_key(name, b"second")
+    assert store.get_key(name) == b"second"
+
+    store.delete_key(name)
+    with pytest.raises(KeyError):
+        store.get_key(name)
+    store.delete_key(name)  # Deleting of missing key isn't error
+
+
+def test_many_keys_and_x25519_namespace(store):
+    name = unique_name()
+
+    store.put_keys([(name, b"rsa"), (x25519_key_name(name), b"x25519"), (f"{name}_x25519", b"other user")])
+    assert store.get_key(name) == b"rsa"
+    assert store.get_key(x25519_key_name(name)) == b"x25519"
+    assert store.get_key(f"{name}_x25519") == b"other user"
+
+    store.delete_keys([name, x25519_key_name(name)])
+    assert store.get_key(f"{name}_x25519") == b"other user"
+
+
+def test_old_pem_files_are_read(store):
+    name = unique_name()
+    PemKeystore().put_key(name, b"pem")
+
+    assert store.get_key(name) == b"pem"
+
+    store.delete_key(name)
+    with pytest.raises(KeyError):
+        store.get_key(name)
+
+
+def test_backup_has_keys(store, tmp_path):
+    name = unique_name()
+    store.put_key(name, b"backed up")
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        store.add_to_backup(tar, "private_keys")
+
+    buffer.seek(0)
+    with tarfile.open(fileobj=buffer) as tar:
+        tar.extractall(tmp_path / "restored", filter="data")
+
+    restored = tmp_path / "restored" / "private_keys"
+    if isinstance(store, PemKeystore) and not store.files:
+        assert (restored / f"{name}_key.pem").read_bytes() == b"backed up"
+        return
+
+    copy = type(store)(str(restored / os.path.basename(store.path)))
+    assert copy.get_key(name) == b"backed up"
+    copy.close()
+
+
+def test_file_keystore_cuts_torn_tail(tmp_path):
+    path = str(tmp_path / "keys.store")
+    store = FileKeystore(path)
+    store.put_keys([("first", b"one"), ("second", b"two")])
+    store.close()
+
+    # Record which wasn't written completely (crash during append)
+    size = os.path.getsize(path)
+    with open(path, "ab") as file:
+        file.write(FileKeystore.RECORD.pack(FileKeystore.PUT, 5, 100) + b"third" + b"partial")
+
+    store = FileKeystore(path)
+    assert os.path.getsize(path) == size
+    assert store.get_key("first") == b"one"
+    with pytest.raises(KeyError):
+        store.get_key("third")
+
+    store.put_key("third", b"three")
+    store.close()
+
+    store = FileKeystore(path)
+    assert [store.get_key(name) for name in ("first", "second", "third")] == [b"one", b"two", b"three"]
+    store.close()
+
+
+def test_file_keystore_sees_writes_of_other_instance(tmp_path):
+    path = str(tmp_path / "keys.store")
+    server, cli = FileKeystore(path), FileKeystore(path)
+
+    cli.put_key("from-cli", b"cli")
+    assert server.get_key("from-cli") == b"cli"
+
+    server.put_key("from-server", b"server")
+    cli.delete_key("from-cli")
+    server.put_key("after-delete", b"x")  # Appended after record of other instance
+    assert cli.get_key("from-server") == b"server"
+    assert cli.get_key("after-delete") == b"x"
+    with pytest.raises(KeyError):
+        server.get_key("from-cli")
+
+    server.close()
+    cli.close()
+
+
+def test_file_keystore_compact_keeps_writes_of_other_instance(tmp_path):
+    path = str(tmp_path / "keys.store")
+    server, cli = FileKeystore(path), FileKeystore(path)
+    for i in range(10):
+        server.put_key("replaced", str(i).encode())
+    server.put_key("deleted", b"x")
+    server.delete_key("deleted")
+    size = os.path.getsize(path)
+
+    cli.compact()
+    assert os.path.getsize(path) < size
+
+    # Server still has old file open, it writes to the new one
+    server.put_key("after-compact", b"kept")
+    assert server.get_key("replaced") == b"9"
+
+    reopened = FileKeystore(path)
+    assert reopened.get_key("after-compact") == b"kept"
+    assert reopened.get_key("replaced") == b"9"
+    with pytest.raises(KeyError):
+        reopened.get_key("deleted")
+
+    for store in (server, cli, reopened):
+        store.close()
+
+
+def test_file_keystore_is_rejected_without_fcntl(monkeypatch):
+    from cipher import keystore
+
+    monkeypatch.setattr(keystore, "fcntl", None)  # Windows
+
+    with pytest.raises(ValueError, match="fcntl"):
+        keystore.open_keystore("file")
+    assert isinstance(keystore.open_keystore("pem"), PemKeystore)
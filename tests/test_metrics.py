@@ -0,0 +1,24 @@
+from fastapi.testclient import TestClient
+
+
+def test_metrics_need_login(app):
+    assert TestClient(app).get("/metrics").status_code == 401
+
+
+def test_metrics_are_only_for_admins(make_user):
+    client, _ = make_user()
+
+    assert client.get("/metrics").status_code == 403
+
+
+def test_admin_gets_metrics_without_csrf_token(make_user):
+    admin, _ = make_user(is_admin=True)
+    admin.get("/users/statistics")
+    del admin.headers["X-CSRF-Token"]  # Scraper sends only cookie
+
+    response = admin.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'notes_http_request_duration_seconds_count{method="GET",route="/users/statistics",status="200"}' in response.text
+    assert "# TYPE notes_db_call_duration_seconds histogram" in response.text
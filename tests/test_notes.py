@@ -0,0 +1,212 @@
+from routers.notes import BULK_NOTES_LIMIT
+
+
+def add_notes(client, count: int, tags: str | None = None) -> list[int]:
+    response = client.post("/notes/bulk", json={ "notes": [{ "header": f"Note {i}", "text": f"text {i}", "tags": tags }
+                                                           for i in range(count)] })
+    assert response.status_code == 200, response.text
+
+    return list(response.json()["created"].values())
+
+
+def share(owner, user_ids: list[int], note_ids: list[int]) -> list[dict]:
+    response = owner.post("/accesses/bulk-set-permission", json={ "user_ids": user_ids, "note_ids": note_ids })
+    assert response.status_code == 200, response.text
+
+    return response.json()["results"]
+
+
+def test_keyset_pages_have_all_notes_once(make_user):
+    owner, _ = make_user()
+    client, user = make_user()
+    own_ids = add_notes(client, 7)
+    shared_ids = add_notes(owner, 4)
+    share(owner, [user["id"]], shared_ids[::2])
+
+    pages, after_id = [], 0
+    while after_id is not None:
+        page = client.get("/notes/", params={ "limit": 3, "after_id": after_id }).json()
+        if "notes" not in page:  # Last page was full
+            break
+
+        pages.append([int(note_id) for note_id in page["notes"]])
+        after_id = page["next_cursor"]
+
+    ids = [note_id for page in pages for note_id in page]
+    assert ids == sorted(own_ids + shared_ids[::2])
+    assert all(len(page) == 3 for page in pages[:-1])
+
+    # Offset pages give the same notes
+    offset_ids = [int(note_id) for page in (1, 2, 3) for note_id in
+                  client.get("/notes/", params={ "limit": 3, "page": page }).json().get("notes", {})]
+    assert offset_ids == ids
+
+
+def test_last_full_page_has_cursor_and_next_page_is_empty(make_user):
+    client, _ = make_user()
+    ids = add_notes(client, 2)
+
+    page = client.get("/notes/", params={ "limit": 2, "after_id": 0 }).json()
+    assert page["next_cursor"] == max(ids)
+    assert client.get("/notes/", params={ "limit": 2, "after_id": max(ids) }).json() == { "message": "No notes found!" }
+
+
+def test_tags_filter_own_and_shared_notes(make_user):
+    owner, _ = make_user()
+    client, user = make_user()
+    other, _ = make_user()
+    own_id, = add_notes(client, 1, "Work, ideas")
+    shared_id, = add_notes(owner, 1, "#work")
+    add_notes(owner, 1, "work")  # Not shared
+    add_notes(other, 1, "work")  # Equal tag of other user
+    share(owner, [user["id"]], [shared_id])
+
+    found = client.get("/notes/", params={ "tags": "work" }).json()["notes"]
+    assert sorted(map(int, found)) == [own_id, shared_id]
+
+    found = client.get("/notes/", params={ "tags": "work, ideas", "tags_mode": "all", "after_id": 0 }).json()["notes"]
+    assert list(map(int, found)) == [own_id]
+
+
+def test_tags_of_users_are_different_tokens(make_user):
+    from database.general import get_connection
+
+    first, _ = make_user()
+    second, _ = make_user()
+    first_id, = add_notes(first, 1, "shared-tag")
+    second_id, = add_notes(second, 1, "shared-tag")
+
+    with get_connection() as conn:
+        tokens = conn.execute("SELECT note_id, token FROM note_tags WHERE note_id IN (?, ?)",
+                              (first_id, second_id)).fetchall()
+
+    assert len({ token for _, token in tokens }) == 2
+
+
+def test_bulk_create_reports_errors_per_note(make_user):
+    client, _ = make_user()
+
+    response = client.post("/notes/bulk", json={ "notes": [{ "header": "Good", "text": "text", "tags": None },
+                                                           { "header": "", "text": "text", "tags": None },
+                                                           { "header": "Good too", "text": "text", "tags": "a" }] })
+    body = response.json()
+    assert body["message"] == "2 of 3 notes added"
+    assert sorted(body["created"]) == ["0", "2"]
+    assert body["errors"] == { "1": "Incorrect input of note!" }
+
+
+def test_bulk_create_all_or_nothing_adds_nothing(make_user):
+    client, _ = make_user()
+
+    response = client.post("/notes/bulk", json={ "all_or_nothing": True,
+                                                 "notes": [{ "header": "Good", "text": "text", "tags": None },
+                                                           { "header": "Bad", "text": "", "tags": None }] })
+    assert response.status_code == 400
+    assert response.json()["detail"] == { "errors": { "1": "Incorrect input of note!" } }
+    assert client.get("/notes/").json() == { "message": "No notes found!" }
+
+
+def test_bulk_create_rejects_empty_and_too_big_batches(make_user):
+    client, _ = make_user()
+
+    assert client.post("/notes/bulk", json={ "notes": [] }).status_code == 400
+    notes = [{ "header": "h", "text": "t", "tags": None }] * (BULK_NOTES_LIMIT + 1)
+    assert client.post("/notes/bulk", json={ "notes": notes }).status_code == 400
+
+
+def test_bulk_create_keeps_notes_which_db_accepts(make_user):
+    from database.notes import add_notes as add_notes_db
+    from models.notes import NoteInternalModel
+
+    _, user = make_user()
+
+    note = NoteInternalModel(header="", text="", tags=None, body=b"body", aes_key=b"unique key of bulk test",
+                             created_time="00:00:00 01-01-2026")
+    broken = note.model_copy(update={ "aes_key": b"other key of bulk test", "created_time": None })
+    duplicate = note.model_copy()
+
+    result = add_notes_db([note, broken, duplicate], user["id"], [[], [], []], [("", "")] * 3)
+
+    assert isinstance(result[0], int)
+    assert "NOT NULL" in result[1]
+    assert "UNIQUE" in result[2]
+
+
+def test_bulk_share_reports_rejected_pairs(make_user):
+    owner, owner_user = make_user()
+    stranger, _ = make_user()
+    _, user = make_user()
+    own_id, = add_notes(owner, 1)
+    foreign_id, = add_notes(stranger, 1)
+
+    results = share(owner, [user["id"], owner_user["id"], 10 ** 9], [own_id, foreign_id])
+    messages = { (result["note_id"], result["user_id"]): result["message"] for result in results }
+
+    assert messages == {
+        (own_id, user["id"]): "User successfully gained access",
+        (own_id, owner_user["id"]): "You can't change access of yourself!",
+        (own_id, 10 ** 9): "User not found",
+        (foreign_id, user["id"]): "This action can only be performed by owner of note",
+        (foreign_id, owner_user["id"]): "This action can only be performed by owner of note",
+        (foreign_id, 10 ** 9): "This action can only be performed by owner of note",
+    }
+
+    results = share(owner, [user["id"]], [own_id])
+    assert results[0]["message"] == "This user already has access to this note"
+
+
+def test_bulk_delete_access_reports_missing_accesses(make_user):
+    owner, _ = make_user()
+    reader, user = make_user()
+    _, other = make_user()
+    shared_id, = add_notes(owner, 1)
+    share(owner, [user["id"]], [shared_id])
+
+    response = owner.request("DELETE", "/accesses/bulk-delete-permission",
+                             json={ "user_ids": [user["id"], other["id"]], "note_ids": [shared_id] })
+    messages = { result["user_id"]: result["message"] for result in response.json()["results"] }
+
+    assert messages == { user["id"]: "User successfully lost access",
+                         other["id"]: "This user doesn't have access to this note" }
+    assert reader.get("/notes/").json() == { "message": "No notes found!" }
+
+
+def test_page_keeps_order_and_corrupted_note_only_has_error(make_user):
+    from database.general import get_connection
+
+    client, _ = make_user()
+    ids = add_notes(client, 6)
+    with get_connection() as conn:
+        body = conn.execute("SELECT body FROM notes WHERE id = ?", (ids[2],)).fetchone()[0]
+        conn.execute("UPDATE notes SET body = ? WHERE id = ?", (body[:-1] + bytes([body[-1] ^ 1]), ids[2]))  # Bad tag
+        conn.commit()
+
+    order = list(client.get("/notes/", params={ "fields": "created_time" }).json()["notes"])
+    notes = client.get("/notes/").json()["notes"]
+
+    assert list(notes) == order and len(order) == 6
+    assert notes.pop(str(ids[2])) == { "error": "Note can't be decrypted" }
+    assert sorted(note["content"] for note in notes.values()) == [f"text {i}" for i in (0, 1, 3, 4, 5)]
+
+
+def test_fields_without_encrypted_ones_skip_decryption(make_user, monkeypatch):
+    from cipher import decrypting
+    from routers import notes
+
+    client, user = make_user()
+    note_id, = add_notes(client, 1, "tag")
+
+    assert client.get(f"/notes/{note_id}", params={ "fields": "header, tags" }).json()["note"] == {
+        "id": note_id, "header": "Note 0", "tags": "tag" }
+    assert client.get("/notes/", params={ "fields": "id" }).status_code == 400
+
+    def failing(*args):
+        raise AssertionError("Note is decrypted")
+
+    monkeypatch.setattr(decrypting, "decrypt_note", failing)
+    monkeypatch.setattr(notes, "decrypt_note", failing)
+
+    note = client.get(f"/notes/{note_id}", params={ "fields": "created_time,from_user_id" }).json()["note"]
+    assert set(note) == { "id", "created_time", "from_user_id" } and note["from_user_id"] == user["id"]
+    page = client.get("/notes/", params={ "fields": "last_edit_time" }).json()["notes"]
+    assert page == { str(note_id): { "last_edit_time": None } }
@@ -0,0 +1,130 @@
+import smtplib, sqlite3
+
+import pytest
+
+from database import notifications
+from database.general import get_connection
+
+
+@pytest.fixture
+def queue(app, monkeypatch):
+    """
+    Empty queue with events which are due at once, sent by fake SMTP session: queue -> list of sent (receiver, text)
+    """
+
+    with get_connection() as conn:
+        conn.execute("DELETE FROM notifications")
+        conn.commit()
+
+    monkeypatch.setattr(notifications, "NOTIFY_DELAY", 0)
+    monkeypatch.setattr(notifications, "NOTIFY_BACKOFF", 0)
+    sent = []
+
+    def send_messages(messages, on_result=None):
+        for i, message in enumerate(messages):
+            sent.append(message)
+            if on_result is not None:
+                on_result(i, True)
+
+        return [True] * len(messages)
+
+    monkeypatch.setattr(notifications, "send_messages", send_messages)
+
+    return sent
+
+
+def queued() -> list[tuple[str, int]]:
+    with get_connection() as conn:
+        return conn.execute("SELECT receiver, attempts FROM notifications ORDER BY id").fetchall()
+
+
+def share_notes(make_user, count: int) -> tuple[dict, dict]:
+    owner, owner_user = make_user()
+    _, reader = make_user()
+    owner.post("/notes/bulk", json={ "notes": [{ "header": f"Note {i}", "text": "text", "tags": None }
+                                               for i in range(count)] })
+    note_ids = list(map(int, owner.get("/notes/").json()["notes"]))
+    owner.post("/accesses/bulk-set-permission", json={ "user_ids": [reader["id"]], "note_ids": note_ids })
+
+    return owner_user, reader
+
+
+def test_events_of_receiver_are_sent_in_one_email(make_user, queue):
+    owner, reader = share_notes(make_user, 3)
+    assert [receiver for receiver, _ in queued()] == [reader["email"]] * 3
+
+    assert notifications.send_due() == 3
+
+    assert len(queue) == 1
+    receiver, text = queue[0]
+    assert receiver == reader["email"] and text.count(f"From user: {owner['email']}") == 3
+    assert queued() == []
+
+
+def test_rejected_email_is_retried_then_dropped(make_user, queue, monkeypatch):
+    _, reader = share_notes(make_user, 1)
+    monkeypatch.setattr(notifications, "send_messages", lambda messages, on_result: on_result(0, False))
+    monkeypatch.setattr(notifications, "NOTIFY_MAX_ATTEMPTS", 2)
+
+    notifications.send_due()
+    assert queued() == [(reader["email"], 1)]
+
+    notifications.send_due()
+    assert queued() == []
+
+
+def test_retry_waits_for_backoff(make_user, queue, monkeypatch):
+    share_notes(make_user, 1)
+    monkeypatch.setattr(notifications, "NOTIFY_BACKOFF", 60)
+
+    def unavailable(messages, on_result):
+        raise OSError("Connection refused")
+
+    monkeypatch.setattr(notifications, "send_messages", unavailable)
+    assert notifications.send_due() == 1
+    assert notifications.send_due() == 0  # Not due yet
+    assert [attempts for _, attempts in queued()] == [1]
+
+
+def test_disconnect_doesnt_send_sent_emails_again(make_user, queue, monkeypatch):
+    _, first = share_notes(make_user, 1)
+    _, second = share_notes(make_user, 1)
+
+    def disconnected(messages, on_result):
+        queue.append(messages[0])
+        on_result(0, True)
+        raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+
+    monkeypatch.setattr(notifications, "send_messages", disconnected)
+    notifications.send_due()
+
+    assert [receiver for receiver, _ in queue] == [first["email"]]
+    assert queued() == [(second["email"], 1)]
+
+
+def test_event_isnt_queued_when_sharing_fails(make_user, queue):
+    owner, _ = make_user()
+    owner.post("/accesses/bulk-set-permission", json={ "user_ids": [10 ** 9], "note_ids": [10 ** 9] })
+
+    assert queued() == []
+
+
+def test_access_is_rolled_back_when_event_isnt_queued(make_user, queue, monkeypatch):
+    from database.accesses import set_permission
+    from models.accesses import AccessInternalModel
+
+    owner, owner_user = make_user()
+    _, reader = make_user()
+    owner.post("/notes/create", json={ "header": "Note", "text": "text", "tags": None })
+    note_id, = map(int, owner.get("/notes/").json()["notes"])
+
+    def broken(cursor, user_id, text):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(notifications, "enqueue", broken)
+    with pytest.raises(sqlite3.OperationalError):
+        set_permission(AccessInternalModel(user_id=reader["id"], note_id=note_id, permission=1, key=b"key"),
+                       owner_user["id"])
+
+    with get_connection() as conn:
+        assert conn.execute("SELECT * FROM accesses WHERE note_id = ?", (note_id,)).fetchall() == []
@@ -0,0 +1,137 @@
+import pytest
+
+from cipher.keystore import keystore, x25519_key_name
+from database.general import get_connection
+from tests.conftest import purge
+
+
+def count_rows(user_id: int, note_ids: list[int]) -> dict:
+    marks = ", ".join("?" * len(note_ids))
+    with get_connection() as conn:
+        return {
+            "users": conn.execute("SELECT COUNT(*) FROM users WHERE id = ?", (user_id,)).fetchone()[0],
+            "statistics": conn.execute("SELECT COUNT(*) FROM statistics WHERE user_id = ?", (user_id,)).fetchone()[0],
+            "notes": conn.execute(f"SELECT COUNT(*) FROM notes WHERE id IN ({marks})", note_ids).fetchone()[0],
+            "accesses": conn.execute(f"SELECT COUNT(*) FROM accesses WHERE note_id IN ({marks}) OR user_id = ?",
+                                     (*note_ids, user_id)).fetchone()[0],
+            "note_tags": conn.execute(f"SELECT COUNT(*) FROM note_tags WHERE note_id IN ({marks})",
+                                      note_ids).fetchone()[0],
+            "notes_search": conn.execute(f"SELECT COUNT(*) FROM notes_search WHERE rowid IN ({marks})",
+                                         note_ids).fetchone()[0],
+        }
+
+
+def test_purge_of_user_deletes_all_his_rows_and_keys(make_user):
+    admin, _ = make_user(is_admin=True)
+    client, user = make_user()
+    friend, friend_user = make_user()
+    client.post("/notes/bulk", json={ "notes": [{ "header": f"Note {i}", "text": "text", "tags": "tag" }
+                                                for i in range(3)] })
+    friend.post("/notes/create", json={ "header": "Friend's", "text": "text", "tags": None })
+    note_ids = list(map(int, client.get("/notes/").json()["notes"]))
+    friend_note_id = int(next(iter(friend.get("/notes/").json()["notes"])))
+    client.post("/accesses/set-permission", json={ "user_id": friend_user["id"], "note_id": note_ids[0] })
+    friend.post("/accesses/set-permission", json={ "user_id": user["id"], "note_id": friend_note_id })
+
+    job = purge(admin, f"/admin/delete-user/{user['id']}")
+
+    assert job["status"] == "done" and job["done"] == 1 and job["notes"] == 3
+    assert count_rows(user["id"], note_ids) == { "users": 0, "statistics": 0, "notes": 0, "accesses": 0,
+                                                 "note_tags": 0, "notes_search": 0 }
+    for name in (user["username"], x25519_key_name(user["username"])):
+        with pytest.raises(KeyError):
+            keystore.get_key(name)
+
+    # Other users keep their notes
+    assert list(map(int, friend.get("/notes/").json()["notes"])) == [friend_note_id]
+
+
+def test_purge_of_unknown_user_or_admin_isnt_started(make_user):
+    admin, admin_user = make_user(is_admin=True)
+
+    assert admin.delete("/admin/delete-user/1000000000").json() == { "message": "User not found" }
+    assert admin.delete(f"/admin/delete-user/{admin_user['id']}").json() == { "message": "User not found" }
+    assert admin.get("/admin/purge/unknown").status_code == 404
+
+
+def test_purge_needs_admin(make_user):
+    client, user = make_user()
+
+    assert client.delete(f"/admin/delete-user/{user['id']}").status_code == 403
+    assert client.delete("/admin/delete-users").status_code == 403
+
+
+def test_purge_of_all_users_keeps_admins(make_user, monkeypatch):
+    from database import admin as admin_db
+
+    monkeypatch.setattr(admin_db, "PURGE_BATCH", 2)  # Many batches of users and notes
+    admin, admin_user = make_user(is_admin=True)
+    users = [make_user() for _ in range(3)]
+    for client, _ in users:
+        client.post("/notes/bulk", json={ "notes": [{ "header": f"Note {i}", "text": "text", "tags": None }
+                                                    for i in range(3)] })
+
+    job = purge(admin, "/admin/delete-users")
+
+    assert job["status"] == "done"
+    with get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM users WHERE is_admin = 0").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0] == 0
+        assert conn.execute("SELECT id FROM users WHERE is_admin = 1 AND id = ?", (admin_user["id"],)).fetchone()
+    for client, _ in users:
+        assert client.get("/notes/").status_code == 401
+    assert admin.delete("/admin/delete-users").json() == { "message": "No users found" }
+
+
+def test_admin_delete_note_deletes_its_accesses(make_user):
+    admin, _ = make_user(is_admin=True)
+    owner, _ = make_user()
+    reader, reader_user = make_user()
+    owner.post("/notes/create", json={ "header": "Shared", "text": "text", "tags": "tag" })
+    note_id = int(next(iter(owner.get("/notes/").json()["notes"])))
+    owner.post("/accesses/set-permission", json={ "user_id": reader_user["id"], "note_id": note_id })
+
+    assert admin.delete(f"/admin/delete-note/{note_id}").json() == { "message": "Note is successfully deleted" }
+    assert admin.delete(f"/admin/delete-note/{note_id}").json() == { "message": "Note not found" }
+    assert count_rows(reader_user["id"], [note_id]) == { "users": 1, "statistics": 1, "notes": 0, "accesses": 0,
+                                                         "note_tags": 0, "notes_search": 0 }
+    assert reader.get("/notes/").json() == { "message": "No notes found!" }
+
+
+def test_status_of_purge_isnt_evicted_by_imports(make_user, monkeypatch):
+    from database import jobs
+
+    admin, _ = make_user(is_admin=True)
+    client, user = make_user()
+    job = purge(admin, f"/admin/delete-user/{user['id']}")
+
+    monkeypatch.setattr(jobs.jobs["import"], "maxsize", 2)
+    for _ in range(3):
+        jobs.create_job("import", user["id"])
+
+    assert admin.get(f"/admin/purge/{job['id']}").json()["status"] == "done"
+    assert admin.get(f"/admin/purge/{jobs.create_job('import', 1)['id']}").status_code == 404  # Not a purge
+
+
+def test_next_purge_deletes_rows_left_by_interrupted_purge(make_user):
+    admin, _ = make_user(is_admin=True)
+    client, user = make_user()
+    other, other_user = make_user()
+    other.post("/notes/create", json={ "header": "Shared", "text": "text", "tags": None })
+    shared_id = int(next(iter(other.get("/notes/").json()["notes"])))
+    other.post("/accesses/set-permission", json={ "user_id": user["id"], "note_id": shared_id })
+    client.post("/notes/bulk", json={ "notes": [{ "header": f"Note {i}", "text": "text", "tags": "tag" }
+                                                for i in range(3)] })
+    note_ids = list(map(int, client.get("/notes/", params={ "fields": "header" }).json()["notes"]))
+    note_ids.remove(shared_id)
+
+    with get_connection() as conn:  # Purge was stopped right after users were deleted
+        conn.execute("DELETE FROM users WHERE id = ?", (user["id"],))
+        conn.commit()
+
+    _, victim = make_user()
+    assert purge(admin, f"/admin/delete-user/{victim['id']}")["status"] == "done"
+
+    assert count_rows(user["id"], note_ids) == { "users": 0, "statistics": 0, "notes": 0, "accesses": 0,
+                                                 "note_tags": 0, "notes_search": 0 }
+    assert count_rows(other_user["id"], [shared_id])["notes"] == 1
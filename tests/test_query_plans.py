@@ -0,0 +1,19 @@
+import pytest
+
+from database.general import get_connection
+from database.migrations import HOT_QUERIES, check_query_plans, hot_query
+
+
+def test_hot_queries_use_indexes(app):
+    assert "get_note_by_id" in HOT_QUERIES  # Registered by DAO modules
+
+    check_query_plans(get_connection())
+
+
+def test_full_scan_of_full_text_index_is_found(app):
+    hot_query("test full scan", "DELETE FROM notes_search WHERE user_id = ?")
+    try:
+        with pytest.raises(RuntimeError, match="test full scan"):
+            check_query_plans(get_connection())
+    finally:
+        HOT_QUERIES.pop("test full scan")
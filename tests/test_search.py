@@ -0,0 +1,45 @@
+def add_note(client, header: str, text: str) -> int:
+    client.post("/notes/create", json={ "header": header, "text": text, "tags": None })
+
+    return max(map(int, client.get("/notes/").json()["notes"]))
+
+
+def search(client, q: str) -> dict:
+    response = client.get("/notes/search", params={ "q": q })
+    assert response.status_code == 200, response.text
+
+    return response.json().get("notes", {})
+
+
+def test_search_finds_notes_with_all_words_header_first(make_user):
+    client, _ = make_user()
+    in_content = add_note(client, "Shopping", "Buy milk and BREAD")
+    in_header = add_note(client, "Bread recipe", "Flour, water, milk")
+    add_note(client, "Other", "Nothing here")
+
+    assert list(map(int, search(client, "bread"))) == [in_header, in_content]
+    assert list(map(int, search(client, "milk Bread"))) == [in_header, in_content]
+    assert list(map(int, search(client, "bread flour"))) == [in_header]
+    assert search(client, "bread butter") == {}
+    assert search(client, "bread")[str(in_content)]["content"] == "Buy milk and BREAD"
+
+
+def test_search_doesnt_find_notes_of_other_users(make_user):
+    client, _ = make_user()
+    other, _ = make_user()
+    add_note(other, "Secret plans", "words")
+
+    assert search(client, "secret") == {}
+    assert client.get("/notes/search", params={ "q": "!!!" }).status_code == 400  # No words
+
+
+def test_edited_note_is_found_by_new_words(make_user):
+    client, _ = make_user()
+    note_id = add_note(client, "Draft", "old words")
+
+    response = client.put(f"/notes/edit-note/{note_id}", json={ "id": note_id, "header": "Final", "text": "new words",
+                                                                "tags": None })
+    assert response.status_code == 200, response.text
+
+    assert search(client, "old") == {}
+    assert list(map(int, search(client, "final new"))) == [note_id]
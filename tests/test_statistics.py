@@ -0,0 +1,45 @@
+import sqlite3
+from contextlib import contextmanager
+
+from database import statistics
+from database.general import get_connection
+
+
+def stored(user_id: int) -> tuple[int, int, int]:
+    with get_connection() as conn:
+        return conn.execute("SELECT count_creating_note, count_reading_note, count_deleting_note FROM statistics "
+                            "WHERE user_id = ?", (user_id,)).fetchone()
+
+
+def test_pending_counters_are_shown_then_written_once(make_user):
+    client, user = make_user()
+    statistics.increment(user["id"], created=2, read=3)
+    statistics.increment(user["id"], deleted=1)
+
+    expected = { "created": 2, "read": 3, "deleted": 1 }
+    assert client.get("/users/statistics").json()["statistics"] == expected  # Before or after flush
+
+    statistics.flush()
+    assert statistics.get_pending(user["id"]) == [0, 0, 0]
+    assert stored(user["id"]) == (2, 3, 1)
+    assert client.get("/users/statistics").json()["statistics"] == expected
+
+
+def test_counters_of_failed_flush_are_written_next_time(make_user, monkeypatch):
+    client, user = make_user()
+
+    @contextmanager
+    def locked():
+        raise sqlite3.OperationalError("database is locked")
+        yield
+
+    monkeypatch.setattr(statistics, "get_connection", locked)
+    statistics.increment(user["id"], created=1)
+    statistics.flush()
+
+    assert statistics.get_pending(user["id"]) == [1, 0, 0]
+    assert stored(user["id"]) == (0, 0, 0)
+
+    monkeypatch.undo()
+    statistics.flush()
+    assert stored(user["id"]) == (1, 0, 0)
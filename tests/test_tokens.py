@@ -0,0 +1,18 @@
+import threading
+
+from secure import tokens
+
+
+def test_user_is_loaded_in_db_thread(make_user, monkeypatch):
+    client, user = make_user()
+    threads = []
+
+    def get_auth_user(username):
+        threads.append(threading.current_thread().name)
+        return { "id": user["id"], "username": username, "email": user["email"], "is_admin": False }
+
+    monkeypatch.setattr(tokens, "get_auth_user", get_auth_user)
+
+    assert client.get("/users/statistics").status_code == 200
+    assert client.get("/admin/purge/unknown").status_code == 403
+    assert len(threads) == 2 and all(name.startswith("db") for name in threads)
@@ -0,0 +1,137 @@
+import base64
+
+from cipher.decrypting import (decrypt_wrapped_key, forget_aes_keys, forget_private_key, is_x25519_wrap,
+                               load_wrapped_key)
+from cipher.encrypting import encrypt_aes_key
+from cipher.executor import upgrade_executor
+from cipher.keystore import keystore, x25519_key_name
+from database.general import get_connection
+from database.users import get_public_keys, has_old_wraps
+from routers.users import UPGRADE_BATCH
+from tests.conftest import login
+
+
+def wrap_by_rsa(user: dict) -> None:
+    """
+    Rewrap all keys of user by RSA (base64 in notes as before envelopes, raw in accesses)
+    """
+
+    with get_connection() as conn:
+        for table, id_column, user_column in (("notes", "id", "from_user_id"), ("accesses", "note_id", "user_id")):
+            rows = conn.execute(f"SELECT {id_column}, {'aes_key' if table == 'notes' else 'key'} FROM {table} "
+                                f"WHERE {user_column} = ?", (user["id"],)).fetchall()
+            for row_id, key in rows:
+                rsa_key = encrypt_aes_key(get_public_keys(user["id"])["rsa"],
+                                          decrypt_wrapped_key(user["username"], load_wrapped_key(key)))
+                conn.execute(f"UPDATE {table} SET {'aes_key' if table == 'notes' else 'key'} = ? "
+                             f"WHERE {id_column} = ? AND {user_column} = ?",
+                             (base64.b64encode(rsa_key).decode() if table == "notes" else rsa_key, row_id, user["id"]))
+        conn.commit()
+
+    forget_aes_keys()
+
+
+def wait_upgrades() -> None:
+    upgrade_executor.submit(lambda: None).result()  # Jobs are run one by one
+
+
+def wrapped_keys(user: dict) -> list[bytes]:
+    with get_connection() as conn:
+        rows = conn.execute("SELECT aes_key FROM notes WHERE from_user_id = ?", (user["id"],)).fetchall()
+        rows += conn.execute("SELECT key FROM accesses WHERE user_id = ?", (user["id"],)).fetchall()
+
+    return [load_wrapped_key(row[0]) for row in rows]
+
+
+def test_login_rewraps_rsa_keys(make_user):
+    owner, owner_user = make_user()
+    client, user = make_user()
+    for i in range(UPGRADE_BATCH + 3):  # More than one batch
+        client.post("/notes/create", json={ "header": f"Note {i}", "text": "text", "tags": None })
+    owner.post("/notes/create", json={ "header": "Shared", "text": "text", "tags": None })
+    shared_id = max(map(int, owner.get("/notes/").json()["notes"]))
+    owner.post("/accesses/set-permission", json={ "user_id": user["id"], "note_id": shared_id })
+
+    wrap_by_rsa(user)
+    assert has_old_wraps(user["id"])
+    assert not any(is_x25519_wrap(key) for key in wrapped_keys(user))
+
+    login(client, user["username"])
+    wait_upgrades()
+
+    assert not has_old_wraps(user["id"])
+    assert all(is_x25519_wrap(key) for key in wrapped_keys(user))
+    notes = client.get("/notes/", params={ "limit": 100 }).json()["notes"]
+    assert all("error" not in note for note in notes.values())
+    assert client.get(f"/notes/{shared_id}").json()["note"]["header"] == "Shared"
+
+
+def test_login_generates_x25519_key_for_old_user(make_user):
+    client, user = make_user()
+    client.post("/notes/create", json={ "header": "Old user", "text": "text", "tags": None })
+    wrap_by_rsa(user)
+
+    with get_connection() as conn:
+        conn.execute("UPDATE users SET x25519_public_key = NULL WHERE id = ?", (user["id"],))
+        conn.commit()
+    keystore.delete_key(x25519_key_name(user["username"]))
+    forget_private_key(user["username"])  # User created before X25519 scheme has never had this key
+
+    login(client, user["username"])
+    wait_upgrades()
+
+    with get_connection() as conn:
+        public_key = conn.execute("SELECT x25519_public_key FROM users WHERE id = ?", (user["id"],)).fetchone()[0]
+
+    assert public_key
+    assert all(is_x25519_wrap(key) for key in wrapped_keys(user))
+    assert next(iter(client.get("/notes/").json()["notes"].values()))["header"] == "Old user"
+
+
+def test_key_generated_by_other_process_is_kept(make_user, monkeypatch):
+    from routers import users
+    from cipher.generate import new_x25519_keys
+    from database.users import claim_x25519_public_key
+
+    client, user = make_user()
+    client.post("/notes/create", json={ "header": "Old user", "text": "text", "tags": None })
+    wrap_by_rsa(user)
+
+    with get_connection() as conn:
+        conn.execute("UPDATE users SET x25519_public_key = NULL WHERE id = ?", (user["id"],))
+        conn.commit()
+    keystore.delete_key(x25519_key_name(user["username"]))
+    forget_private_key(user["username"])
+
+    other_pem, other_public = new_x25519_keys()
+
+    def racing():  # Other process sets its keys while this one generates own keys
+        assert claim_x25519_public_key(user["id"], other_public)
+        keystore.put_key(x25519_key_name(user["username"]), other_pem)
+        return new_x25519_keys()
+
+    monkeypatch.setattr(users, "new_x25519_keys", racing)
+    login(client, user["username"])
+    wait_upgrades()
+
+    with get_connection() as conn:
+        public_key = conn.execute("SELECT x25519_public_key FROM users WHERE id = ?", (user["id"],)).fetchone()[0]
+
+    assert public_key == other_public
+    assert keystore.get_key(x25519_key_name(user["username"])) == other_pem
+    assert all(is_x25519_wrap(key) for key in wrapped_keys(user))
+    assert next(iter(client.get("/notes/").json()["notes"].values()))["content"] == "text"
+
+
+def test_login_without_old_wraps_doesnt_queue_upgrade(make_user, monkeypatch):
+    from routers import users
+
+    client, user = make_user()
+    client.post("/notes/create", json={ "header": "New", "text": "text", "tags": None })
+    wait_upgrades()
+
+    submitted = []
+    monkeypatch.setattr(users.upgrade_executor, "submit", lambda *args: submitted.append(args))
+    login(client, user["username"])
+
+    assert submitted == []